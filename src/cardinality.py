@@ -0,0 +1,172 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Incremental series cardinality analysis of Prometheus text and OpenMetrics expositions."""
+
+import collections
+import math
+import re
+import typing
+
+# Suffixes of the samples making up histogram, summary, counter and info families
+_FAMILY_SUFFIXES = ("_bucket", "_count", "_sum", "_total", "_created", "_info", "_gcount", "_gsum")
+_LABEL_PAIR = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"')
+
+
+class ExpositionAnalyzer:
+    """Count series per metric family and distinct values per label key, one chunk at a time.
+
+    Only complete lines are parsed; a partial line is carried over to the next chunk, so the
+    exposition body is never held in memory. Distinct values are tracked up to
+    `max_tracked_values` per label key, which bounds memory for unbounded label values.
+    """
+
+    def __init__(self, max_tracked_values: int = 10000):
+        self.max_tracked_values = max_tracked_values
+        self.series = 0
+        self.families: typing.Counter[str] = collections.Counter()
+        self.label_values: typing.Dict[str, typing.Set[str]] = {}
+        self.saturated_labels: typing.Set[str] = set()
+        self.max_labels = 0
+        self.max_label_name_length = 0
+        self.max_label_value_length = 0
+        self._types: typing.Dict[str, str] = {}
+        self._family_of: typing.Dict[str, str] = {}
+        self._partial = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse all complete lines in `chunk`, keeping any trailing partial line."""
+        data = self._partial + chunk
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+        for line in data[:end].decode("utf-8", "replace").split("\n"):
+            self._parse_line(line)
+
+    def close(self) -> None:
+        """Parse whatever is left once the body has ended."""
+        if self._partial:
+            self._parse_line(self._partial.decode("utf-8", "replace"))
+            self._partial = b""
+
+    def _parse_line(self, line: str) -> None:
+        if not line or line.isspace():
+            return
+        if line[0] == "#":
+            parts = line.split(None, 3)
+            if len(parts) == 4 and parts[1] == "TYPE":
+                self._types[parts[2]] = parts[3].strip()
+                self._family_of.clear()
+            return
+
+        brace = line.find("{")
+        space = line.find(" ")
+        if brace == -1 or -1 < space < brace:
+            name = line[:space] if space != -1 else line
+            labels = ()
+        else:
+            name = line[:brace]
+            # drop OpenMetrics exemplars, which carry their own label set
+            exemplar = line.find(" # ")
+            sample = line if exemplar == -1 else line[:exemplar]
+            labels = _LABEL_PAIR.findall(sample, brace, sample.rfind("}"))
+
+        self.series += 1
+        if (family := self._family_of.get(name)) is None:
+            family = self._family_of[name] = self._family(name)
+        self.families[family] += 1
+        self._count_labels(labels)
+
+    def _count_labels(self, labels: typing.Sequence[typing.Tuple[str, str]]) -> None:
+        if len(labels) > self.max_labels:
+            self.max_labels = len(labels)
+        for key, value in labels:
+            if len(key) > self.max_label_name_length:
+                self.max_label_name_length = len(key)
+            if len(value) > self.max_label_value_length:
+                self.max_label_value_length = len(value)
+            if key in self.saturated_labels:
+                continue
+            values = self.label_values.setdefault(key, set())
+            values.add(value)
+            if len(values) >= self.max_tracked_values:
+                self.saturated_labels.add(key)
+
+    def _family(self, name: str) -> str:
+        if name in self._types:
+            return name
+        for suffix in _FAMILY_SUFFIXES:
+            if name.endswith(suffix) and name[: -len(suffix)] in self._types:
+                return name[: -len(suffix)]
+        return name
+
+    def top_families(self, count: int = 10) -> typing.List[typing.Tuple[str, int]]:
+        """The metric families with the most series."""
+        return self.families.most_common(count)
+
+    def top_labels(self, count: int = 10) -> typing.List[typing.Tuple[str, int]]:
+        """The label keys with the most distinct values (capped at `max_tracked_values`)."""
+        cardinality = ((key, len(values)) for key, values in self.label_values.items())
+        return sorted(cardinality, key=lambda item: item[1], reverse=True)[:count]
+
+    def report(self, top: int = 10, drop_share: float = 0.2) -> dict:
+        """Summarise the analysis, with scrape limit and drop rule recommendations.
+
+        Args:
+            top: number of families and label keys to list.
+            drop_share: a family holding at least this share of all series is suggested
+                for dropping.
+        """
+        return {
+            "series": self.series,
+            "families": len(self.families),
+            "top_families": dict(self.top_families(top)),
+            "top_labels": {
+                key: ">={}".format(n) if key in self.saturated_labels else n
+                for key, n in self.top_labels(top)
+            },
+            "recommended": recommend_limits([self]),
+            "drop_candidates": [
+                family
+                for family, series in self.families.most_common()
+                if self.series and series / self.series >= drop_share and series > 1
+            ],
+        }
+
+
+def _headroom(value: int, factor: float = 1.5) -> int:
+    """Round value * factor up to two significant digits."""
+    if value <= 0:
+        return 0
+    scaled = value * factor
+    magnitude = 10 ** max(int(math.log10(scaled)) - 1, 0)
+    return int(math.ceil(scaled / magnitude) * magnitude)
+
+
+def recommend_limits(analyzers: typing.Iterable[ExpositionAnalyzer]) -> dict:
+    """Recommend per-scrape limits that fit every analysed target, with headroom.
+
+    label_limit also accounts for the `job` and `instance` labels Prometheus adds on ingestion.
+    """
+    series = labels = name_length = value_length = 0
+    for analyzer in analyzers:
+        series = max(series, analyzer.series)
+        labels = max(labels, analyzer.max_labels)
+        name_length = max(name_length, analyzer.max_label_name_length)
+        value_length = max(value_length, analyzer.max_label_value_length)
+    return {
+        "sample_limit": _headroom(series),
+        "label_limit": _headroom(labels + 2),
+        "label_name_length_limit": _headroom(name_length),
+        "label_value_length_limit": _headroom(value_length),
+    }
+
+
+def drop_rules(families: typing.Iterable[str]) -> typing.List[dict]:
+    """Render metric_relabel_configs dropping the given metric families (and their samples)."""
+    if not (families := sorted(set(families))):
+        return []
+    regex = "({})({})?".format(
+        "|".join(re.escape(family) for family in families),
+        "|".join(_FAMILY_SUFFIXES),
+    )
+    return [{"source_labels": ["__name__"], "regex": regex, "action": "drop"}]
@@ -6,55 +6,669 @@
 
 """Prometheus Scrape Target Charm."""
 
+import os
+import sys
+
+import fastpath
+
+if __name__ == "__main__" and fastpath.handled(os.environ):
+    # nothing left to do: exit before importing the framework
+    sys.exit(0)
+
+import hashlib
+import itertools
 import json
 import logging
+import time
 import typing
-from urllib.parse import urlparse
+from pathlib import Path
 
-import yaml
-from ops.charm import CharmBase
+from ops.charm import ActionEvent, CharmBase, RelationBrokenEvent, RelationEvent
+from ops.framework import StoredState
 from ops.main import main
-from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
+from ops.model import ActiveStatus, BlockedStatus, ModelError, Relation, WaitingStatus
+
+from cardinality import ExpositionAnalyzer, drop_rules, recommend_limits
+from distribution import DISTRIBUTION_MODES, distribute, split_evenly
+from exporter import (
+    ProbeSuccess,
+    device_error,
+    exporter_of,
+    module_jobs,
+    parse_modules,
+    relabel_chain,
+)
+from federation import FEDERATE_PATH, FEDERATION_DEFAULTS, parse_selectors
+from health import QUARANTINE_MODES, count_failures, job_targets, quarantine, target_key
+from options import (
+    DEFAULT_SCRAPE_TIMEOUT,
+    SCRAPE_OPTIONS,
+    SCRAPE_PROTOCOLS,
+    dropped_keys,
+    parse_duration,
+    parse_protocols,
+    parse_size,
+    scrape_options,
+)
+from probe import ProbeResult, probe_jobs, split_host_port
+from protocols import cheapest, compare_protocols
+from relabel import drop_metrics_rule, split_patterns, validate_relabel_configs
+from resolve import (
+    Resolver,
+    is_ip_address,
+    join_address,
+    resolve_cached,
+    system_resolver,
+)
+from targets import (
+    TargetReport,
+    address_error,
+    group_by_labels,
+    iter_targets_file,
+    split_targets,
+    underscored_hostname,
+    validate_targets,
+)
+from telemetry import HookStats, recorded, status_message, summarize
+from tiers import Tier, parse_tiers, smoothed, tier_of, tiered
 
 logger = logging.getLogger(__name__)
 
 
-def _validated_address(address: str) -> str:
-    """Validate address using urllib.parse.urlparse.
+class YAMLError(ValueError):
+    """A config value is not valid YAML."""
+
 
-    Args:
-        address: must not include scheme.
+def _load_yaml(value: str) -> typing.Any:
+    """Safely load a YAML config value.
+
+    Raises:
+        YAMLError: if the value is not valid YAML.
     """
-    # Add '//' prefix per RFC 1808, if not already there
-    # This is needed by urlparse, https://docs.python.org/3/library/urllib.parse.html
-    if not address.startswith("//"):
-        address = "//" + address
-
-    parsed = urlparse(address)
-    if not parsed.netloc or any([parsed.scheme, parsed.path, parsed.params, parsed.query]):
-        logger.error("Invalid address : %s", address)
-        logger.error("Targets must be specified in host:port format")
-        return ""
-
-    # validate port
+    # imported here, as most hooks never parse YAML and the import is a large part of the
+    # start-up time of a hook
+    import yaml
+
+    # libyaml's loader is an order of magnitude faster on large `jobs` configs
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
     try:
-        # the port property would raise an exception if the port is invalid
-        _ = parsed.port
-        target = parsed.netloc
-    except ValueError:
-        logger.error("Invalid port for target: %s", parsed.netloc)
-        return ""
+        return yaml.load(value, Loader=loader)
+    except yaml.YAMLError as e:
+        raise YAMLError(str(e)) from e
+
+
+def _shard_index(target: str, shards: int) -> int:
+    """Deterministically assign a target to one of `shards` buckets.
+
+    Uses the same hashing scheme as Prometheus' `hashmod` relabel action (the low 64 bits of
+    the MD5 digest), so a target's shard only depends on the target itself: adding or removing
+    other targets never moves it.
+    """
+    digest = hashlib.md5(target.encode(), usedforsecurity=False).digest()
+    return int.from_bytes(digest[8:], "big") % shards
+
+
+def _blocked_message(errors: typing.List[str]) -> str:
+    """Summarise configuration errors as a status message, naming the offending options."""
+    options = sorted({error.split(":", 1)[0] for error in errors})
+    if len(options) > 3:
+        options[2:] = ["{} more".format(len(options) - 2)]
+    return "Invalid {}; see debug-logs".format(", ".join(options))
+
+
+# Safety cap on the number of addresses CIDR blocks and ranges may expand to, per job
+DEFAULT_MAX_EXPANDED_TARGETS = 65536
+
+# Number of jobs the federation selectors are split between, by default
+DEFAULT_FEDERATION_JOBS = 4
+
+# Bounds on the liveness checks run on update-status when health_check is set
+HEALTH_CHECK_CONCURRENCY = 100
+HEALTH_CHECK_TIMEOUT = 5.0
+# Longest a latency tier probe waits for a target; a target timing out counts as this slow
+TIER_PROBE_TIMEOUT = 30.0
+# Longest the health checks and latency tier probes of one update-status hook take together,
+# so that the hook ends in time however many targets there are; the targets left unprobed
+# keep their failure counts and measurements until a later hook
+UPDATE_STATUS_PROBE_TIME = 120.0
+
+# Options a `jobs` entry may set; they have the same meaning as the charm config options.
+JOB_OPTIONS = (
+    "job_name",
+    "targets",
+    "labels",
+    "metrics_path",
+    "scheme",
+    "params",
+    "basic_auth",
+    "tls_config_key_file",
+    "tls_config_cert_file",
+    "tls_config_server_name",
+    "tls_config_ca_file",
+    "tls_config_insecure_skip_verify",
+    "relabel_configs",
+    "metric_relabel_configs",
+    "drop_metrics",
+    "shards",
+    "max_expanded_targets",
+    "resolve_hostnames",
+    "federation_selectors",
+    "federation_jobs",
+    "exporter_address",
+    "exporter_modules",
+    *SCRAPE_OPTIONS,
+)
+
+
+def _check_job_spec(spec: dict) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Check the required fields of a `jobs` entry.
+
+    Returns:
+        The entry's unvalidated targets, and the problems found.
+    """
+    errors = []
+    if unknown := set(spec) - set(JOB_OPTIONS):
+        errors.append("options: unknown {}".format(", ".join(sorted(unknown))))
+    if not ((name := spec.get("job_name")) and isinstance(name, str)):
+        errors.append("job_name: required")
+
+    targets = spec.get("targets")
+    if targets and isinstance(targets, str):
+        return list(split_targets(targets)), errors
+    if targets and isinstance(targets, list):
+        return [str(target) for target in targets], errors
+    if targets:
+        errors.append("targets: must be a list or a comma separated string")
+    else:
+        errors.append("targets: required")
+    return [], errors
+
+
+def _sharded(job: typing.Dict[str, typing.Any], targets: dict, labels: dict, shards: int) -> list:
+    """Split a job into `shards` jobs, each scraping a stable subset of the targets."""
+    if shards == 1:
+        return [dict(job, static_configs=group_by_labels(targets, labels))]
+
+    buckets = [{} for _ in range(shards)]
+    for address, target_labels in targets.items():
+        buckets[_shard_index(address, shards)][address] = target_labels
+
+    jobs = []
+    for index, bucket in enumerate(buckets):
+        if not bucket:
+            continue
+        shard = dict(job, job_name="{}_shard{}".format(job["job_name"], index))
+        shard["static_configs"] = group_by_labels(bucket, labels)
+        jobs.append(shard)
+    return jobs
+
+
+# Selector groups of a federation job spec, as (group index, selectors) pairs
+FederationGroups = typing.Tuple[typing.Tuple[int, typing.Tuple[str, ...]], ...]
+
+
+def _federation(
+    spec: typing.Mapping[str, typing.Any], params: typing.Mapping[str, typing.Any]
+) -> typing.Tuple[FederationGroups, typing.List[str]]:
+    """Split the `federation_selectors` of a job spec into groups, one per federation job.
+
+    The selectors are split by rendezvous hashing, so that the pulls run in parallel and the
+    groups differ in size by at most one selector; adding or removing a selector moves few
+    of the others, but usually changes more than one group, and so more than one job.
+    """
+    selectors, selector_errors = parse_selectors(spec["federation_selectors"])
+    errors = ["federation_selectors: {}".format(error) for error in selector_errors]
+    count = spec.get("federation_jobs", DEFAULT_FEDERATION_JOBS)
+    if isinstance(count, bool) or not isinstance(count, int) or count < 1:
+        errors.append("federation_jobs: must be a positive integer")
+    if "match[]" in params:
+        errors.append("params: match[] is set from federation_selectors")
+    if errors:
+        return (), errors
+
+    groups = split_evenly(selectors, [str(index) for index in range(count)])
+    return tuple(
+        (int(index), tuple(sorted(group))) for index, group in groups.items() if group
+    ), []
+
+
+def _federated(jobs: list, groups: FederationGroups) -> list:
+    """Turn jobs into federation jobs, one per group of selectors."""
+    federated = []
+    for job in jobs:
+        for index, group in groups:
+            name = job["job_name"]
+            if len(groups) > 1:
+                name = "{}_federate{}".format(name, index)
+            params = {**job.get("params", {}), "match[]": list(group)}
+            federated.append(dict(job, job_name=name, params=params))
+    return federated
+
+
+def _exporter(
+    spec: typing.Mapping[str, typing.Any], job: typing.Dict[str, typing.Any]
+) -> typing.Tuple[typing.Tuple[str, ...], typing.List[str]]:
+    """Scrape the targets of a job through the multi-target exporter at `exporter_address`.
+
+    The relabel chain goes before the job's own relabel_configs, so that those see the device
+    as the instance label.
+
+    Returns:
+        The exporter modules, one job each, and the problems found.
+    """
+    errors = []
+    exporter = str(spec["exporter_address"])
+    if reason := address_error(exporter):
+        errors.append("exporter_address: {}".format(reason))
+    job["relabel_configs"] = relabel_chain(exporter) + job.get("relabel_configs", [])
+
+    modules: typing.List[str] = []
+    if value := spec.get("exporter_modules"):
+        modules, module_errors = parse_modules(value)
+        errors.extend("exporter_modules: {}".format(error) for error in module_errors)
+        if "module" in job.get("params", {}):
+            errors.append("params: module is set from exporter_modules")
+    return tuple(modules), errors
+
+
+def _max_expanded(spec: typing.Mapping[str, typing.Any]) -> int:
+    """The expansion cap of a job spec; invalid values are reported by _render_job."""
+    value = spec.get("max_expanded_targets")
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return DEFAULT_MAX_EXPANDED_TARGETS
+    return value
+
+
+def _devices(spec: typing.Mapping[str, typing.Any]) -> bool:
+    """Whether the targets of a job spec are devices scraped through a multi-target exporter."""
+    return bool(spec.get("exporter_address"))
+
+
+def _time_left(deadline: float) -> float:
+    """Seconds until a time.monotonic() deadline, or 0 if it has passed."""
+    return max(deadline - time.monotonic(), 0.0)
+
+
+def _target_errors(report: TargetReport) -> typing.List[str]:
+    """Describe the invalid entries of a validated target list, and log the duplicates."""
+    if report.duplicates:
+        logger.warning(
+            "Ignoring %d duplicate target(s): %s",
+            len(report.duplicates),
+            _abridged(report.duplicates),
+        )
+    if report.error:
+        return ["targets: {}".format(report.error)]
+    if report.invalid:
+        invalid = ", ".join(
+            "{} ({})".format(entry, reason) for entry, reason in report.invalid.items()
+        )
+        return [
+            "targets: {} invalid target(s): {}; use host:port format".format(
+                len(report.invalid), invalid
+            )
+        ]
+    return []
+
+
+def _abridged(items: typing.List[str], limit: int = 20) -> str:
+    """Join items for a log message, eliding all but the first `limit`."""
+    if len(items) <= limit:
+        return ", ".join(items)
+    return "{}, and {} more".format(", ".join(items[:limit]), len(items) - limit)
+
+
+def _parse_remote_targets(
+    data: typing.Mapping[str, str], max_expanded: int, devices: bool = False
+) -> dict:
+    """Validate the targets a remote application published on the scrape-targets relation.
+
+    The application databag holds `targets`, a JSON list of target entries in the same syntax
+    as the `targets` option, and optionally `labels`, a JSON mapping applied to all of them.
+    They are merged into the config job, so they are checked as its devices when it scrapes
+    through a multi-target exporter, as the `targets` option is.
+
+    Returns:
+        The valid targets with their labels, and the error if the data is invalid, in which
+        case none of the application's targets are used.
+    """
+    entry: typing.Dict[str, typing.Any] = {
+        "targets": {},
+        "error": "",
+        "max_expanded": max_expanded,
+        "devices": devices,
+    }
+    try:
+        entries = json.loads(data.get("targets", "[]"))
+        labels = json.loads(data.get("labels", "{}"))
+    except json.JSONDecodeError as e:
+        entry["error"] = "invalid JSON: {}".format(e)
+        return entry
+    if not isinstance(entries, list) or not all(isinstance(item, str) for item in entries):
+        entry["error"] = "targets must be a list of strings"
+        return entry
+    if not isinstance(labels, dict):
+        entry["error"] = "labels must be a mapping"
+        return entry
+
+    report = validate_targets(
+        entries, max_expanded, address_check=device_error if devices else None
+    )
+    if errors := _target_errors(report):
+        entry["error"] = "; ".join(errors)
+        return entry
+    common = {str(key): str(value) for key, value in labels.items()}
+    entry["targets"] = {
+        address: {**common, **target_labels} for address, target_labels in report.targets.items()
+    }
+    return entry
+
+
+def _digest(*parts: typing.Union[str, Path]) -> str:
+    """Content hash of strings and files, read in blocks."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, Path):
+            with part.open("rb") as file:
+                while block := file.read(1 << 20):
+                    digest.update(block)
+        else:
+            digest.update(part.encode())
+        # keep ("ab", "c") and ("a", "bc") apart
+        digest.update(b"\0")
+    return digest.hexdigest()
+
 
-    return target
+def _slices(jobs: list, members: typing.List[str]) -> typing.Dict[str, list]:
+    """The share of the jobs' targets each unit probes, by unit name."""
+    return distribute(jobs, members) if len(members) > 1 else {members[0]: jobs}
+
+
+def _parse_labels(all_labels: typing.Any) -> typing.Tuple[dict, typing.List[str]]:
+    """Parse the common labels: a mapping, or comma separated key:value pairs."""
+    if not all_labels:
+        return {}, []
+    if isinstance(all_labels, dict):
+        return {str(key): str(value) for key, value in all_labels.items()}, []
+
+    labels = {}
+    invalid_labels = []
+    for label in str(all_labels).split(","):
+        try:
+            key, value = label.split(":")
+        except ValueError:
+            invalid_labels.append(label)
+            continue
+
+        if key and value:
+            labels[key] = value
+        else:
+            invalid_labels.append(f"{key}:{value}")
+
+    if invalid_labels:
+        return {}, ["labels: invalid labels {}; use key:value format".format(invalid_labels)]
+    return labels, []
+
+
+def _params_error(params: typing.Any) -> str:
+    """Why URL parameters are invalid; empty if they map names to lists of values."""
+    if not isinstance(params, dict):
+        return "must be a mapping"
+    for name, values in params.items():
+        if not isinstance(name, str):
+            return "parameter names must be strings"
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            return "{} must be a list of strings".format(name)
+    return ""
+
+
+def _relabel_configs(
+    spec: typing.Mapping[str, typing.Any],
+) -> typing.Tuple[dict, typing.List[str]]:
+    """Validated relabel_configs and metric_relabel_configs for a job."""
+    configs = {}
+    errors = []
+    for option in ("relabel_configs", "metric_relabel_configs"):
+        if not (value := spec.get(option)):
+            continue
+        try:
+            rules = _load_yaml(value) if isinstance(value, str) else value
+        except YAMLError as e:
+            errors.append("{}: invalid YAML: {}".format(option, e))
+            continue
+        if option_errors := validate_relabel_configs(rules):
+            errors.extend("{}: {}".format(option, error) for error in option_errors)
+        else:
+            configs[option] = rules
+
+    if drop_metrics := spec.get("drop_metrics"):
+        try:
+            rule = drop_metrics_rule(split_patterns(str(drop_metrics)))
+        except ValueError as e:
+            errors.append("drop_metrics: {}".format(e))
+        else:
+            if rule:
+                # drop first, so later rules are not evaluated for dropped series
+                configs["metric_relabel_configs"] = [
+                    rule,
+                    *configs.get("metric_relabel_configs", []),
+                ]
+    return configs, errors
+
+
+class JobModel(typing.NamedTuple):
+    """The parsed and validated options of a job spec, i.e. everything but its targets.
+
+    Made of immutable JSON types only, so that it can be memoized in StoredState and only
+    rebuilt when the options it derives from change.
+    """
+
+    # JSON of the job fields, without job_name and static_configs
+    fields: str
+    labels: typing.Tuple[typing.Tuple[str, str], ...] = ()
+    shards: int = 1
+    federation: typing.Optional[FederationGroups] = None
+    errors: typing.Tuple[str, ...] = ()
+    # exporter modules, one job each, when scraping devices through a multi-target exporter
+    modules: typing.Tuple[str, ...] = ()
+
+    @classmethod
+    def from_stored(cls, value: typing.Sequence[typing.Any]) -> "JobModel":
+        """Rebuild a model from its StoredState form, where tuples became lists."""
+        fields, labels, shards, federation, errors, modules = value
+        return cls(
+            fields,
+            tuple((key, label) for key, label in labels),
+            shards,
+            None
+            if federation is None
+            else tuple((index, tuple(group)) for index, group in federation),
+            tuple(errors),
+            tuple(modules),
+        )
+
+    def to_stored(self) -> list:
+        """The model as nested lists, which StoredState can hold."""
+        return [
+            self.fields,
+            [list(label) for label in self.labels],
+            self.shards,
+            None
+            if self.federation is None
+            else [[index, list(group)] for index, group in self.federation],
+            list(self.errors),
+            list(self.modules),
+        ]
+
+
+# Options a JobModel derives from; the targets are validated, and resolved, separately
+MODEL_OPTIONS = tuple(
+    option for option in JOB_OPTIONS if option not in ("job_name", "targets", "resolve_hostnames")
+)
+
+
+def _model_digest(spec: typing.Mapping[str, typing.Any]) -> str:
+    """Content hash of the options of a job spec that its JobModel derives from."""
+    options = {option: spec[option] for option in MODEL_OPTIONS if option in spec}
+    return _digest(json.dumps(options, sort_keys=True, default=str))
+
+
+def _parse_job_spec(spec: typing.Mapping[str, typing.Any]) -> JobModel:  # noqa: C901
+    """Parse and validate the options of one job spec: the charm config, or a `jobs` entry."""
+    errors = []
+    job: typing.Dict[str, typing.Any] = {}
+
+    for option in (
+        "metrics_path",  # prom's built-in default: [ metrics_path: <path> | default = /metrics ]
+        "scheme",
+    ):
+        if value := spec.get(option):
+            if isinstance(value, str):
+                job.update({option: value})
+            else:
+                errors.append("{}: must be a string".format(option))
+
+    if params := spec.get("params"):
+        try:
+            val = _load_yaml(params) if isinstance(params, str) else params
+        except YAMLError as e:
+            errors.append("params: invalid YAML: {}".format(e))
+        else:
+            if error := _params_error(val):
+                errors.append("params: {}".format(error))
+            else:
+                job.update({"params": val})
+
+    tls_config = {}
+
+    for option, field in (
+        ("tls_config_cert_file", "cert_file"),
+        ("tls_config_key_file", "key_file"),
+        ("tls_config_server_name", "server_name"),
+        ("tls_config_ca_file", "ca_file"),
+    ):
+        if value := spec.get(option):
+            if isinstance(value, str):
+                tls_config.update({field: value})
+            else:
+                errors.append("{}: must be a string".format(option))
+    if insecure_skip_verify := spec.get("tls_config_insecure_skip_verify"):
+        if isinstance(insecure_skip_verify, bool):
+            tls_config.update({"insecure_skip_verify": insecure_skip_verify})
+        else:
+            errors.append("tls_config_insecure_skip_verify: must be true or false")
+
+    if tls_config:
+        job.update({"tls_config": tls_config})
+
+    if basic_auth := spec.get("basic_auth"):
+        try:
+            if not isinstance(basic_auth, str):
+                raise ValueError(basic_auth)
+            username, password = basic_auth.split(":")
+        except ValueError:
+            errors.append("basic_auth: use `user:password` format")
+        else:
+            job.update({"basic_auth": {"username": username, "password": password}})
+
+    options, option_errors = scrape_options(spec)
+    errors.extend(option_errors)
+    job.update(options)
+
+    relabel_configs, relabel_errors = _relabel_configs(spec)
+    errors.extend(relabel_errors)
+    job.update(relabel_configs)
+
+    labels, label_errors = _parse_labels(spec.get("labels"))
+    errors.extend(label_errors)
+
+    max_expanded = spec.get("max_expanded_targets", DEFAULT_MAX_EXPANDED_TARGETS)
+    if isinstance(max_expanded, bool) or not isinstance(max_expanded, int) or max_expanded < 0:
+        errors.append("max_expanded_targets: must be a non-negative integer")
+
+    shards = spec.get("shards", 1)
+    if isinstance(shards, bool) or not isinstance(shards, int) or shards < 1:
+        errors.append("shards: must be a positive integer")
+        shards = 1
+
+    modules: typing.Tuple[str, ...] = ()
+    if spec.get("exporter_address"):
+        modules, exporter_errors = _exporter(spec, job)
+        errors.extend(exporter_errors)
+    elif spec.get("exporter_modules"):
+        errors.append("exporter_modules: requires exporter_address")
+
+    federation = None
+    if spec.get("federation_selectors"):
+        federation, federation_errors = _federation(spec, job.get("params", {}))
+        errors.extend(federation_errors)
+        # the defaults only apply together, so that the timeout never exceeds the interval
+        defaults = FEDERATION_DEFAULTS
+        if any(spec.get(option) for option in FEDERATION_DEFAULTS):
+            defaults = {}
+        job = {"metrics_path": FEDERATE_PATH, **defaults, **job, "honor_labels": True}
+
+    return JobModel(
+        json.dumps(job, sort_keys=True),
+        tuple(labels.items()),
+        shards,
+        federation,
+        tuple(errors),
+        modules,
+    )
 
 
 class PrometheusScrapeTargetCharm(CharmBase):
     """Prometheus Scrape Target Charm."""
 
+    _stored = StoredState()
+
     def __init__(self, *args):
         super().__init__(*args)
+        # Content hash of the last scrape_jobs payload published to each relation, so that
+        # unchanged payloads are not rewritten (every write triggers relation-changed remotely).
+        self._stored.set_default(published_digests={}, relation_writes=0, skipped_writes=0)
+        # Content hashes of the target lists found valid, so that unchanged lists are not
+        # validated again on every hook.
+        self._stored.set_default(valid_targets=[])
+        self._valid_targets: typing.List[str] = []
+        self._known_valid_targets: typing.Set[str] = set()
+        self._invalid_targets = 0
+        # Cost of the last hooks that rendered the scrape jobs, see the stats action
+        self._stored.set_default(hook_stats=[])
+        # Parsed job options, by content hash of the options they derive from, so that only
+        # the job specs whose options changed are parsed again.
+        self._stored.set_default(job_models={})
+        self._job_models: typing.Dict[str, JobModel] = {}
+        # Addresses of target hostnames, as host -> [address, expiry timestamp]; an empty
+        # address records a failed lookup.
+        self._stored.set_default(dns_cache={})
+        # Consecutive failed liveness checks per target key, when health_check is set
+        self._stored.set_default(health_failures={})
+        # Timestamp of the last health report counted from each unit, so that a report is
+        # only counted once however many hooks read it
+        self._stored.set_default(health_reports={})
+        # Smoothed [latency, body size] per target key, and the tier of each target that has
+        # one, when latency_tiers is set
+        self._stored.set_default(tier_costs={}, tier_membership={})
+        # Timestamp of the last tier report counted from each unit, as for health_reports
+        self._stored.set_default(tier_reports={})
+        self._dns_cache: typing.Dict[str, typing.List[typing.Any]] = {}
+        self._resolve_ttl = 0.0
+        # Whether the jobs being rendered resolve target hostnames, when their spec says so
+        self._resolving = True
+        # Looks up target hostnames when resolve_hostnames is set; tests replace it with a stub
+        self.resolver: Resolver = system_resolver
 
         self._prometheus_relation = "metrics-endpoint"
+        # Validated targets published by each remote application on the scrape-targets
+        # relation, so that a change from one application does not revalidate the others.
+        self._stored.set_default(remote_targets={}, remote_targets_synced=False)
+        self._remote_relation = "scrape-targets"
+        # Set while handling a scrape-targets event, which only changes that one application
+        self._remote_targets_event = False
+        # Peer relation over which the units share out the health checks
+        self._workers_relation = "workers"
 
         # handle changes in relation with Prometheus
         self.framework.observe(
@@ -66,6 +680,14 @@ class PrometheusScrapeTargetCharm(CharmBase):
 
         # handle changes in external scrape targets
         self.framework.observe(self.on.config_changed, self._update_prometheus_jobs)
+        self.framework.observe(
+            self.on[self._remote_relation].relation_changed, self._on_remote_targets_changed
+        )
+        self.framework.observe(
+            self.on[self._remote_relation].relation_broken, self._on_remote_targets_changed
+        )
+        # attaching a new targets-file resource triggers upgrade-charm
+        self.framework.observe(self.on.upgrade_charm, self._on_upgrade_charm)
 
         # Sometimes a `stop` event is followed by a `start` event with nothing in between
         # https://bugs.launchpad.net/juju/+bug/2015566
@@ -73,130 +695,1029 @@ class PrometheusScrapeTargetCharm(CharmBase):
 
         # One time charm setup
         self.framework.observe(self.on.install, self._on_install)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
+
+        # refresh expired hostname resolutions
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(
+            self.on[self._workers_relation].relation_changed, self._on_workers_changed
+        )
+        self.framework.observe(
+            self.on[self._workers_relation].relation_departed, self._on_workers_changed
+        )
+
+        self.framework.observe(self.on.probe_targets_action, self._on_probe_targets_action)
+        self.framework.observe(
+            self.on.analyze_cardinality_action, self._on_analyze_cardinality_action
+        )
+        self.framework.observe(self.on.compare_protocols_action, self._on_compare_protocols_action)
+        self.framework.observe(self.on.stats_action, self._on_stats_action)
 
     def _on_install(self, _) -> None:
-        """Initial charm setup."""
+        """Initial charm setup; see fastpath, which handles install without the framework."""
         self.unit.set_workload_version("n/a")
 
-    def _update_prometheus_jobs(self, _):
-        """Setup Prometheus scrape configuration for external targets."""
+    def _on_leader_elected(self, event) -> None:
+        """Forget the remote targets stored while last leading, and publish as the new leader.
+
+        Followers skip relation-changed hooks (see fastpath), so they may not have dropped
+        the remote targets on losing leadership; they may have changed since.
+        """
+        self._stored.remote_targets = {}
+        self._stored.remote_targets_synced = False
+        # another leader may have published since; the databags no longer match the digests
+        self._stored.published_digests = {}
+        self._update_prometheus_jobs(event)
+
+    def _on_remote_targets_changed(self, event: RelationEvent) -> None:
+        """Revalidate the targets of the remote application that changed, and republish."""
+        if self.unit.is_leader() and (app := event.relation.app):
+            if isinstance(event, RelationBrokenEvent):
+                self._stored.remote_targets.pop(app.name, None)
+            else:
+                self._stored.remote_targets[app.name] = self._remote_targets_entry(
+                    app.name, event.relation
+                )
+        self._remote_targets_event = True
+        try:
+            self._update_prometheus_jobs(event)
+        finally:
+            self._remote_targets_event = False
+
+    def _remote_targets_entry(self, app_name: str, relation: Relation) -> dict:
+        """Read and validate the targets a remote application published."""
+        data = relation.data[relation.app] if relation.app else {}
+        entry = _parse_remote_targets(
+            data, _max_expanded(self.model.config), _devices(self.model.config)
+        )
+        if entry["error"]:
+            logger.error("Ignoring the targets published by %s: %s", app_name, entry["error"])
+        return entry
+
+    def _remote_targets(self) -> dict:
+        """Merge the targets published by remote applications, in application name order.
+
+        The stored entries are checked against the related applications once per leadership,
+        and then on every hook other than a scrape-targets relation event, so that handling
+        one application's change does not read every relation.
+        """
+        if self._stored.remote_targets_synced and self._remote_targets_event:
+            entries = dict(self._stored.remote_targets.items())
+        else:
+            entries = self._synced_remote_targets()
+
+        merged = {}
+        for name in sorted(entries):
+            for address, labels in entries[name]["targets"].items():
+                merged.setdefault(address, dict(labels))
+        return merged
+
+    def _synced_remote_targets(self) -> dict:
+        """Read the applications missing from StoredState, and forget the departed ones."""
+        max_expanded = _max_expanded(self.model.config)
+        devices = _devices(self.model.config)
+        stored = self._stored.remote_targets
+        entries = {}
+        for relation in self.model.relations[self._remote_relation]:
+            if not relation.app:
+                continue
+            name = relation.app.name
+            entry = stored.get(name)
+            # read again whenever the checks they passed change
+            if entry is None or (entry["max_expanded"], entry.get("devices")) != (
+                max_expanded,
+                devices,
+            ):
+                entry = stored[name] = self._remote_targets_entry(name, relation)
+            entries[name] = entry
+        for name in set(stored.keys()) - set(entries):
+            del stored[name]
+        if self.unit.is_leader():
+            self._stored.remote_targets_synced = True
+        return entries
+
+    def _on_update_status(self, event) -> None:
+        """Check target health and re-resolve expired hostnames, republishing on changes."""
+        changed = False
+        deadline = time.monotonic() + UPDATE_STATUS_PROBE_TIME
+        if self.model.config.get("health_check"):
+            changed = self._check_health(deadline)
+        if self.model.config.get("latency_tiers"):
+            changed = self._measure_tiers(deadline) or changed
         if not self.unit.is_leader():
-            self.unit.status = WaitingStatus("inactive unit")
+            self._stand_by()
+        elif changed or self._stored.dns_cache:
+            self._update_prometheus_jobs(event)
+
+    def _on_workers_changed(self, event) -> None:
+        """Count the reports of the other units, and reassign targets when one leaves."""
+        health_check = self.model.config.get("health_check")
+        tiers = self._latency_tiers()
+        if not self.unit.is_leader() or not (health_check or tiers):
             return
+        if not (jobs := self._scrape_jobs()):
+            return
+        members, digest = self._probe_assignment(jobs)
+        changed = bool(health_check) and self._count_health(jobs, members, digest, {})
+        if tiers:
+            changed = self._count_tiers(jobs, members, digest, tiers, {}) or changed
+        if changed:
+            self._update_prometheus_jobs(event)
 
-        jobs = self._scrape_jobs()
-        for relation in self.model.relations[self._prometheus_relation]:
-            relation.data[self.app]["scrape_jobs"] = json.dumps(jobs)
+    def _check_health(self, deadline: float) -> bool:
+        """Probe this unit's share of the targets once, and report the ones that are down.
+
+        The targets are split between the units by rendezvous hashing, so that each unit added
+        cuts the time every unit spends probing; the leader counts the consecutive failures
+        from all the units' reports.
+
+        Args:
+            deadline: time.monotonic() by which the probes stop; the targets not probed by
+                then are reported as such, and their counts kept.
+
+        Returns:
+            Whether the set of quarantined targets changed.
+        """
+        if not (jobs := self._scrape_jobs()):
+            return False
+        members, digest = self._probe_assignment(jobs)
+        if self.unit.name not in members:
+            return False
+        assigned = _slices(jobs, members)[self.unit.name]
+        down, unprobed = self._down(assigned, deadline)
+        report = {
+            "digest": digest,
+            "time": time.time(),
+            # only the failures, to keep the databag small
+            "down": down,
+        }
+        if unprobed:
+            report["unprobed"] = unprobed
+        if relation := self.model.get_relation(self._workers_relation):
+            relation.data[self.unit]["health"] = json.dumps(report)
+        if not self.unit.is_leader():
+            return False
+        return self._count_health(jobs, members, digest, {self.unit.name: report})
+
+    def _down(
+        self, jobs: list, deadline: float
+    ) -> typing.Tuple[typing.List[str], typing.List[str]]:
+        """Keys of the targets of the jobs failing their liveness check, and of those unprobed.
+
+        A target answering with any HTTP response is alive: only targets that do not answer
+        at all hold up Prometheus' scrape loop until the timeout. So only the status line and
+        headers are read, rather than a whole scrape. A device scraped through an exporter is
+        down, though, if the exporter answers with an error status or `probe_success 0`, which
+        is how it reports a device it could not reach; for those, the whole response is read.
+        """
+        direct = [job for job in jobs if not exporter_of(job)]
+        exported = [job for job in jobs if exporter_of(job)]
+        # (target key, probe result, alive)
+        checks: typing.List[typing.Tuple[str, ProbeResult, bool]] = []
+        if direct:
+            results = probe_jobs(
+                direct,
+                concurrency=HEALTH_CHECK_CONCURRENCY,
+                timeout=HEALTH_CHECK_TIMEOUT,
+                read_body=False,
+                total_timeout=_time_left(deadline),
+            )
+            checks.extend(
+                (target_key(*pair), result, result.status is not None)
+                for pair, result in zip(job_targets(direct), results)
+            )
+        if exported:
+            watchers: typing.Dict[str, ProbeSuccess] = {}
+
+            def watcher_for(job: dict, target: str):
+                watcher = watchers[target_key(job["job_name"], target)] = ProbeSuccess()
+                return watcher.feed
+
+            results = probe_jobs(
+                exported,
+                concurrency=HEALTH_CHECK_CONCURRENCY,
+                timeout=HEALTH_CHECK_TIMEOUT,
+                consumer=watcher_for,
+                total_timeout=_time_left(deadline),
+            )
+            for pair, result in zip(job_targets(exported), results):
+                key = target_key(*pair)
+                if watcher := watchers.get(key):
+                    watcher.close()
+                checks.append((key, result, result.up and not (watcher and watcher.failed)))
+        down = [key for key, result, alive in checks if result.probed and not alive]
+        unprobed = [key for key, result, _ in checks if not result.probed]
+        return down, unprobed
+
+    def _probe_assignment(self, jobs: list) -> typing.Tuple[typing.List[str], str]:
+        """The units the targets are split between, and a digest of the split.
+
+        The same split is used for the health checks and the latency tier measurements, the
+        only work the units share; what Prometheus scrapes is split by `distribution`.
+
+        The leader publishes the units in the peer application databag. Another unit only
+        takes part if it renders the same jobs as the leader, which the digest checks. The
+        digest is taken before DNS resolution, as units may resolve the same hostname to
+        different addresses, e.g. with round-robin DNS or a cache of another age.
+
+        Args:
+            jobs: the jobs just rendered by _scrape_jobs.
+
+        Returns:
+            The unit names, sorted, or none if this unit should not probe; and the digest.
+        """
+        if self._dns_cache:
+            # some hostnames were resolved rendering `jobs`
+            jobs = self._render_jobs(resolve=False)[0]
+        relation = self.model.get_relation(self._workers_relation)
+        if self.unit.is_leader():
+            members = sorted(
+                {self.unit.name, *(unit.name for unit in (relation.units if relation else ()))}
+            )
+            digest = _digest(json.dumps(jobs, sort_keys=True), *members)
+            if relation and relation.data[self.app].get("digest") != digest:
+                relation.data[self.app].update({"members": json.dumps(members), "digest": digest})
+            return members, digest
+        if not relation:
+            return [], ""
+        data = relation.data[self.app]
+        members = json.loads(data.get("members", "[]"))
+        digest = _digest(json.dumps(jobs, sort_keys=True), *members)
+        if digest != data.get("digest"):
+            logger.warning("Not probing: the jobs or units differ from the leader's assignment")
+            return [], digest
+        return members, digest
+
+    def _count_health(
+        self,
+        jobs: list,
+        members: typing.List[str],
+        digest: str,
+        reports: typing.Dict[str, dict],
+    ) -> bool:
+        """Count consecutive failures from the unit reports not counted yet.
+
+        Args:
+            jobs: the rendered jobs, without quarantine.
+            members: the units the targets are split between.
+            digest: digest of the current split; reports made for another one are stale.
+            reports: reports already at hand, by unit name; the others are read from the peer
+                relation.
+
+        Returns:
+            Whether the set of quarantined targets changed.
+        """
+        reports = {**self._peer_reports("health"), **reports}
+        slices = _slices(jobs, members)
+        checks = []
+        for name, report in self._uncounted(reports, members, digest, "health_reports").items():
+            down = set(report.get("down", []))
+            unprobed = set(report.get("unprobed", []))
+            for job_name, target in job_targets(slices[name]):
+                if (key := target_key(job_name, target)) not in unprobed:
+                    checks.append((key, key not in down))
+        if not checks:
+            return False
+
+        checked = {key for key, _ in checks}
+        unchecked = {target_key(*pair) for pair in job_targets(jobs)} - checked
+        before = self._quarantined()
+        self._stored.health_failures = count_failures(
+            self._stored.health_failures, checks, unchecked
+        )
+        after = self._quarantined()
+        if before != after:
+            logger.info(
+                "Quarantined %d target(s), recovered %d", len(after - before), len(before - after)
+            )
+        return before != after
+
+    def _measure_tiers(self, deadline: float) -> bool:
+        """Scrape this unit's share of the targets once, and report what each one cost.
+
+        The targets are split between the units as for the health checks. The leader smooths
+        the costs from all the units' reports, and places each target in the slowest tier its
+        cost reaches. Targets not scraped by the deadline, a time.monotonic() value, are left
+        out of the report, as down ones are.
+
+        Returns:
+            Whether the tier of any target changed.
+        """
+        if not (tiers := self._latency_tiers()) or not (jobs := self._scrape_jobs()):
+            return False
+        members, digest = self._probe_assignment(jobs)
+        if self.unit.name not in members:
+            return False
+        assigned = _slices(jobs, members)[self.unit.name]
+        timeout = min(TIER_PROBE_TIMEOUT, max(parse_duration(t.timeout) for t in tiers) / 1000)
+        results = probe_jobs(
+            assigned,
+            concurrency=HEALTH_CHECK_CONCURRENCY,
+            timeout=timeout,
+            total_timeout=_time_left(deadline),
+        )
+
+        # [latency, body size] by target key
+        samples = {}
+        for (job_name, target), result in zip(job_targets(assigned), results):
+            if result.latency is not None:
+                latency = result.latency
+            elif result.error.startswith("timeout"):
+                latency = timeout
+            else:
+                # down, which is for the health checks to handle, or not scraped in time
+                continue
+            samples[target_key(job_name, target)] = [round(latency, 4), result.body_size]
+        report = {"digest": digest, "time": time.time(), "samples": samples}
+        if relation := self.model.get_relation(self._workers_relation):
+            relation.data[self.unit]["tiers"] = json.dumps(report)
+        if not self.unit.is_leader():
+            return False
+        return self._count_tiers(jobs, members, digest, tiers, {self.unit.name: report})
+
+    def _count_tiers(
+        self,
+        jobs: list,
+        members: typing.List[str],
+        digest: str,
+        tiers: typing.List[Tier],
+        reports: typing.Dict[str, dict],
+    ) -> bool:
+        """Smooth the costs from the unit reports not counted yet, and update the tiers.
+
+        The arguments are those of `_count_health`, and the parsed latency tiers. A target
+        that was not measured keeps its last cost.
+
+        Returns:
+            Whether the tier of any target changed.
+        """
+        reports = {**self._peer_reports("tiers"), **reports}
+        if not (uncounted := self._uncounted(reports, members, digest, "tier_reports")):
+            return False
+        keys = {target_key(*pair) for pair in job_targets(jobs)}
+        previous = self._stored.tier_costs
+        # the targets no longer rendered are forgotten
+        costs = {key: list(cost) for key, cost in previous.items() if key in keys}
+        for report in uncounted.values():
+            for key, (latency, size) in report.get("samples", {}).items():
+                if key in keys:
+                    costs[key] = smoothed(previous.get(key), latency, size)
+
+        current = self._stored.tier_membership
+        membership = {}
+        for key, cost in costs.items():
+            if tier := tier_of(cost, tiers, current.get(key)):
+                membership[key] = tier
+        self._stored.tier_costs = costs
+        if membership == dict(current):
+            return False
+        logger.info(
+            "Moved %d target(s) between latency tiers",
+            sum(membership.get(key) != current.get(key) for key in {*membership, *current}),
+        )
+        self._stored.tier_membership = membership
+        return True
+
+    def _uncounted(
+        self, reports: typing.Dict[str, dict], members: typing.List[str], digest: str, field: str
+    ) -> typing.Dict[str, dict]:
+        """The reports made for the current split and not counted yet, which are marked counted.
+
+        Args:
+            reports: the last report of each unit, by unit name.
+            members: the units the targets are split between.
+            digest: digest of the current split; reports made for another one are stale.
+            field: the stored field with the timestamp of the last report counted per unit.
+        """
+        counted = getattr(self._stored, field)
+        for name in set(counted.keys()) - set(members):
+            del counted[name]
+        uncounted = {}
+        for name, report in reports.items():
+            if (
+                name in members
+                and report.get("digest") == digest
+                and report.get("time", 0) > counted.get(name, 0)
+            ):
+                counted[name] = report["time"]
+                uncounted[name] = report
+        return uncounted
+
+    def _peer_reports(self, field: str) -> typing.Dict[str, dict]:
+        """The last report of each other unit in a field of its peer databag, by unit name."""
+        reports = {}
+        if relation := self.model.get_relation(self._workers_relation):
+            for unit in relation.units:
+                if not (raw := relation.data[unit].get(field)):
+                    continue
+                try:
+                    reports[unit.name] = json.loads(raw)
+                except json.JSONDecodeError:
+                    logger.warning("Ignoring the malformed %s report of %s", field, unit.name)
+        return reports
+
+    def _latency_tiers(self) -> typing.List[Tier]:
+        """The latency tiers, or none if unset or invalid, which rendering the jobs reports."""
+        try:
+            return parse_tiers(str(self.model.config.get("latency_tiers") or ""))
+        except ValueError:
+            return []
+
+    def _quarantined(self) -> typing.Set[str]:
+        """Keys of the targets that failed health_check_failures checks in a row."""
+        threshold = self.model.config.get("health_check_failures", 3)
+        return {key for key, count in self._stored.health_failures.items() if count >= threshold}
+
+    def _on_upgrade_charm(self, event) -> None:
+        """Revalidate every target list and job spec, as the validation rules may have changed."""
+        self._stored.valid_targets = []
+        self._stored.job_models = {}
+        self._update_prometheus_jobs(event)
+
+    def _on_probe_targets_action(self, event: ActionEvent) -> None:
+        """Check that every configured target answers a scrape request."""
+        if not (jobs := self._scrape_jobs()):
+            event.fail("No valid targets configured")
+            return
+
+        results = probe_jobs(
+            jobs, concurrency=event.params["concurrency"], timeout=event.params["timeout"]
+        )
+        up = sum(result.up for result in results)
+        event.set_results(
+            {
+                "up": up,
+                "down": len(results) - up,
+                "results": json.dumps([result.as_dict() for result in results]),
+            }
+        )
+
+    def _on_analyze_cardinality_action(self, event: ActionEvent) -> None:
+        """Scrape every target once and report how many series it would add to Prometheus."""
+        if not (jobs := self._scrape_jobs()):
+            event.fail("No valid targets configured")
+            return
+
+        analyzers = {}
+
+        def analyzer_for(job: dict, target: str):
+            analyzer = analyzers[job["job_name"], target] = ExpositionAnalyzer()
+            return analyzer.feed
 
-        if jobs:
-            self.unit.status = ActiveStatus()
+        results = probe_jobs(
+            jobs,
+            concurrency=event.params["concurrency"],
+            timeout=event.params["timeout"],
+            consumer=analyzer_for,
+        )
+
+        reports = []
+        analyzed = []
+        drop_candidates = set()
+        # probe_jobs returns results in job and target order
+        job_names = (
+            job["job_name"]
+            for job in jobs
+            for static_config in job["static_configs"]
+            for _ in static_config["targets"]
+        )
+        for job_name, result in zip(job_names, results):
+            target = result.target
+            report = {"job": job_name, "target": target}
+            if not result.up:
+                report["error"] = result.error or "HTTP {}".format(result.status)
+            else:
+                analyzer = analyzers[job_name, target]
+                analyzer.close()
+                analyzed.append(analyzer)
+                report.update(analyzer.report(top=event.params["top"]))
+                drop_candidates.update(report["drop_candidates"])
+            reports.append(report)
+
+        event.set_results(
+            {
+                "recommended": json.dumps(recommend_limits(analyzed)),
+                "drop-rules": json.dumps(drop_rules(drop_candidates)),
+                "targets": json.dumps(reports),
+            }
+        )
+
+    def _on_compare_protocols_action(self, event: ActionEvent) -> None:
+        """Scrape every target with each protocol and encoding, and report the cheapest.
+
+        The result is diagnostic only: the jobs published do not carry these settings.
+        """
+        if not (jobs := self._scrape_jobs()):
+            event.fail("No valid targets configured")
+            return
+        try:
+            protocols = parse_protocols(event.params["protocols"] or list(SCRAPE_PROTOCOLS))
+        except ValueError as e:
+            event.fail("Invalid protocols: {}".format(e))
+            return
+
+        measurements = compare_protocols(
+            jobs,
+            protocols,
+            concurrency=event.params["concurrency"],
+            timeout=event.params["timeout"],
+        )
+        event.set_results(
+            {
+                "cheapest": json.dumps(cheapest(measurements)),
+                "targets": json.dumps(measurements),
+            }
+        )
+
+    def _stand_by(self) -> None:
+        """Leave publishing to the leader; a follower only takes its share of health checks."""
+        # another unit handles the scrape-targets events until this one leads again
+        if self._stored.remote_targets_synced:
+            self._stored.remote_targets = {}
+            self._stored.remote_targets_synced = False
+        # the next leader publishes, so what this unit published is no longer current
+        if self._stored.published_digests:
+            self._stored.published_digests = {}
+        if self.model.config.get("health_check") or self.model.config.get("latency_tiers"):
+            self.unit.status = ActiveStatus("probing targets for the leader")
         else:
+            self.unit.status = WaitingStatus("inactive unit")
+
+    def _update_prometheus_jobs(self, event):
+        """Setup Prometheus scrape configuration for external targets."""
+        if not self.unit.is_leader():
+            self._stand_by()
+            return
+
+        start = time.perf_counter()
+        writes = self._stored.relation_writes
+        jobs, errors = self._render_jobs()
+        render_time = time.perf_counter() - start
+        jobs = self._measured(jobs, errors)
+        distribution = self.model.config.get("distribution", "replicate")
+        if distribution not in DISTRIBUTION_MODES:
+            errors.append("distribution: must be one of {}".format(", ".join(DISTRIBUTION_MODES)))
+        budget, budget_errors = self._payload_budget()
+        errors.extend(budget_errors)
+        # the jobs with errors were left out, and invalid settings left at their defaults:
+        # publish the rest, so that one mistake does not stop every other job from scraping
+        for error in errors:
+            logger.error("Invalid config: %s", error)
+        payloads = self._payloads(jobs, distribution == "hash")
+        self._publish(payloads)
+
+        stats = HookStats(
+            event=event.handle.kind,
+            version=self._charm_version(),
+            timestamp=round(time.time(), 3),
+            duration_ms=round((time.perf_counter() - start) * 1000, 1),
+            render_ms=round(render_time * 1000, 1),
+            jobs=len(jobs),
+            valid_targets=sum(1 for _ in job_targets(jobs)),
+            invalid_targets=self._invalid_targets,
+            # the largest payload is the one closest to the databag size limit
+            payload_bytes=max(map(len, payloads.values()), default=0)
+            or len(json.dumps(jobs, sort_keys=True)),
+            relation_writes=self._stored.relation_writes - writes,
+        )
+        self._stored.hook_stats = recorded(self._stored.hook_stats, stats)
+        self._set_status(jobs, errors, stats, budget)
+
+    def _set_status(
+        self, jobs: list, errors: typing.List[str], stats: HookStats, budget: int
+    ) -> None:
+        """Report config errors, or the published jobs and what to be aware of about them."""
+        if errors:
+            self.unit.status = BlockedStatus(_blocked_message(errors))
+            return
+        if not jobs:
             self.unit.status = BlockedStatus("No targets specified")
+            return
+        notes = []
+        if budget and stats.payload_bytes > budget:
+            # still published: Prometheus needs the targets more than the controller the space
+            logger.warning(
+                "scrape_jobs payload of %d bytes exceeds payload_budget; every write of it "
+                "slows down the Juju controller",
+                stats.payload_bytes,
+            )
+            notes.append("over payload_budget")
+        if ignored := dropped_keys(jobs):
+            # still published, for consumers that do use them
+            logger.warning(
+                "Prometheus charms drop the %s field(s) of the scrape jobs; they have no effect",
+                ", ".join(ignored),
+            )
+            notes.append("ignored by Prometheus: {}".format(", ".join(ignored)))
+        self.unit.status = ActiveStatus(", ".join([status_message(stats), *notes]))
+
+    def _payload_budget(self) -> typing.Tuple[int, typing.List[str]]:
+        """The largest payload in bytes, 0 meaning no limit, and the related config errors."""
+        if not (budget := self.model.config.get("payload_budget")):
+            return 0, []
+        try:
+            return parse_size(str(budget)), []
+        except ValueError as e:
+            return 0, ["payload_budget: {}".format(e)]
 
-    def _scrape_jobs(self) -> list:  # noqa: C901
-        if targets := self._targets():
-            static_config = {"targets": targets}
-            if labels := self._labels():
-                static_config.update(labels=labels)  # pyright: ignore
+    def _charm_version(self) -> str:
+        """The version of the charm code, as recorded at build time."""
+        try:
+            return (self.charm_dir / "version").read_text().strip() or "unknown"
+        except OSError:
+            return "unknown"
 
-            job = {
-                "job_name": self._job_name(),
-                "static_configs": [static_config],
+    def _on_stats_action(self, event: ActionEvent) -> None:
+        """Report what the last hooks cost, per hook and per charm version."""
+        history = [dict(entry) for entry in self._stored.hook_stats]
+        if not history:
+            event.fail("No hook has rendered the scrape jobs yet")
+            return
+        event.set_results(
+            {
+                "last": json.dumps(history[-1]),
+                "summary": json.dumps(summarize(history)),
+                "history": json.dumps(history),
+                "relation-writes": self._stored.relation_writes,
+                "skipped-writes": self._stored.skipped_writes,
             }
+        )
 
-            for option in (
-                "metrics_path",  # prom's built-in default: [ metrics_path: <path> | default = /metrics ]
-                "scheme",
-            ):
-                if value := self.model.config.get(option):
-                    job.update({option: value})
+    def _without_unhealthy(self, jobs: list) -> typing.Tuple[list, typing.List[str]]:
+        """Quarantine the targets failing their liveness checks, per the quarantine option."""
+        errors = []
+        threshold = self.model.config.get("health_check_failures", 3)
+        if isinstance(threshold, bool) or not isinstance(threshold, int) or threshold < 1:
+            errors.append("health_check_failures: must be a positive integer")
+        if (mode := self.model.config.get("quarantine", "job")) not in QUARANTINE_MODES:
+            errors.append("quarantine: must be one of {}".format(", ".join(QUARANTINE_MODES)))
 
-            if params := self.model.config.get("params"):
-                val = yaml.safe_load(typing.cast(str, params))
-                job.update({"params": val})
+        interval = str(self.model.config.get("quarantine_interval", "5m"))
+        try:
+            if not (interval_ms := parse_duration(interval)):
+                errors.append("quarantine_interval: must be greater than 0")
+        except ValueError as e:
+            errors.append("quarantine_interval: {}".format(e))
+        else:
+            errors.extend(
+                "quarantine_interval: shorter than the scrape_timeout of {}".format(
+                    job["job_name"]
+                )
+                for job in jobs
+                if parse_duration(job.get("scrape_timeout", DEFAULT_SCRAPE_TIMEOUT)) > interval_ms
+            )
 
-            tls_config = {}
+        if errors:
+            return jobs, errors
+        overrides = {"scrape_interval": interval}
+        return quarantine(jobs, self._quarantined(), typing.cast(str, mode), overrides), []
 
-            if cert_file := self.model.config.get("tls_config_cert_file"):
-                tls_config.update({"cert_file": typing.cast(str, cert_file)})
-            if key_file := self.model.config.get("tls_config_key_file"):
-                tls_config.update({"key_file": typing.cast(str, key_file)})
-            if server_name := self.model.config.get("tls_config_server_name"):
-                tls_config.update({"server_name": typing.cast(str, server_name)})
-            if ca_file := self.model.config.get("tls_config_ca_file"):
-                tls_config.update({"ca_file": typing.cast(str, ca_file)})
-            if insecure_skip_verify := self.model.config.get("tls_config_insecure_skip_verify"):
-                # Need to convert bool to lowercase str
-                tls_config.update({"insecure_skip_verify": insecure_skip_verify})
+    def _measured(self, jobs: list, errors: typing.List[str]) -> list:
+        """Apply what the update-status probes measured: quarantine, then latency tiers.
 
-            if tls_config:
-                job.update({"tls_config": tls_config})
+        Measurements of a feature that was turned off are dropped; configuration errors are
+        appended to `errors`.
+        """
+        if self.model.config.get("health_check"):
+            jobs, health_errors = self._without_unhealthy(jobs)
+            errors.extend(health_errors)
+        elif self._stored.health_failures:
+            self._stored.health_failures = {}
+        if self.model.config.get("latency_tiers"):
+            jobs, tier_errors = self._tiered(jobs)
+            errors.extend(tier_errors)
+        elif self._stored.tier_costs:
+            self._stored.tier_costs = {}
+            self._stored.tier_membership = {}
+            self._stored.tier_reports = {}
+        return jobs
 
-            if basic_auth := self.model.config.get("basic_auth"):
-                try:
-                    username, password = typing.cast(str, basic_auth).split(":")
-                except ValueError:
-                    self.unit.status = BlockedStatus(
-                        "Invalid basic_auth config option; use `user:password` format"
-                    )
-                else:
-                    job.update({"basic_auth": {"username": username, "password": password}})
+    def _tiered(self, jobs: list) -> typing.Tuple[list, typing.List[str]]:
+        """Move the targets measured slow or heavy into the job of their latency tier."""
+        try:
+            tiers = parse_tiers(str(self.model.config["latency_tiers"]))
+        except ValueError as e:
+            return jobs, ["latency_tiers: {}".format(e)]
+        return tiered(jobs, self._stored.tier_membership, tiers), []
 
-            return [job]
+    def _payloads(self, jobs: list, distributed: bool) -> typing.Dict[int, str]:
+        """The scrape_jobs payload for each relation, by relation id.
 
-        return []
+        Every relation gets all the jobs, unless `distributed`: then each target is assigned
+        to one of the related applications, and each relation only gets its own targets.
+        """
+        relations = self.model.relations[self._prometheus_relation]
+        if not distributed or len(relations) < 2:
+            payload = json.dumps(jobs, sort_keys=True)
+            logger.info(
+                "Rendered %d scrape job(s); payload size %d bytes", len(jobs), len(payload)
+            )
+            return {relation.id: payload for relation in relations}
 
-    def _targets(self) -> list:
-        if not (unvalidated_scrape_targets := self.model.config.get("targets", "")):
-            self.unit.status = BlockedStatus("No targets specified")
-            return []
+        # keyed by application name, which (unlike the relation id) survives a re-relation
+        members = {
+            relation.id: relation.app.name if relation.app else str(relation.id)
+            for relation in relations
+        }
+        slices = distribute(jobs, list(members.values()))
+        payloads = {
+            relation_id: json.dumps(slices[member], sort_keys=True)
+            for relation_id, member in members.items()
+        }
+        logger.info(
+            "Distributed %d scrape job(s) across %d relations; payload sizes %s bytes",
+            len(jobs),
+            len(relations),
+            ", ".join(str(len(payload)) for payload in payloads.values()),
+        )
+        return payloads
 
-        targets = []
-        invalid_targets = []
-        unvalidated_scrape_targets = typing.cast(str, unvalidated_scrape_targets)
-        for config_target in unvalidated_scrape_targets.split(","):
-            if valid_address := _validated_address(config_target):
-                targets.append(valid_address)
+    def _publish(self, payloads: typing.Dict[int, str]) -> None:
+        """Write each relation's scrape_jobs payload, if it differs from the published one."""
+        digests: typing.Dict[str, str] = {}
+        published = {}
+        skipped = 0
+        for relation in self.model.relations[self._prometheus_relation]:
+            key = str(relation.id)
+            payload = payloads[relation.id]
+            # relations usually share the same payload; hash it only once
+            if (digest := digests.get(payload)) is None:
+                digest = digests[payload] = hashlib.sha256(payload.encode()).hexdigest()
+            if self._stored.published_digests.get(key) == digest:
+                skipped += 1
             else:
-                invalid_targets.append(config_target)
+                relation.data[self.app]["scrape_jobs"] = payload
+                self._stored.relation_writes += 1
+            published[key] = digest
 
-        if invalid_targets:
-            logger.error("Invalid targets found: %s", invalid_targets)
-            logger.error("Targets must be specified in host:port format")
-            self.unit.status = BlockedStatus("Invalid targets, see debug-logs")
-            return []
+        # Also forgets relations that have since been removed
+        self._stored.published_digests = published
+        if skipped:
+            self._stored.skipped_writes += skipped
+            logger.debug(
+                "Skipped %d unchanged scrape_jobs write(s); %d skipped in total",
+                skipped,
+                self._stored.skipped_writes,
+            )
+
+    def _scrape_jobs(self) -> list:
+        """The scrape jobs to publish, leaving out the ones with config errors."""
+        return self._render_jobs()[0]
+
+    def _render_jobs(self, resolve: bool = True) -> typing.Tuple[list, typing.List[str]]:
+        """Render the job from the flat config options and the ones from the `jobs` option.
+
+        Args:
+            resolve: whether to resolve target hostnames for the jobs with resolve_hostnames
+                set; if not, the DNS cache is left as it is.
+
+        Returns:
+            The scrape jobs, leaving out the ones with errors, and every configuration error
+            found (prefixed with the option).
+        """
+        jobs = []
+        errors = []
+        self._valid_targets = []
+        self._invalid_targets = 0
+        # a set, as membership tests on the StoredState list are linear
+        self._known_valid_targets = set(self._stored.valid_targets)
+        self._job_models = {}
+        self._resolving = resolve
+        if resolve:
+            self._dns_cache = {}
+        try:
+            ttl = parse_duration(str(self.model.config.get("resolve_ttl", "10m")))
+        except ValueError as e:
+            errors.append("resolve_ttl: {}".format(e))
+        else:
+            self._resolve_ttl = ttl / 1000
+
+        config_jobs, config_errors = self._render_config_job()
+        jobs.extend(config_jobs)
+        errors.extend(config_errors)
+
+        if specs := self.model.config.get("jobs"):
+            spec_jobs, spec_errors = self._render_job_specs(typing.cast(str, specs))
+            jobs.extend(spec_jobs)
+            errors.extend(spec_errors)
+
+        names = [job["job_name"] for job in jobs]
+        if duplicates := sorted({name for name in names if names.count(name) > 1}):
+            errors.append("jobs: duplicate job names {}".format(", ".join(duplicates)))
+            jobs = [job for job in jobs if job["job_name"] not in duplicates]
+
+        # Also forgets target lists, job specs and hostnames that are no longer configured
+        if self._valid_targets != list(self._stored.valid_targets):
+            self._stored.valid_targets = self._valid_targets
+        if self._job_models.keys() != self._stored.job_models.keys():
+            self._stored.job_models = {
+                digest: model.to_stored() for digest, model in self._job_models.items()
+            }
+        if resolve and self._dns_cache != {
+            host: list(entry) for host, entry in self._stored.dns_cache.items()
+        }:
+            self._stored.dns_cache = self._dns_cache
+        return jobs, errors
+
+    def _render_config_job(self) -> typing.Tuple[list, typing.List[str]]:
+        """Render the job from the flat config options, if it has any targets.
+
+        A job with errors is left out, so that the other jobs are still published.
+        """
+        try:
+            targets_file = self._targets_file()
+        except OSError as e:
+            return [], ["targets-file: unreadable resource: {}".format(e)]
+        remote_targets = self._remote_targets()
+        config_targets = self.model.config.get("targets")
+        if not (config_targets or targets_file or remote_targets):
+            return [], []
+        max_expanded = _max_expanded(self.model.config)
+        devices = _devices(self.model.config)
+        sources: typing.List[typing.Union[str, Path]] = [
+            str(config_targets or ""),
+            str(max_expanded),
+            str(devices),
+        ]
+        if targets_file:
+            sources.append(targets_file)
+        try:
+            targets, target_errors = self._validated_targets(
+                self._config_targets(targets_file), max_expanded, _digest(*sources), devices
+            )
+        except (UnicodeDecodeError, OSError) as e:
+            # the file is only read as the targets are validated
+            return [], ["targets-file: unreadable resource: {}".format(e)]
+        # targets from the config take precedence over the same address from a relation
+        targets = {**remote_targets, **targets}
+        jobs, job_errors = self._render_job(self.model.config, targets)
+        if errors := target_errors + job_errors:
+            return [], errors
+        return jobs, []
+
+    def _validated_targets(
+        self,
+        entries: typing.Iterable[str],
+        max_expanded: int,
+        digest: str,
+        devices: bool = False,
+    ) -> typing.Tuple[dict, typing.List[str]]:
+        """Validate a target list, skipping the address checks if it was found valid before.
 
-        return targets
+        Args:
+            entries: the unvalidated target entries.
+            max_expanded: the most addresses patterns may expand to.
+            digest: content hash of everything the entries derive from.
+            devices: whether the targets are devices scraped through a multi-target exporter,
+                which may also be URLs.
+        """
+        known = digest in self._known_valid_targets
+        report = validate_targets(
+            entries,
+            max_expanded,
+            check_addresses=not known,
+            address_check=device_error if devices else None,
+        )
+        self._invalid_targets += len(report.invalid)
+        if errors := _target_errors(report):
+            return {}, errors
+        # only warned about when the list changes, like the other address checks
+        if not known and (underscored := list(filter(underscored_hostname, report.targets))):
+            logger.warning(
+                "Hostnames with underscores are deprecated, and may be rejected in a later "
+                "version: %s",
+                ", ".join(underscored),
+            )
+        self._valid_targets.append(digest)
+        return report.targets, []
 
-    def _labels(self):
-        if not (all_labels := self.model.config.get("labels", "")):
-            return {}
+    def _render_job_specs(self, specs: str) -> typing.Tuple[list, typing.List[str]]:
+        """Render the jobs listed in the `jobs` option, collecting every job's errors."""
+        try:
+            entries = _load_yaml(specs)
+        except YAMLError as e:
+            return [], ["jobs: invalid YAML: {}".format(e)]
+        if not isinstance(entries, list):
+            return [], ["jobs: must be a list of jobs"]
 
-        labels = {}
-        invalid_labels = []
-        all_labels = typing.cast(str, all_labels)
-        for label in all_labels.split(","):
-            try:
-                key, value = label.split(":")
-            except ValueError:
-                invalid_labels.append(label)
+        jobs = []
+        errors = []
+        for index, spec in enumerate(entries):
+            if not isinstance(spec, dict):
+                errors.append("jobs[{}]: must be a mapping".format(index))
                 continue
+            name = spec.get("job_name")
+            prefix = "jobs[{}]".format(name if isinstance(name, str) and name else index)
+            entries_targets, job_errors = _check_job_spec(spec)
+            if not job_errors:
+                max_expanded = _max_expanded(spec)
+                devices = _devices(spec)
+                targets, target_errors = self._validated_targets(
+                    entries_targets,
+                    max_expanded,
+                    _digest(json.dumps(entries_targets), str(max_expanded), str(devices)),
+                    devices,
+                )
+                spec_jobs, spec_errors = self._render_job(spec, targets)
+                if not (job_errors := target_errors + spec_errors):
+                    jobs.extend(spec_jobs)
+            errors.extend("{}.{}".format(prefix, error) for error in job_errors)
+
+        return jobs, errors
+
+    def _render_job(
+        self, spec: typing.Mapping[str, typing.Any], targets: dict
+    ) -> typing.Tuple[list, typing.List[str]]:
+        """Render the scrape job(s) for one job spec: the charm config, or a `jobs` entry."""
+        model = self._job_model(spec)
+        # devices are resolved by the exporter, and may be URLs
+        if self._resolving and spec.get("resolve_hostnames") and not spec.get("exporter_address"):
+            if spec.get("scheme") == "https" and not spec.get("tls_config_server_name"):
+                # the certificates would be verified against the addresses, not the hostnames
+                logger.warning(
+                    "Not resolving the targets of %s: https needs tls_config_server_name",
+                    spec["job_name"],
+                )
+            else:
+                targets = self._resolved(targets)
 
-            if key and value:
-                labels[key] = value
+        job = {"job_name": self._job_name(spec["job_name"]), **json.loads(model.fields)}
+        jobs = module_jobs(_sharded(job, targets, dict(model.labels), model.shards), model.modules)
+        if model.federation is not None:
+            jobs = _federated(jobs, model.federation)
+        return jobs, list(model.errors)
+
+    def _job_model(self, spec: typing.Mapping[str, typing.Any]) -> JobModel:
+        """The model of a job spec, rebuilt only if its options changed since the last hook."""
+        digest = _model_digest(spec)
+        if (model := self._job_models.get(digest)) is None:
+            if (stored := self._stored.job_models.get(digest)) is not None:
+                model = JobModel.from_stored(stored)
             else:
-                invalid_labels.append(f"{key}:{value}")
+                model = _parse_job_spec(spec)
+            self._job_models[digest] = model
+        return model
+
+    def _resolved(self, targets: dict) -> dict:
+        """Replace target hostnames with their addresses, resolving expired ones in parallel.
 
-        if invalid_labels:
-            logger.error("Invalid labels : %s", invalid_labels)
-            logger.error("Labels must be specified in key:value format")
-            self.unit.status = BlockedStatus("Invalid labels, see debug-logs")
-        return labels
+        The original address is kept as the `instance` label, so that series keep their
+        identity. Hosts that do not resolve are left to Prometheus, as is a hostname resolving
+        to the address of another target.
+        """
+        hosts = {
+            host
+            for host, _ in (split_host_port(address, 0) for address in targets)
+            if not is_ip_address(host)
+        }
+        if not hosts:
+            return targets
+        cache = {**self._stored.dns_cache, **self._dns_cache}
+        entries = resolve_cached(hosts, cache, self.resolver, self._resolve_ttl, time.time())
+        self._dns_cache.update(entries)
+
+        resolved = {}
+        pending = []
+        for address, labels in targets.items():
+            host, port = split_host_port(address, 0)
+            if host in hosts and entries[host][0]:
+                pending.append((join_address(entries[host][0], port), address, labels))
+            else:
+                resolved[address] = labels
+        # IP addresses and unresolved hostnames go first, so they win any collision
+        for target, address, labels in pending:
+            if target in resolved:
+                resolved[address] = labels
+            else:
+                resolved[target] = {"instance": address, **labels}
+        return resolved
 
-    def _job_name(self):
-        return "juju_{}_{}_{}_{}".format(
-            self.model.name, self.model.uuid[:7], self.app.name, self.model.config["job_name"]
+    def _config_targets(self, targets_file: typing.Optional[Path]) -> typing.Iterable[str]:
+        """Unvalidated targets from the `targets` option, followed by the targets-file ones."""
+        config_targets = typing.cast(str, self.model.config.get("targets", ""))
+        unvalidated_scrape_targets: typing.Iterable[str] = (
+            split_targets(config_targets) if config_targets else []
         )
+        if targets_file:
+            unvalidated_scrape_targets = itertools.chain(
+                unvalidated_scrape_targets, iter_targets_file(targets_file)
+            )
+        return unvalidated_scrape_targets
+
+    def _targets_file(self) -> typing.Optional[Path]:
+        """Path to the attached targets-file resource, if a non-empty one was provided.
+
+        Raises:
+            OSError: if the fetched file is missing or cannot be read.
+        """
+        try:
+            path = self.model.resources.fetch("targets-file")
+        except (ModelError, NameError):
+            return None
+        return path if path.stat().st_size else None
+
+    def _job_name(self, name: str) -> str:
+        return "juju_{}_{}_{}_{}".format(self.model.name, self.model.uuid[:7], self.app.name, name)
 
 
 if __name__ == "__main__":
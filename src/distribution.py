@@ -0,0 +1,74 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Splitting scrape targets between several Prometheus applications."""
+
+import hashlib
+import typing
+
+DISTRIBUTION_MODES = ("replicate", "hash")
+
+
+def _weight(member: str, target: str) -> int:
+    digest = hashlib.blake2b("{}\0{}".format(member, target).encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "big")
+
+
+def owner(target: str, members: typing.Sequence[str]) -> str:
+    """The member a target is assigned to, by rendezvous (highest random weight) hashing.
+
+    A target only moves when the member it was assigned to leaves, or when a joining member
+    outweighs it, so adding or removing one of N members moves about 1/N of the targets.
+    """
+    return max(members, key=lambda member: _weight(member, target))
+
+
+def distribute(
+    jobs: typing.Iterable[dict], members: typing.Sequence[str]
+) -> typing.Dict[str, typing.List[dict]]:
+    """Split the targets of every job between members, keeping the job options and labels.
+
+    Returns:
+        The jobs for each member; a job is left out of a member's list if none of its targets
+        were assigned to it.
+    """
+    slices: typing.Dict[str, typing.List[dict]] = {member: [] for member in members}
+    for job in jobs:
+        static_configs: typing.Dict[str, typing.List[dict]] = {member: [] for member in members}
+        for static_config in job["static_configs"]:
+            assigned: typing.Dict[str, typing.List[str]] = {}
+            for target in static_config["targets"]:
+                assigned.setdefault(owner(target, members), []).append(target)
+            for member, targets in assigned.items():
+                static_configs[member].append(dict(static_config, targets=targets))
+        for member, member_configs in static_configs.items():
+            if member_configs:
+                slices[member].append(dict(job, static_configs=member_configs))
+    return slices
+
+
+def split_evenly(
+    items: typing.Iterable[str], members: typing.Sequence[str]
+) -> typing.Dict[str, typing.List[str]]:
+    """Split items between members by rendezvous hashing, with at most one more for any member.
+
+    Each item goes to the member it weighs most with that has room left, taking the items in
+    the order of their own weight. Adding or removing an item then moves only the few items
+    pushed out of, or pulled into, a full member, rather than every item after it as dealing
+    them out in turn would; keeping the sizes even still means that the change usually
+    reaches more than one member, e.g. about half of them with four members.
+
+    Returns:
+        The items of each member, in the order of their weight.
+    """
+    items = sorted(items, key=lambda item: (_weight("", item), item))
+    least, extra = divmod(len(items), len(members))
+    groups: typing.Dict[str, typing.List[str]] = {member: [] for member in members}
+    for item in items:
+        for member in sorted(members, key=lambda member: _weight(member, item), reverse=True):
+            size = len(groups[member])
+            full = sum(len(group) > least for group in groups.values())
+            if size < least or (size == least and full < extra):
+                groups[member].append(item)
+                break
+    return groups
@@ -0,0 +1,128 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Jobs scraping devices through a multi-target exporter, e.g. snmp_exporter or blackbox_exporter.
+
+The targets of such a job are the devices; Prometheus relabels each of them into the `target`
+URL parameter, keeps it as the instance label, and scrapes the exporter instead.
+"""
+
+import typing
+from urllib.parse import urlsplit
+
+from targets import address_error
+
+# Schemes blackbox_exporter probes a device URL with
+DEVICE_URL_SCHEMES = ("http", "https")
+
+
+def device_error(device: str) -> str:
+    """Why a device address is invalid; empty if it is valid.
+
+    A device is a `host[:port]` address, or an http(s) URL for blackbox_exporter.
+    """
+    if "://" not in device:
+        return address_error(device)
+    if any(char.isspace() for char in device):
+        return "must not contain whitespace"
+    try:
+        url = urlsplit(device)
+        port = url.port
+    except ValueError as e:
+        return "invalid URL: {}".format(e)
+    if url.scheme not in DEVICE_URL_SCHEMES:
+        return "URL scheme must be one of {}".format(", ".join(DEVICE_URL_SCHEMES))
+    if not url.hostname:
+        return "URL without a host"
+    if port == 0:
+        return "port 0 out of range"
+    return ""
+
+
+def parse_modules(value: typing.Any) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Parse exporter modules: a list, or a comma separated string.
+
+    Returns:
+        The modules, and the problems found.
+    """
+    if isinstance(value, str):
+        value = [module.strip() for module in value.split(",")]
+    if not isinstance(value, list) or not all(isinstance(m, str) and m for m in value):
+        return [], ["must be a list of module names"]
+    if duplicates := sorted({module for module in value if value.count(module) > 1}):
+        return [], ["duplicate modules {}".format(", ".join(duplicates))]
+    return value, []
+
+
+def relabel_chain(exporter: str) -> typing.List[dict]:
+    """The relabel rules that scrape each device through the exporter at `exporter`."""
+    return [
+        {"source_labels": ["__address__"], "target_label": "__param_target"},
+        {"source_labels": ["__param_target"], "target_label": "instance"},
+        {"target_label": "__address__", "replacement": exporter},
+    ]
+
+
+def exporter_of(job: typing.Mapping[str, typing.Any]) -> typing.Optional[str]:
+    """The exporter a job scrapes its targets through, if it starts with the relabel chain."""
+    rules = job.get("relabel_configs", [])
+    if len(rules) >= 3 and rules[:2] == relabel_chain("")[:2]:
+        if rules[2].get("target_label") == "__address__" and "source_labels" not in rules[2]:
+            return rules[2].get("replacement")
+    return None
+
+
+def module_jobs(jobs: typing.List[dict], modules: typing.Sequence[str]) -> typing.List[dict]:
+    """Turn each job into one job per exporter module, all scraping the same devices."""
+    if not modules:
+        return jobs
+    result = []
+    for job in jobs:
+        for module in modules:
+            name = job["job_name"]
+            if len(modules) > 1:
+                name = "{}_{}".format(name, module)
+            params = {**job.get("params", {}), "module": [module]}
+            result.append(dict(job, job_name=name, params=params))
+    return result
+
+
+class ProbeSuccess:
+    """Watch an exporter's response for a `probe_success` sample of 0, one chunk at a time.
+
+    blackbox_exporter answers with a 200 whether or not it could probe the device, and only
+    reports the outcome in this metric. Only the current line is held in memory.
+    """
+
+    METRIC = b"probe_success"
+
+    def __init__(self):
+        self.failed = False
+        self._partial = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """Check all complete lines in `chunk`, keeping any trailing partial line."""
+        data = self._partial + chunk
+        end = data.rfind(b"\n") + 1
+        self._partial = data[end:]
+        for line in data[:end].split(b"\n"):
+            self._check_line(line)
+
+    def close(self) -> None:
+        """Check whatever is left once the body has ended."""
+        self._check_line(self._partial)
+        self._partial = b""
+
+    def _check_line(self, line: bytes) -> None:
+        if not line.startswith(self.METRIC):
+            return
+        rest = line[len(self.METRIC) :]
+        if rest[:1] == b"{":
+            rest = rest.rpartition(b"}")[2]
+        elif rest[:1] not in (b" ", b"\t"):
+            # another metric sharing the prefix
+            return
+        try:
+            self.failed = self.failed or float(rest.split()[0]) == 0
+        except (IndexError, ValueError):
+            pass
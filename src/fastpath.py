@@ -0,0 +1,44 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Hooks answered without starting the operator framework.
+
+Every hook runs in a fresh interpreter, where importing ops and the charm's modules takes most
+of the time of a hook that has nothing to do. Such hooks are recognised here from the dispatch
+environment, with at most one hook tool call, before anything else is imported; so only the
+standard library may be used.
+"""
+
+import json
+import subprocess
+import typing
+
+# Relations whose changes only the leader acts on; on other units the framework would only
+# set the status they already have.
+LEADER_RELATIONS = ("metrics-endpoint", "scrape-targets", "workers")
+
+
+def _hook_tool(*args: str) -> str:
+    return subprocess.run(args, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def handled(environ: typing.Mapping[str, str]) -> bool:
+    """Handle the current hook if it needs nothing from the framework.
+
+    Returns:
+        Whether the hook was handled; if not, it must be dispatched to the charm as usual.
+    """
+    # e.g. hooks/install; actions are always dispatched
+    hook = environ.get("JUJU_DISPATCH_PATH", "").partition("hooks/")[2]
+    relation, _, kind = hook.rpartition("-relation-")
+    try:
+        if hook == "install":
+            # all the charm does on install, as it has no workload
+            _hook_tool("application-version-set", "n/a")
+            return True
+        if kind == "changed" and relation in LEADER_RELATIONS:
+            return json.loads(_hook_tool("is-leader", "--format=json")) is False
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        # leave it to the framework, which reports hook tool errors properly
+        return False
+    return False
@@ -0,0 +1,79 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Validation of the series selectors used to federate from another Prometheus."""
+
+import re
+import typing
+
+from relabel import compile_regex
+
+FEDERATE_PATH = "/federate"
+# Federation responses are large: scrape less often than usual, and allow for slow responses
+FEDERATION_DEFAULTS = {"scrape_interval": "1m", "scrape_timeout": "45s"}
+
+_METRIC_NAME = re.compile(r"\s*([a-zA-Z_:][a-zA-Z0-9_:]*)\s*")
+_MATCHER = re.compile(
+    r"""\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"""
+    r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)\s*(,|$)"""
+)
+_ESCAPE = re.compile(r"\\(.)")
+
+
+def _matches_empty(op: str, value: str) -> bool:
+    """Whether a label matcher matches series that do not have the label at all."""
+    if op in ("=", "!="):
+        return (value == "") == (op == "=")
+    matches = bool(compile_regex(value).match(""))
+    return matches == (op == "=~")
+
+
+def selector_error(selector: str) -> str:
+    """Why a series selector is invalid; empty if it is valid.
+
+    Checks the syntax Prometheus accepts in `match[]`: an optional metric name, followed by
+    label matchers in braces, at least one of which must not match the empty string.
+    """
+    selector = selector.strip()
+    name = _METRIC_NAME.match(selector)
+    position = name.end() if name else 0
+    if position == len(selector):
+        return "" if name else "empty selector"
+    if selector[position] != "{" or not selector.endswith("}"):
+        return 'invalid syntax; use name{label="value",...}'
+
+    position += 1
+    non_empty = bool(name)
+    while position < len(selector) - 1:
+        if not (matcher := _MATCHER.match(selector, position, len(selector) - 1)):
+            return "invalid label matcher at {!r}".format(selector[position:-1])
+        _, op, quoted, _ = matcher.groups()
+        value = quoted[1:-1] if quoted[0] == "`" else _ESCAPE.sub(r"\1", quoted[1:-1])
+        try:
+            non_empty = non_empty or not _matches_empty(op, value)
+        except ValueError as e:
+            return str(e)
+        position = matcher.end()
+
+    if not non_empty:
+        return "must contain at least one matcher that does not match the empty string"
+    return ""
+
+
+def parse_selectors(value: typing.Any) -> typing.Tuple[typing.List[str], typing.List[str]]:
+    """Split and validate selectors: a list, or one selector per line.
+
+    Returns:
+        The selectors, and a description of each invalid one.
+    """
+    if isinstance(value, str):
+        value = value.splitlines()
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return [], ["must be a list of series selectors, or one selector per line"]
+    selectors = [item.strip() for item in value if item.strip()]
+    errors = [
+        "{}: {}".format(selector, error)
+        for selector in selectors
+        if (error := selector_error(selector))
+    ]
+    return selectors, errors
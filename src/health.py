@@ -0,0 +1,108 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Quarantine of scrape targets that repeatedly fail their liveness check."""
+
+import typing
+
+QUARANTINE_MODES = ("job", "label")
+QUARANTINE_LABEL = "quarantined"
+
+
+def target_key(job_name: str, target: str) -> str:
+    """Identify a target within a job; the same address may be healthy in one job only."""
+    return "{} {}".format(job_name, target)
+
+
+def job_targets(jobs: typing.Iterable[dict]) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Every (job name, target) pair, in the order probe_jobs probes them."""
+    for job in jobs:
+        for static_config in job["static_configs"]:
+            for target in static_config["targets"]:
+                yield job["job_name"], target
+
+
+def count_failures(
+    failures: typing.Mapping[str, int],
+    checks: typing.Iterable[typing.Tuple[str, bool]],
+    unchecked: typing.Collection[str] = (),
+) -> typing.Dict[str, int]:
+    """Update the consecutive failure count of each checked target.
+
+    A successful check resets a target's count. Only checked targets are kept, so targets
+    that are no longer configured are forgotten.
+
+    Args:
+        failures: consecutive failures per target key, from the previous checks.
+        checks: (target key, alive) pairs.
+        unchecked: keys of configured targets that were not checked this time, e.g. those
+            probed by another unit that has not reported yet; their counts are kept as is.
+    """
+    counts = {key: failures[key] for key in unchecked if key in failures}
+    for key, alive in checks:
+        if not alive:
+            counts[key] = failures.get(key, 0) + 1
+    return counts
+
+
+def _partition(
+    job: dict, quarantined: typing.Collection[str], mode: str
+) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    """Split a job's static_configs into the healthy and the quarantined targets."""
+    healthy = []
+    sick = []
+    for static_config in job["static_configs"]:
+        keep = []
+        moved = []
+        for target in static_config["targets"]:
+            if target_key(job["job_name"], target) in quarantined:
+                moved.append(target)
+            else:
+                keep.append(target)
+        if not moved:
+            healthy.append(static_config)
+            continue
+        if keep:
+            healthy.append(dict(static_config, targets=keep))
+
+        labels = static_config.get("labels", {})
+        if mode == "label":
+            labels = dict(labels, **{QUARANTINE_LABEL: "true"})
+        moved_config: typing.Dict[str, typing.Any] = {"targets": moved}
+        if labels:
+            moved_config["labels"] = labels
+        sick.append(moved_config)
+    return healthy, sick
+
+
+def quarantine(
+    jobs: typing.List[dict],
+    quarantined: typing.Collection[str],
+    mode: str,
+    job_overrides: typing.Optional[typing.Mapping[str, typing.Any]] = None,
+) -> typing.List[dict]:
+    """Move quarantined targets out of their jobs, or label them.
+
+    Args:
+        jobs: rendered scrape jobs.
+        quarantined: keys (see target_key) of the targets to quarantine.
+        mode: "job" moves the targets into a `<job>_quarantine` job with `job_overrides`
+            applied, e.g. a longer scrape interval; "label" tags them `quarantined="true"`.
+        job_overrides: options set on quarantine jobs.
+    """
+    if not quarantined:
+        return jobs
+
+    result = []
+    for job in jobs:
+        healthy, sick = _partition(job, quarantined, mode)
+        if not sick:
+            result.append(job)
+        elif mode == "label":
+            result.append(dict(job, static_configs=healthy + sick))
+        else:
+            if healthy:
+                result.append(dict(job, static_configs=healthy))
+            name = "{}_quarantine".format(job["job_name"])
+            result.append(dict(job, **(job_overrides or {}), job_name=name, static_configs=sick))
+    return result
@@ -0,0 +1,184 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Parsing and validation of Prometheus scrape config values."""
+
+import re
+import typing
+
+# https://prometheus.io/docs/prometheus/latest/configuration/configuration/#duration
+_DURATION = re.compile(
+    r"(?:(\d+)y)?(?:(\d+)w)?(?:(\d+)d)?(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?(?:(\d+)ms)?"
+)
+_DURATION_UNITS_MS = (
+    365 * 24 * 3600 * 1000,
+    7 * 24 * 3600 * 1000,
+    24 * 3600 * 1000,
+    3600 * 1000,
+    60 * 1000,
+    1000,
+    1,
+)
+# https://prometheus.io/docs/prometheus/latest/configuration/configuration/#size
+_SIZE = re.compile(r"(\d+)(B|KB|MB|GB|TB|PB|EB)")
+_SIZE_UNITS = {
+    unit: 1024**power for power, unit in enumerate(("B", "KB", "MB", "GB", "TB", "PB", "EB"))
+}
+
+
+def parse_duration(value: typing.Any) -> int:
+    """Parse a Prometheus duration (e.g. "1m30s") into milliseconds.
+
+    Raises:
+        ValueError: if the value is not a valid duration.
+    """
+    if not isinstance(value, str):
+        # e.g. an unquoted number in a YAML `jobs` entry
+        raise ValueError('must be a duration string, e.g. "30s", got {!r}'.format(value))
+    if value == "0":
+        return 0
+    if not value or not (match := _DURATION.fullmatch(value)):
+        raise ValueError("invalid duration {!r}".format(value))
+    return sum(int(n) * unit for n, unit in zip(match.groups(), _DURATION_UNITS_MS) if n)
+
+
+def parse_size(value: typing.Any) -> int:
+    """Parse a Prometheus size (e.g. "10MB") into bytes.
+
+    Raises:
+        ValueError: if the value is not a valid size.
+    """
+    if not isinstance(value, str):
+        raise ValueError('must be a size string, e.g. "10MB", got {!r}'.format(value))
+    if not (match := _SIZE.fullmatch(value)):
+        raise ValueError("invalid size {!r}".format(value))
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2)]
+
+
+def parse_limit(value: int) -> int:
+    """Validate a Prometheus ingestion limit, where 0 means no limit.
+
+    Raises:
+        ValueError: if the value is not a non-negative integer.
+    """
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError("must be a non-negative integer, got {!r}".format(value))
+    return value
+
+
+# Scrape protocol names, and the media type Prometheus asks for with each of them
+SCRAPE_PROTOCOLS = {
+    "PrometheusProto": (
+        "application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;"
+        "encoding=delimited"
+    ),
+    "OpenMetricsText1.0.0": "application/openmetrics-text;version=1.0.0",
+    "OpenMetricsText0.0.1": "application/openmetrics-text;version=0.0.1",
+    "PrometheusText1.0.0": "text/plain;version=1.0.0",
+    "PrometheusText0.0.4": "text/plain;version=0.0.4",
+}
+
+
+def parse_protocols(value: typing.Any) -> typing.List[str]:
+    """Parse scrape protocols, in order of preference: a list, or a comma separated string.
+
+    Raises:
+        ValueError: if a protocol is unknown or listed twice, or none is listed.
+    """
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(",") if item.strip()]
+    if not isinstance(value, list) or not value:
+        raise ValueError("must list at least one of {}".format(", ".join(SCRAPE_PROTOCOLS)))
+    for protocol in value:
+        if protocol not in SCRAPE_PROTOCOLS:
+            raise ValueError(
+                "unknown protocol {!r}, expected one of {}".format(
+                    protocol, ", ".join(SCRAPE_PROTOCOLS)
+                )
+            )
+    if len(set(value)) != len(value):
+        raise ValueError("protocols must not be listed twice")
+    return value
+
+
+SCRAPE_OPTIONS: typing.Dict[str, typing.Callable[[typing.Any], int]] = {
+    "scrape_interval": parse_duration,
+    "scrape_timeout": parse_duration,
+    "sample_limit": parse_limit,
+    "label_limit": parse_limit,
+    "label_name_length_limit": parse_limit,
+    "label_value_length_limit": parse_limit,
+}
+# Prometheus' default global scrape_interval, which a job without its own interval inherits,
+# unless the Prometheus operator configured another one
+DEFAULT_SCRAPE_INTERVAL = "1m"
+# Likewise for scrape_timeout
+DEFAULT_SCRAPE_TIMEOUT = "10s"
+
+# Job fields the prometheus_scrape charm library (charms.prometheus_k8s.v0), which Prometheus
+# charms read scrape_jobs with, passes on to Prometheus: its ALLOWED_KEYS. It silently drops
+# any other field. tests/integration checks this against a deployed Prometheus.
+CONSUMER_KEYS = frozenset(
+    (
+        "job_name",
+        "metrics_path",
+        "static_configs",
+        "scrape_interval",
+        "scrape_timeout",
+        "proxy_url",
+        "relabel_configs",
+        "metric_relabel_configs",
+        "sample_limit",
+        "label_limit",
+        "label_name_length_limit",
+        "label_value_length_limit",
+        "scheme",
+        "basic_auth",
+        "tls_config",
+        "authorization",
+        "params",
+    )
+)
+
+
+def dropped_keys(jobs: typing.Iterable[typing.Mapping[str, typing.Any]]) -> typing.List[str]:
+    """The fields of rendered jobs that Prometheus charms drop (see CONSUMER_KEYS), sorted."""
+    return sorted({key for job in jobs for key in job} - CONSUMER_KEYS)
+
+
+def scrape_options(
+    config: typing.Mapping[str, typing.Any],
+) -> typing.Tuple[typing.Dict[str, typing.Any], typing.List[str]]:
+    """Collect and validate the scrape interval, timeout and limits from config.
+
+    Unset options (and limits set to 0, i.e. no limit) are left out, so that Prometheus or
+    scrape-config defaults apply.
+
+    Returns:
+        The scrape job fields, and a description of each invalid option.
+    """
+    options: typing.Dict[str, typing.Any] = {}
+    parsed: typing.Dict[str, int] = {}
+    errors = []
+    for option, parse in SCRAPE_OPTIONS.items():
+        if (value := config.get(option)) in (None, ""):
+            continue
+        try:
+            parsed[option] = parse(value)
+        except ValueError as e:
+            errors.append("{}: {}".format(option, e))
+        else:
+            if value != 0:
+                options[option] = value
+
+    if parsed.get("scrape_interval") == 0:
+        errors.append("scrape_interval: must be greater than zero")
+    interval = parsed.get("scrape_interval", parse_duration(DEFAULT_SCRAPE_INTERVAL))
+    if parsed.get("scrape_timeout", 0) > interval:
+        errors.append(
+            "scrape_timeout: must not be greater than scrape_interval, {} by default".format(
+                DEFAULT_SCRAPE_INTERVAL
+            )
+        )
+
+    return options, errors
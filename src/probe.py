@@ -0,0 +1,288 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Concurrent HTTP probing of scrape targets, using the settings of a rendered scrape job."""
+
+import asyncio
+import base64
+import logging
+import os
+import time
+import typing
+from urllib.parse import urlencode
+
+from exporter import exporter_of
+
+if typing.TYPE_CHECKING:
+    import ssl
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "prometheus-scrape-target-k8s-probe"
+
+BodyConsumer = typing.Callable[[bytes], None]
+# Called with the (lower-cased) response headers, before the body is streamed
+HeadersConsumer = typing.Callable[[typing.Mapping[str, str]], None]
+
+# Error of the targets left unprobed once the time allowed for all of them ran out
+NOT_PROBED = "not probed: out of time"
+
+
+class ProbeResult(typing.NamedTuple):
+    """Outcome of a single probe; timings are in seconds, sizes in bytes."""
+
+    target: str
+    status: typing.Optional[int] = None
+    ttfb: typing.Optional[float] = None
+    latency: typing.Optional[float] = None
+    body_size: int = 0
+    error: str = ""
+
+    @property
+    def up(self) -> bool:
+        """Whether the target answered with a 2xx status."""
+        return self.status is not None and 200 <= self.status < 300
+
+    @property
+    def probed(self) -> bool:
+        """Whether the target was probed at all, rather than skipped for lack of time."""
+        return self.error != NOT_PROBED
+
+    def as_dict(self) -> dict:
+        """Compact, JSON serialisable form (timings in milliseconds)."""
+        result: typing.Dict[str, typing.Any] = {"target": self.target, "up": self.up}
+        if self.status is not None:
+            result["status"] = self.status
+        if self.ttfb is not None:
+            result["ttfb_ms"] = round(self.ttfb * 1000, 1)
+        if self.latency is not None:
+            result["latency_ms"] = round(self.latency * 1000, 1)
+        if self.body_size:
+            result["body_bytes"] = self.body_size
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+class ScrapeRequest:
+    """How to request metrics from a target, derived from a Prometheus scrape job."""
+
+    def __init__(self, job: dict):
+        self.scheme = job.get("scheme", "http")
+        path = job.get("metrics_path", "/metrics")
+        if params := job.get("params"):
+            path += "?" + urlencode(params, doseq=True)
+        self.path = path
+        # a multi-target exporter is scraped in place of each target, which it is passed
+        self.exporter = exporter_of(job)
+
+        self.headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        if basic_auth := job.get("basic_auth"):
+            credentials = "{}:{}".format(basic_auth["username"], basic_auth.get("password", ""))
+            self.headers["Authorization"] = "Basic " + base64.b64encode(
+                credentials.encode()
+            ).decode("ascii")
+
+        tls_config = job.get("tls_config", {})
+        self.server_name = tls_config.get("server_name")
+        self.ssl = _ssl_context(tls_config) if self.scheme == "https" else None
+
+    def address(self, target: str) -> str:
+        """The host[:port] to connect to for a target."""
+        return self.exporter or target
+
+    def path_for(self, target: str) -> str:
+        """The request path for a target."""
+        if not self.exporter:
+            return self.path
+        separator = "&" if "?" in self.path else "?"
+        return self.path + separator + urlencode({"target": target})
+
+
+def _ssl_context(tls_config: dict) -> "ssl.SSLContext":
+    """Build a client TLS context from a job's tls_config.
+
+    The file paths in tls_config are meant for Prometheus; they are only used if they also
+    exist locally.
+    """
+    # imported here, as loading OpenSSL slows down every hook while only https probes need it
+    import ssl
+
+    ca_file = tls_config.get("ca_file")
+    if ca_file and not os.path.exists(ca_file):
+        logger.warning("CA file %s not found locally; using system CAs", ca_file)
+        ca_file = None
+    context = ssl.create_default_context(cafile=ca_file)
+
+    cert_file, key_file = tls_config.get("cert_file"), tls_config.get("key_file")
+    if cert_file and key_file and os.path.exists(cert_file) and os.path.exists(key_file):
+        context.load_cert_chain(cert_file, key_file)
+
+    if tls_config.get("insecure_skip_verify"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def split_host_port(target: str, default_port: int) -> typing.Tuple[str, int]:
+    """Split a validated host[:port] target, including bracketed IPv6 addresses."""
+    if target.startswith("["):
+        host, _, rest = target[1:].partition("]")
+        port = rest[1:] if rest.startswith(":") else ""
+    else:
+        host, _, port = target.rpartition(":") if ":" in target else (target, "", "")
+    return host, int(port) if port else default_port
+
+
+async def _iter_body(
+    reader: asyncio.StreamReader, headers: typing.Mapping[str, str]
+) -> typing.AsyncIterator[bytes]:
+    """Yield the response body as it arrives, undoing chunked transfer encoding."""
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while size := int((await reader.readline()).split(b";", 1)[0], 16):
+            yield await reader.readexactly(size)
+            await reader.readline()
+        return
+
+    remaining = int(headers["content-length"]) if "content-length" in headers else -1
+    while remaining:
+        chunk = await reader.read(65536 if remaining < 0 else min(remaining, 65536))
+        if not chunk:
+            return
+        if remaining > 0:
+            remaining -= len(chunk)
+        yield chunk
+
+
+async def fetch(
+    target: str,
+    request: ScrapeRequest,
+    timeout: float,
+    on_chunk: typing.Optional[BodyConsumer] = None,
+    headers: typing.Optional[typing.Mapping[str, str]] = None,
+    on_headers: typing.Optional[HeadersConsumer] = None,
+    read_body: bool = True,
+) -> ProbeResult:
+    """Scrape one target, streaming the body to `on_chunk` rather than buffering it.
+
+    Args:
+        target: host[:port] to scrape.
+        request: request settings shared by all targets of a job.
+        timeout: seconds allowed for the whole exchange.
+        on_chunk: called with each piece of the decoded body.
+        headers: extra request headers, overriding the defaults.
+        on_headers: called with the response headers.
+        read_body: whether to read the body; if not, the connection is closed once the
+            headers arrive, and the latency is the time taken to receive them.
+    """
+    start = time.perf_counter()
+    ttfb = None
+    status = None
+    body_size = 0
+    writer = None
+
+    async def exchange() -> None:
+        nonlocal ttfb, status, body_size, writer
+        address = request.address(target)
+        host, port = split_host_port(address, 443 if request.ssl else 80)
+        reader, writer = await asyncio.open_connection(
+            host,
+            port,
+            ssl=request.ssl,
+            server_hostname=(request.server_name or host) if request.ssl else None,
+        )
+        lines = [
+            "GET {} HTTP/1.1".format(request.path_for(target)),
+            "Host: {}".format(address),
+        ]
+        lines.extend(
+            "{}: {}".format(k, v) for k, v in {**request.headers, **(headers or {})}.items()
+        )
+        lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        ttfb = time.perf_counter() - start
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            key, _, value = line.decode("latin-1").partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        if on_headers:
+            on_headers(response_headers)
+        if not read_body:
+            return
+
+        async for chunk in _iter_body(reader, response_headers):
+            body_size += len(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+
+    try:
+        # wait_for rather than asyncio.timeout, which needs Python 3.11
+        await asyncio.wait_for(exchange(), timeout)
+    except asyncio.TimeoutError:
+        error = "timeout after {}s".format(timeout)
+        return ProbeResult(target, status, ttfb, None, body_size, error)
+    except (OSError, ValueError, IndexError, asyncio.IncompleteReadError) as e:
+        return ProbeResult(target, status, ttfb, None, body_size, str(e) or type(e).__name__)
+    finally:
+        if writer:
+            writer.close()
+
+    return ProbeResult(target, status, ttfb, time.perf_counter() - start, body_size)
+
+
+async def _probe_all(
+    jobs: typing.Iterable[dict],
+    concurrency: int,
+    timeout: float,
+    consumer: typing.Optional[typing.Callable[[dict, str], BodyConsumer]],
+    read_body: bool,
+    total_timeout: typing.Optional[float],
+) -> typing.List[ProbeResult]:
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    deadline = None if total_timeout is None else loop.time() + total_timeout
+
+    async def bounded(job: dict, target: str, request: ScrapeRequest) -> ProbeResult:
+        async with semaphore:
+            left = timeout if deadline is None else min(timeout, deadline - loop.time())
+            if left <= 0:
+                return ProbeResult(target, error=NOT_PROBED)
+            on_chunk = consumer(job, target) if consumer else None
+            result = await fetch(target, request, left, on_chunk, read_body=read_body)
+            if left < timeout and result.error.startswith("timeout"):
+                return ProbeResult(target, error=NOT_PROBED)
+            return result
+
+    tasks = []
+    for job in jobs:
+        request = ScrapeRequest(job)
+        for static_config in job.get("static_configs", []):
+            tasks.extend(bounded(job, target, request) for target in static_config["targets"])
+    return list(await asyncio.gather(*tasks))
+
+
+def probe_jobs(
+    jobs: typing.Iterable[dict],
+    concurrency: int = 100,
+    timeout: float = 5.0,
+    consumer: typing.Optional[typing.Callable[[dict, str], BodyConsumer]] = None,
+    read_body: bool = True,
+    total_timeout: typing.Optional[float] = None,
+) -> typing.List[ProbeResult]:
+    """Probe every target of the given scrape jobs concurrently.
+
+    Args:
+        jobs: rendered Prometheus scrape jobs.
+        concurrency: maximum number of probes in flight.
+        timeout: seconds allowed per target.
+        consumer: called with a job and one of its targets before it is probed; returns the
+            callable that the target's response body is streamed to.
+        read_body: whether to read the response bodies, or only the status and headers.
+        total_timeout: seconds allowed for all the targets; a target not probed by then, or
+            cut short by it, is reported with the NOT_PROBED error rather than as down.
+    """
+    return asyncio.run(_probe_all(jobs, concurrency, timeout, consumer, read_body, total_timeout))
@@ -0,0 +1,273 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Comparison of the bytes transferred and decode time of each scrape protocol and encoding."""
+
+import asyncio
+import time
+import typing
+import zlib
+
+from cardinality import ExpositionAnalyzer
+from options import SCRAPE_PROTOCOLS
+from probe import ScrapeRequest, fetch
+
+ENCODINGS = ("identity", "gzip")
+_PROTOBUF_TYPE = "application/vnd.google.protobuf"
+
+
+def _varint(data: bytes, position: int) -> typing.Tuple[typing.Optional[int], int]:
+    """Read a protobuf varint; the value is None if `data` ends before it does."""
+    value = 0
+    shift = 0
+    while position < len(data):
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+    return None, position
+
+
+class DelimitedProtobuf:
+    """Walk length-delimited MetricFamily messages, counting families and metrics.
+
+    Only the top-level fields of each message are decoded, which is enough to check framing
+    without depending on generated protobuf code. A partial message is carried over to the
+    next chunk.
+    """
+
+    def __init__(self):
+        self.families = 0
+        self.metrics = 0
+        self._partial = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """Decode all complete messages in `chunk`, keeping any trailing partial message."""
+        data = self._partial + chunk
+        position = 0
+        while True:
+            length, start = _varint(data, position)
+            if length is None or start + length > len(data):
+                break
+            self._message(data, start, start + length)
+            position = start + length
+        self._partial = data[position:]
+
+    def close(self) -> None:
+        """Check that the body did not end in the middle of a message."""
+        if self._partial:
+            raise ValueError("truncated protobuf message")
+
+    def _message(self, data: bytes, position: int, end: int) -> None:
+        self.families += 1
+        while position < end:
+            key, position = _varint(data, position)
+            if key is None:
+                raise ValueError("truncated protobuf field")
+            wire_type = key & 7
+            if wire_type == 0:
+                _, position = _varint(data, position)
+            elif wire_type == 1:
+                position += 8
+            elif wire_type == 2:
+                length, position = _varint(data, position)
+                position += length or 0
+                # field 4 of MetricFamily is the repeated Metric
+                self.metrics += key >> 3 == 4
+            elif wire_type == 5:
+                position += 4
+            else:
+                raise ValueError("invalid protobuf wire type {}".format(wire_type))
+        if position != end:
+            raise ValueError("protobuf field overruns its message")
+
+
+class Decoder:
+    """Decompress and parse a response body as it streams in, timing only that work.
+
+    The parser is picked from the response Content-Type, so a target that ignores the
+    requested protocol is measured in the format it actually served.
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.content_type = ""
+        self.content_encoding = ""
+        self._inflate = None
+        self._parser: typing.Union[DelimitedProtobuf, ExpositionAnalyzer] = ExpositionAnalyzer()
+
+    def start(self, headers: typing.Mapping[str, str]) -> None:
+        """Pick the decompressor and parser for a response."""
+        self.content_type = headers.get("content-type", "")
+        self.content_encoding = headers.get("content-encoding", "identity")
+        if self.content_encoding == "gzip":
+            self._inflate = zlib.decompressobj(wbits=31)
+        if self.content_type.startswith(_PROTOBUF_TYPE):
+            self._parser = DelimitedProtobuf()
+
+    def feed(self, chunk: bytes) -> None:
+        """Decode one piece of the body."""
+        start = time.perf_counter()
+        try:
+            if self._inflate:
+                chunk = self._inflate.decompress(chunk)
+            self._parser.feed(chunk)
+        except zlib.error as e:
+            raise ValueError("invalid gzip body: {}".format(e)) from e
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def close(self) -> None:
+        """Decode whatever is left once the body has ended."""
+        start = time.perf_counter()
+        try:
+            if self._inflate:
+                self._parser.feed(self._inflate.flush())
+                if not self._inflate.eof:
+                    raise ValueError("truncated gzip body")
+            self._parser.close()
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    @property
+    def samples(self) -> int:
+        """Series in a text exposition, or metrics in a protobuf one."""
+        if isinstance(self._parser, DelimitedProtobuf):
+            return self._parser.metrics
+        return self._parser.series
+
+
+async def _measure(
+    job_name: str,
+    target: str,
+    request: ScrapeRequest,
+    protocol: str,
+    encoding: str,
+    timeout: float,
+) -> dict:
+    decoder = Decoder()
+    headers = {"Accept": SCRAPE_PROTOCOLS[protocol], "Accept-Encoding": encoding}
+    result = await fetch(target, request, timeout, decoder.feed, headers, decoder.start)
+    error = result.error
+    if not error and not result.up:
+        error = "HTTP {}".format(result.status)
+    if not error:
+        try:
+            decoder.close()
+        except ValueError as e:
+            error = str(e)
+
+    measurement: typing.Dict[str, typing.Any] = {
+        "job": job_name,
+        "target": target,
+        "protocol": protocol,
+        "encoding": encoding,
+    }
+    if error:
+        measurement["error"] = error
+        return measurement
+    measurement.update(
+        {
+            "bytes": result.body_size,
+            "decode_ms": round(decoder.elapsed * 1000, 2),
+            "samples": decoder.samples,
+            "content_type": decoder.content_type,
+            # the target may ignore Accept, or compress regardless of Accept-Encoding
+            "served": (
+                decoder.content_type.partition(";")[0]
+                == SCRAPE_PROTOCOLS[protocol].partition(";")[0]
+                and decoder.content_encoding == encoding
+            ),
+        }
+    )
+    return measurement
+
+
+async def _compare_all(
+    jobs: typing.Iterable[dict],
+    protocols: typing.Sequence[str],
+    concurrency: int,
+    timeout: float,
+) -> typing.List[dict]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(
+        job_name: str, target: str, request: ScrapeRequest, protocol: str, encoding: str
+    ) -> dict:
+        async with semaphore:
+            return await _measure(job_name, target, request, protocol, encoding, timeout)
+
+    tasks = []
+    for job in jobs:
+        request = ScrapeRequest(job)
+        for static_config in job.get("static_configs", []):
+            for target in static_config["targets"]:
+                tasks.extend(
+                    bounded(job["job_name"], target, request, protocol, encoding)
+                    for protocol in protocols
+                    for encoding in ENCODINGS
+                )
+    return list(await asyncio.gather(*tasks))
+
+
+def compare_protocols(
+    jobs: typing.Iterable[dict],
+    protocols: typing.Sequence[str] = tuple(SCRAPE_PROTOCOLS),
+    concurrency: int = 10,
+    timeout: float = 60.0,
+) -> typing.List[dict]:
+    """Scrape every target once per protocol and encoding, measuring each response.
+
+    Args:
+        jobs: rendered Prometheus scrape jobs.
+        protocols: the scrape protocols to try, see SCRAPE_PROTOCOLS.
+        concurrency: maximum number of requests in flight.
+        timeout: seconds allowed per request.
+
+    Returns:
+        One measurement per target, protocol and encoding, in that order: the bytes
+        transferred, the decode time, and whether the target served what was asked for; or
+        the error.
+    """
+    return asyncio.run(_compare_all(jobs, protocols, concurrency, timeout))
+
+
+def cheapest(measurements: typing.Iterable[dict]) -> typing.Dict[str, dict]:
+    """Pick, per job, the protocol and encoding transferring the fewest bytes.
+
+    Only candidates that every target of the job served as requested are considered; decode
+    time breaks ties.
+
+    Returns:
+        Per job, the Prometheus settings selecting the cheapest protocol and encoding, and the
+        totals over all of the job's targets.
+    """
+    totals: typing.Dict[str, typing.Dict[typing.Tuple[str, str], typing.List[float]]] = {}
+    rejected: typing.Set[typing.Tuple[str, str, str]] = set()
+    for measurement in measurements:
+        job = measurement["job"]
+        candidate = (measurement["protocol"], measurement["encoding"])
+        if "error" in measurement or not measurement["served"]:
+            rejected.add((job, *candidate))
+            continue
+        total = totals.setdefault(job, {}).setdefault(candidate, [0, 0.0])
+        total[0] += measurement["bytes"]
+        total[1] += measurement["decode_ms"]
+
+    recommended = {}
+    for job, candidates in totals.items():
+        eligible = {c: t for c, t in candidates.items() if (job, *c) not in rejected}
+        if not eligible:
+            continue
+        (protocol, encoding), (size, decode_ms) = min(
+            eligible.items(), key=lambda item: (item[1][0], item[1][1])
+        )
+        recommended[job] = {
+            "scrape_protocols": [protocol],
+            "enable_compression": encoding == "gzip",
+            "bytes": size,
+            "decode_ms": round(decode_ms, 2),
+        }
+    return recommended
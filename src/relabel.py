@@ -0,0 +1,231 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Validation of Prometheus relabel configs, mirroring the checks Prometheus performs on load."""
+
+import functools
+import re
+import typing
+
+LABEL_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+ACTIONS = (
+    "replace",
+    "keep",
+    "drop",
+    "keepequal",
+    "dropequal",
+    "hashmod",
+    "labelmap",
+    "labeldrop",
+    "labelkeep",
+    "lowercase",
+    "uppercase",
+)
+
+DEFAULT_REGEX = "(.*)"
+FIELDS = (
+    "source_labels",
+    "separator",
+    "target_label",
+    "regex",
+    "modulus",
+    "replacement",
+    "action",
+)
+
+# Perl syntax Go's RE2 engine rejects, although Python's re accepts it: backreferences,
+# lookarounds, atomic groups and conditionals; possessive quantifiers are found as they come.
+_NOT_RE2_GROUP = re.compile(r"\(\?(?:P=|<?[=!]|>|\()")
+_NOT_RE2_ESCAPE = re.compile(r"\\[1-9Z]")
+
+_QUANTIFIER = re.compile(r"[*+?]|\{\d+(?:,\d*)?\}")
+# A character class, in which nothing but escapes and the closing bracket is special
+_CLASS = re.compile(r"\[\^?\]?(?:\[:\^?[a-z]+:\]|\\.|[^\]])*\]", re.DOTALL)
+# Flags set for the rest of the enclosing group, e.g. `(?i)`
+_INLINE_FLAGS = re.compile(r"\(\?([a-zA-Z-]+)\)")
+
+
+def _unsupported(pattern: str, syntax: str) -> ValueError:
+    return ValueError(
+        "regex {!r} uses {!r}, which is not supported by RE2".format(pattern, syntax)
+    )
+
+
+def _python_syntax(pattern: str) -> str:  # noqa: C901
+    """Translate an RE2 pattern to Python's syntax, rejecting what RE2 does not support.
+
+    RE2 applies inline flags such as `(?i)` to the rest of their group, wherever they appear,
+    while Python only accepts them at the very start: they become scoped flag groups, closed
+    and reopened around every alternative.
+
+    Raises:
+        ValueError: if the pattern relies on features RE2 does not support.
+    """
+    translated = []
+    # the inline flags of each open group, the whole pattern first
+    groups: typing.List[typing.List[str]] = [[]]
+    index = 0
+    while index < len(pattern):
+        if match := (
+            _NOT_RE2_ESCAPE.match(pattern, index) or _NOT_RE2_GROUP.match(pattern, index)
+        ):
+            raise _unsupported(pattern, match.group())
+        char = pattern[index]
+        token = char
+        if char == "\\":
+            token = pattern[index : index + 2]
+        elif char == "[":
+            # unclosed classes are left to Python to report
+            if match := _CLASS.match(pattern, index):
+                token = match.group()
+        elif match := _INLINE_FLAGS.match(pattern, index):
+            groups[-1].append(match.group(1))
+            translated.append("(?{}:".format(match.group(1)))
+            index = match.end()
+            continue
+        elif char == "(":
+            groups.append([])
+        elif char == ")" and len(groups) > 1:
+            translated.append(")" * len(groups.pop()))
+        elif char == "|":
+            flags = groups[-1]
+            translated.append(")" * len(flags) + "|" + "".join("(?{}:".format(f) for f in flags))
+            index += 1
+            continue
+        elif match := _QUANTIFIER.match(pattern, index):
+            token = match.group()
+            if pattern.startswith("+", match.end()):
+                raise _unsupported(pattern, token + "+")
+        translated.append(token)
+        index += len(token)
+    translated.append(")" * sum(map(len, groups)))
+    return "".join(translated)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_regex(pattern: str) -> "re.Pattern[str]":
+    """Compile a relabel regex the way Prometheus does: fully anchored, RE2 syntax only.
+
+    Compiled patterns are cached, as the same regexes are validated on every hook.
+
+    Raises:
+        ValueError: if the pattern is invalid or relies on features RE2 does not support.
+    """
+    try:
+        return re.compile("^(?:{})$".format(_python_syntax(pattern)))
+    except re.error as e:
+        raise ValueError("invalid regex {!r}: {}".format(pattern, e)) from e
+
+
+def _check_config(config: typing.Any) -> typing.List[str]:  # noqa: C901
+    """Check a single relabel config; returns the problems found."""
+    if not isinstance(config, dict):
+        return ["must be a mapping"]
+    if unknown := set(config) - set(FIELDS):
+        return ["unknown fields: {}".format(", ".join(sorted(unknown)))]
+
+    errors = []
+    action = config.get("action", "replace")
+    if action not in ACTIONS:
+        return ["unknown action {!r}".format(action)]
+
+    source_labels = config.get("source_labels", [])
+    if not isinstance(source_labels, list) or not all(
+        isinstance(label, str) and LABEL_NAME.fullmatch(label) for label in source_labels
+    ):
+        errors.append("source_labels must be a list of label names")
+
+    try:
+        compile_regex(str(config.get("regex", DEFAULT_REGEX)))
+    except ValueError as e:
+        errors.append(str(e))
+
+    target_label = config.get("target_label")
+    if action in ("replace", "hashmod", "lowercase", "uppercase", "keepequal", "dropequal"):
+        if not target_label:
+            errors.append("target_label is required for action {!r}".format(action))
+        elif not (
+            LABEL_NAME.fullmatch(str(target_label))
+            or action == "replace"
+            and "$" in str(target_label)
+        ):
+            errors.append("invalid target_label {!r}".format(target_label))
+
+    if action == "hashmod" and not (
+        isinstance(config.get("modulus"), int) and config["modulus"] > 0
+    ):
+        errors.append("modulus must be a positive integer for action 'hashmod'")
+
+    if action in ("labeldrop", "labelkeep"):
+        if set(config) - {"regex", "action"}:
+            errors.append("only regex may be set for action {!r}".format(action))
+    elif action in ("keepequal", "dropequal"):
+        if any(field in config for field in ("regex", "modulus", "separator", "replacement")):
+            errors.append("only source_labels and target_label may be set for {!r}".format(action))
+
+    return errors
+
+
+def validate_relabel_configs(configs: typing.Any) -> typing.List[str]:
+    """Check a list of relabel configs.
+
+    Returns:
+        A description of every problem found, each prefixed with the rule's index.
+    """
+    if not isinstance(configs, list):
+        return ["must be a list of relabel configs"]
+    return [
+        "rule {}: {}".format(index, error)
+        for index, config in enumerate(configs)
+        for error in _check_config(config)
+    ]
+
+
+def split_patterns(value: str) -> typing.List[str]:
+    """Split a comma separated list of regexes, ignoring the commas that belong to a regex.
+
+    Commas inside a repetition such as "go_.{1,3}", a group, a character class, or escaped
+    with a backslash do not separate two regexes.
+    """
+    patterns = []
+    depth = 0
+    start = index = 0
+    while index < len(value):
+        char = value[index]
+        if match := (_CLASS.match(value, index) or _QUANTIFIER.match(value, index)):
+            index = match.end()
+            continue
+        if char == "\\":
+            index += 1
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif char == "," and not depth:
+            patterns.append(value[start:index])
+            start = index + 1
+        index += 1
+    patterns.append(value[start:])
+    return patterns
+
+
+def drop_metrics_rule(patterns: typing.Iterable[str]) -> typing.Optional[dict]:
+    """A single metric_relabel_configs rule dropping every metric name matching any pattern.
+
+    The patterns are joined into one alternation, so each series is matched against a single
+    (anchored) regex rather than one rule per pattern.
+
+    Raises:
+        ValueError: if any pattern is invalid.
+    """
+    if not (patterns := [pattern.strip() for pattern in patterns if pattern.strip()]):
+        return None
+    for pattern in patterns:
+        compile_regex(pattern)
+    regex = (
+        patterns[0]
+        if len(patterns) == 1
+        else "|".join("(?:{})".format(pattern) for pattern in patterns)
+    )
+    return {"source_labels": ["__name__"], "regex": regex, "action": "drop"}
@@ -0,0 +1,146 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Parallel, cached resolution of target hostnames into IP addresses."""
+
+import ipaddress
+import logging
+import queue
+import socket
+import threading
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Any callable mapping a hostname to its addresses, so that tests need no real DNS
+Resolver = typing.Callable[[str], typing.Iterable[str]]
+
+
+def system_resolver(host: str) -> typing.List[str]:
+    """Every address the system resolver returns for a host."""
+    return [str(info[4][0]) for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)]
+
+
+def join_address(host: str, port: int) -> str:
+    """The inverse of probe.split_host_port, with 0 as the default port."""
+    if ":" in host:
+        host = "[{}]".format(host)
+    return "{}:{}".format(host, port) if port else host
+
+
+def is_ip_address(host: str) -> bool:
+    """Whether a host is an IP address rather than a hostname."""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def _preferred(addresses: typing.Iterable[str]) -> str:
+    """Pick one address deterministically, IPv4 first, so that payloads do not churn."""
+    parsed = sorted(
+        {ipaddress.ip_address(address.partition("%")[0]) for address in addresses},
+        key=lambda address: (address.version, address),
+    )
+    return str(parsed[0]) if parsed else ""
+
+
+def _lookups(
+    hosts: typing.Collection[str], resolver: Resolver, concurrency: int, timeout: float
+) -> typing.Dict[str, str]:
+    """The preferred address of each host whose lookup completed within the timeout."""
+    pending: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+    for host in hosts:
+        pending.put(host)
+    results: typing.Dict[str, str] = {}
+
+    def work() -> None:
+        while True:
+            try:
+                host = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[host] = _preferred(resolver(host))
+            except (OSError, ValueError):
+                results[host] = ""
+
+    # daemon threads, as a lookup cannot be interrupted: the ones still running when the
+    # timeout expires are abandoned, rather than joined when the interpreter exits
+    workers = [
+        threading.Thread(target=work, name="resolve", daemon=True)
+        for _ in range(min(concurrency, len(hosts)))
+    ]
+    for worker in workers:
+        worker.start()
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        worker.join(max(0.0, deadline - time.monotonic()))
+    # results arriving from now on are discarded
+    return dict(results)
+
+
+def resolve_all(
+    hosts: typing.Collection[str],
+    resolver: Resolver,
+    concurrency: int = 64,
+    timeout: float = 5.0,
+) -> typing.Dict[str, str]:
+    """Resolve hosts in parallel, within an overall timeout.
+
+    Returns:
+        Each host mapped to its preferred address, or to "" if the lookup failed or did not
+        complete in time.
+    """
+    if not hosts:
+        return {}
+    finished = _lookups(hosts, resolver, concurrency, timeout)
+    resolved = {}
+    failed = []
+    for host in hosts:
+        resolved[host] = finished.get(host, "")
+        if not resolved[host]:
+            failed.append(host)
+    if failed:
+        logger.warning(
+            "Could not resolve %d of %d host(s), e.g. %s", len(failed), len(hosts), failed[0]
+        )
+    return resolved
+
+
+def resolve_cached(
+    hosts: typing.Collection[str],
+    cache: typing.Mapping[str, typing.Sequence[typing.Any]],
+    resolver: Resolver,
+    ttl: float,
+    now: float,
+    timeout: float = 5.0,
+) -> typing.Dict[str, typing.List[typing.Any]]:
+    """Resolve the hosts whose cache entries are missing or have expired.
+
+    Failed lookups are cached as well, so that an unresolvable host is retried once per TTL
+    rather than on every hook.
+
+    Args:
+        hosts: the hostnames to resolve.
+        cache: earlier results, as host -> [address, expiry timestamp].
+        resolver: callable returning the addresses of a host.
+        ttl: seconds a result stays valid.
+        now: the current timestamp.
+        timeout: seconds allowed for all lookups together.
+
+    Returns:
+        Entries for exactly the given hosts, in the same form as `cache`.
+    """
+    entries = {}
+    stale = []
+    for host in hosts:
+        if (entry := cache.get(host)) is not None and entry[1] > now:
+            entries[host] = list(entry)
+        else:
+            stale.append(host)
+    for host, address in resolve_all(stale, resolver, timeout=timeout).items():
+        entries[host] = [address, now + ttl]
+    return entries
@@ -0,0 +1,327 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Helpers for reading and combining scrape target lists."""
+
+import ipaddress
+import re
+import typing
+from pathlib import Path
+
+_LABEL_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+# node[001-250] numeric ranges (bracketed IPv6 addresses never look like this) and
+# web{a,b,c} alternations (label sets always contain `=`)
+_PATTERN = re.compile(r"\[(\d+)-(\d+)\]|\{([^{}=]*,[^{}=]*)\}")
+
+# host[:port], where host is an RFC 1123 hostname (which includes dotted IPv4 addresses) or a
+# bracketed IPv6 address; the few hosts this over-accepts are rejected in address_error.
+# Underscores are still accepted, as earlier versions did: see underscored_hostname
+_HOSTNAME_LABEL = r"[a-zA-Z0-9_](?:[a-zA-Z0-9_-]{0,61}[a-zA-Z0-9_])?"
+_ADDRESS = re.compile(
+    r"(?:({label}(?:\.{label})*\.?)|\[([0-9a-fA-F:.]+(?:%[\w.-]+)?)\])(?::([0-9]{{1,5}}))?".format(
+        label=_HOSTNAME_LABEL
+    )
+)
+_IPV4_OCTET = r"(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])"
+_IPV4 = re.compile(r"(?:{0}\.){{3}}{0}".format(_IPV4_OCTET))
+# URL parts that are not part of a target address, in the order they are reported
+_MISPLACED_PARTS = (
+    (("://",), "must not include a scheme"),
+    (("/", "?", "#"), "must not include a path or query"),
+    (("@",), "must not include credentials; use basic_auth"),
+)
+
+
+def split_targets(value: str) -> typing.Iterator[str]:
+    """Split a comma separated target list, ignoring commas inside a `{...}` label set.
+
+    Whitespace around each entry is dropped, so that "foo:1234, bar:5678" works too.
+
+    Args:
+        value: e.g. "foo:1234{rack=r1,role=db},bar:5678".
+    """
+    depth = 0
+    start = 0
+    for index, char in enumerate(value):
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth = max(depth - 1, 0)
+        elif char == "," and not depth:
+            yield value[start:index].strip()
+            start = index + 1
+    yield value[start:].strip()
+
+
+def parse_target(entry: str) -> typing.Tuple[str, typing.Dict[str, str]]:
+    """Split a target entry into its address and its own labels.
+
+    Args:
+        entry: an address, optionally followed by a label set, e.g. "foo:1234{rack=r1,role=db}".
+
+    Raises:
+        ValueError: if the label set is malformed.
+    """
+    if not entry.endswith("}"):
+        return entry, {}
+
+    address, _, label_set = entry[:-1].rpartition("{")
+    if "=" not in label_set and "," in label_set:
+        # a trailing alternation, e.g. "web{a,b}"
+        return entry, {}
+    labels = {}
+    for label in label_set.split(","):
+        key, sep, value = label.partition("=")
+        key = key.strip()
+        if not (sep and value and _LABEL_NAME.fullmatch(key)) or key.startswith("__"):
+            raise ValueError("invalid label {!r} in target {!r}".format(label, entry))
+        labels[key] = value.strip()
+    return address, labels
+
+
+def address_error(address: str) -> str:
+    """Why an address is not a valid scrape target; empty if it is valid.
+
+    A valid address is `host[:port]`, where host is an RFC 1123 hostname, an IPv4 address or
+    a bracketed IPv6 address, and port is in the 1-65535 range.
+    """
+    if not (match := _ADDRESS.fullmatch(address)):
+        return _diagnose(address)
+
+    hostname, ipv6, port = match.groups()
+    if port and not 0 < int(port) < 65536:
+        return "port {} out of range".format(port)
+    if ipv6 is not None:
+        try:
+            ipaddress.IPv6Address(ipv6)
+        except ValueError:
+            return "invalid IPv6 address"
+    elif len(hostname) > 253:
+        return "hostname longer than 253 characters"
+    elif hostname.rpartition(".")[2].isdigit() and not _IPV4.fullmatch(hostname):
+        # a hostname never ends in a numeric label, so this was meant as an IPv4 address
+        return "invalid IPv4 address"
+    return ""
+
+
+def underscored_hostname(address: str) -> bool:
+    """Whether a valid address has a hostname with an underscore, which RFC 1123 forbids.
+
+    Such hostnames are deprecated: they are still accepted, as many resolvers and Prometheus
+    itself do, but a later version may reject them.
+    """
+    return not address.startswith("[") and "_" in address.partition(":")[0]
+
+
+def _diagnose(address: str) -> str:
+    """Explain why an address does not have the `host[:port]` shape."""
+    if not address:
+        return "empty address"
+    for parts, reason in _MISPLACED_PARTS:
+        if any(part in address for part in parts):
+            return reason
+
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        if not rest.startswith(":") and rest:
+            return "invalid IPv6 address"
+        sep, port = rest[:1], rest[1:]
+    elif address.count(":") > 1:
+        return "IPv6 addresses must be enclosed in brackets"
+    else:
+        host, sep, port = address.partition(":")
+
+    if sep and not (port.isascii() and port.isdigit()):
+        return "invalid port {!r}".format(port)
+    if sep and not 0 < int(port) < 65536:
+        return "port {} out of range".format(port)
+    if address.startswith("["):
+        return "invalid IPv6 address"
+    return "invalid hostname {!r}".format(host)
+
+
+class TargetReport(typing.NamedTuple):
+    """The outcome of validating a target list.
+
+    Attributes:
+        targets: each valid address, mapped to its own labels; empty if anything is invalid.
+        invalid: each invalid entry (or expanded address), mapped to the reason.
+        duplicates: entries ignored because an earlier one has the same address.
+        error: why the list as a whole was rejected, e.g. because it expands too far.
+    """
+
+    targets: typing.Dict[str, typing.Dict[str, str]]
+    invalid: typing.Dict[str, str]
+    duplicates: typing.List[str]
+    error: str = ""
+
+
+def _valid(_: str) -> str:
+    return ""
+
+
+def validate_targets(  # noqa: C901
+    entries: typing.Iterable[str],
+    max_expanded: int,
+    check_addresses: bool = True,
+    address_check: typing.Optional[typing.Callable[[str], str]] = None,
+) -> TargetReport:
+    """Validate target entries in a single pass, expanding patterns on the way.
+
+    CIDR blocks, ranges and alternations are expanded lazily, up to `max_expanded` addresses
+    in total. An address listed explicitly takes precedence over the same address produced by
+    an expansion; otherwise the first entry for an address wins.
+
+    Args:
+        entries: target entries, each an address or pattern with optional labels.
+        max_expanded: the most addresses patterns may expand to.
+        check_addresses: whether to check each address, or trust that they were already
+            found valid.
+        address_check: why an address is invalid, or empty if it is valid; address_error by
+            default.
+    """
+    check = (address_check or address_error) if check_addresses else _valid
+    targets: typing.Dict[str, typing.Dict[str, str]] = {}
+    expanded = set()
+    invalid = {}
+    duplicates = []
+    budget = max_expanded
+    for entry in entries:
+        try:
+            address, labels = parse_target(entry)
+        except ValueError as e:
+            invalid[entry] = str(e)
+            continue
+
+        if not is_pattern(address):
+            if reason := check(address):
+                invalid[entry] = reason
+            elif address in expanded:
+                expanded.discard(address)
+                targets[address] = labels
+            elif address in targets:
+                duplicates.append(entry)
+            else:
+                targets[address] = labels
+            continue
+
+        try:
+            for expanded_address in expand(address):
+                budget -= 1
+                if budget < 0:
+                    error = "expanding {!r} exceeds max_expanded_targets ({})".format(
+                        entry, max_expanded
+                    )
+                    return TargetReport({}, invalid, duplicates, error)
+                if reason := check(expanded_address):
+                    invalid[expanded_address] = reason
+                elif expanded_address in expanded:
+                    duplicates.append(expanded_address)
+                elif expanded_address not in targets:
+                    targets[expanded_address] = labels
+                    expanded.add(expanded_address)
+        except ValueError as e:
+            invalid[entry] = str(e)
+
+    return TargetReport({} if invalid else targets, invalid, duplicates)
+
+
+def is_pattern(address: str) -> bool:
+    """Whether the address is a CIDR block, range or alternation to expand."""
+    return _is_cidr(address) or bool(_PATTERN.search(address))
+
+
+def _is_cidr(address: str) -> bool:
+    # only a slash in an IP host part makes a network; "foo:1234/metrics" or a scheme is left
+    # to address_error, which reports the path
+    if address.startswith("["):
+        return "/" in address.partition("]")[0]
+    host = address.partition(":")[0]
+    return "/" in host and host[:1].isdigit()
+
+
+def expand(address: str) -> typing.Iterator[str]:
+    """Lazily expand CIDR blocks, numeric ranges and alternations in an address.
+
+    - "10.0.0.0/30:9100" yields every host address of the network, with the port;
+      IPv6 networks are written in brackets, e.g. "[2001:db8::/126]:9100".
+    - "node[08-10]:9100" yields node08:9100, node09:9100 and node10:9100; a leading zero in
+      the start of the range sets the width.
+    - "web{a,b}:9100" yields weba:9100 and webb:9100.
+
+    Ranges and alternations can be combined, e.g. "rack[1-2]-node{a,b}:9100".
+
+    Raises:
+        ValueError: if a CIDR block or range is invalid.
+    """
+    if "/" in address:
+        return _expand_cidr(address)
+    return _expand_patterns(address)
+
+
+def _expand_cidr(address: str) -> typing.Iterator[str]:
+    if address.startswith("["):
+        network, _, port = address[1:].partition("]")
+        template = "[{}]" + port
+    else:
+        network, sep, port = address.partition(":")
+        template = "{}" + sep + port
+    # validate eagerly, so that errors are raised before the first address is consumed
+    hosts = ipaddress.ip_network(network, strict=False).hosts()
+    return (template.format(host) for host in hosts)
+
+
+def _expand_patterns(address: str) -> typing.Iterator[str]:
+    if not (match := _PATTERN.search(address)):
+        yield address
+        return
+
+    head, tail = address[: match.start()], address[match.end() :]
+    if alternatives := match.group(3):
+        values: typing.Iterable[str] = alternatives.split(",")
+    else:
+        first, last = match.group(1), match.group(2)
+        if int(first) > int(last):
+            raise ValueError("invalid range [{}-{}] in {!r}".format(first, last, address))
+        width = len(first) if first.startswith("0") else 0
+        values = (str(n).zfill(width) for n in range(int(first), int(last) + 1))
+
+    for value in values:
+        yield from _expand_patterns(head + value + tail)
+
+
+def group_by_labels(
+    targets: typing.Mapping[str, typing.Mapping[str, str]],
+    common_labels: typing.Optional[typing.Mapping[str, str]] = None,
+) -> typing.List[dict]:
+    """Render targets as the smallest list of static_configs, one per distinct label set.
+
+    Args:
+        targets: mapping of address to that target's own labels.
+        common_labels: labels applied to every target; a target's own labels take precedence.
+    """
+    groups: typing.Dict[tuple, dict] = {}
+    for address, own_labels in targets.items():
+        labels = {**common_labels, **own_labels} if common_labels else own_labels
+        key = tuple(sorted(labels.items()))
+        if (static_config := groups.get(key)) is None:
+            static_config = groups[key] = {"targets": []}
+            if labels:
+                static_config["labels"] = dict(labels)
+        static_config["targets"].append(address)
+    return list(groups.values())
+
+
+def iter_targets_file(path: typing.Union[str, Path]) -> typing.Iterator[str]:
+    """Lazily yield the targets listed in a newline-delimited file.
+
+    The file is read one line at a time, so its size does not affect memory usage. Blank lines
+    and lines starting with `#` are skipped.
+
+    Args:
+        path: file with one target per line.
+    """
+    with open(path, encoding="utf-8") as targets_file:
+        for line in targets_file:
+            if (target := line.strip()) and not target.startswith("#"):
+                yield target
@@ -0,0 +1,84 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Cost of the charm's own hooks: a rolling history of timings, target counts and payloads."""
+
+import typing
+
+# Hooks kept in the history; enough to compare before and after an upgrade
+HISTORY_SIZE = 50
+
+
+class HookStats(typing.NamedTuple):
+    """What one hook rendering the scrape jobs cost; timings are in milliseconds."""
+
+    event: str
+    version: str
+    timestamp: float
+    duration_ms: float
+    render_ms: float
+    jobs: int
+    valid_targets: int
+    invalid_targets: int
+    payload_bytes: int
+    relation_writes: int
+
+    def as_dict(self) -> dict:
+        """JSON serialisable form, which StoredState can also hold."""
+        return self._asdict()
+
+
+def recorded(
+    history: typing.Iterable[typing.Mapping[str, typing.Any]],
+    stats: HookStats,
+    size: int = HISTORY_SIZE,
+) -> typing.List[dict]:
+    """The history with `stats` appended, keeping only the last `size` hooks."""
+    return [*(dict(entry) for entry in history), stats.as_dict()][-size:]
+
+
+def summarize(history: typing.Iterable[typing.Mapping[str, typing.Any]]) -> dict:
+    """Aggregate the history per charm version, so that regressions stand out after upgrades.
+
+    Returns:
+        Per version: the number of hooks, the median and largest hook duration, the largest
+        payload, and the relation writes.
+    """
+    # imported here, as only the stats action summarizes the history
+    import statistics
+
+    by_version: typing.Dict[str, typing.List[typing.Mapping[str, typing.Any]]] = {}
+    for entry in history:
+        by_version.setdefault(entry["version"], []).append(entry)
+    return {
+        version: {
+            "hooks": len(entries),
+            "median_duration_ms": round(
+                statistics.median(entry["duration_ms"] for entry in entries), 1
+            ),
+            "max_duration_ms": max(entry["duration_ms"] for entry in entries),
+            "max_payload_bytes": max(entry["payload_bytes"] for entry in entries),
+            "relation_writes": sum(entry["relation_writes"] for entry in entries),
+        }
+        for version, entries in by_version.items()
+    }
+
+
+def _size(size: int) -> str:
+    """Human readable byte count, e.g. 12.3kB."""
+    if size < 1000:
+        return "{}B".format(size)
+    if size < 1000**2:
+        return "{:.1f}kB".format(size / 1000)
+    return "{:.1f}MB".format(size / 1000**2)
+
+
+def status_message(stats: HookStats) -> str:
+    """Concise summary of the published jobs for the active status."""
+    return "{} target{} in {} job{}; {} payload".format(
+        stats.valid_targets,
+        "" if stats.valid_targets == 1 else "s",
+        stats.jobs,
+        "" if stats.jobs == 1 else "s",
+        _size(stats.payload_bytes),
+    )
@@ -0,0 +1,135 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Latency tiers: slow or heavy targets moved into jobs with a longer interval and timeout."""
+
+import typing
+
+from health import target_key
+from options import parse_duration, parse_size
+
+# A target only leaves a tier for a faster one once its cost falls below this fraction of
+# the tier's threshold, so that a target measured around a threshold does not flap.
+TIER_HYSTERESIS = 0.8
+# Weight of the latest measurement in a target's smoothed cost
+SMOOTHING = 0.5
+
+
+class Tier(typing.NamedTuple):
+    """A tier: the targets reaching a latency or body size threshold, and how to scrape them."""
+
+    name: str
+    interval: str
+    timeout: str
+    latency: typing.Optional[float] = None
+    size: typing.Optional[int] = None
+
+    def reached(self, cost: typing.Sequence[float], factor: float = 1.0) -> bool:
+        """Whether a (latency in seconds, body size in bytes) cost reaches the threshold."""
+        if self.latency is not None:
+            return cost[0] >= self.latency * factor
+        return cost[1] >= typing.cast(int, self.size) * factor
+
+
+def parse_tiers(value: str) -> typing.List[Tier]:
+    """Parse comma separated name:threshold:interval[:timeout] tiers, slowest last.
+
+    The threshold is a duration, compared to the scrape latency, or a size, compared to the
+    response body; the timeout defaults to the interval.
+
+    Raises:
+        ValueError: if a tier is malformed, or two tiers share a name or an interval.
+    """
+    tiers = []
+    for spec in (spec.strip() for spec in value.split(",")):
+        parts = spec.split(":")
+        if len(parts) not in (3, 4) or not parts[0].isidentifier():
+            raise ValueError("invalid tier {!r}, expected name:threshold:interval".format(spec))
+        name, threshold, interval = parts[:3]
+        timeout = parts[3] if len(parts) == 4 else interval
+        if not (interval_ms := parse_duration(interval)):
+            raise ValueError("interval of tier {} must be greater than 0".format(name))
+        if not 0 < parse_duration(timeout) <= interval_ms:
+            raise ValueError(
+                "timeout of tier {} must be greater than 0 and within its interval".format(name)
+            )
+        try:
+            tier = Tier(name, interval, timeout, latency=parse_duration(threshold) / 1000)
+        except ValueError:
+            tier = Tier(name, interval, timeout, size=parse_size(threshold))
+        tiers.append((interval_ms, tier))
+
+    names = [tier.name for _, tier in tiers]
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate tier names")
+    if len({interval_ms for interval_ms, _ in tiers}) != len(tiers):
+        raise ValueError("tiers must have different intervals")
+    return [tier for _, tier in sorted(tiers)]
+
+
+def smoothed(
+    previous: typing.Optional[typing.Sequence[float]], latency: float, size: int
+) -> typing.List[float]:
+    """Exponentially weighted (latency, body size) cost, from the previous one if any."""
+    if previous is None:
+        return [latency, size]
+    return [
+        previous[0] + SMOOTHING * (latency - previous[0]),
+        previous[1] + SMOOTHING * (size - previous[1]),
+    ]
+
+
+def tier_of(
+    cost: typing.Sequence[float], tiers: typing.Sequence[Tier], current: typing.Optional[str]
+) -> typing.Optional[str]:
+    """The slowest tier whose threshold the cost reaches, if any.
+
+    The current tier is kept as long as the cost reaches TIER_HYSTERESIS of its threshold.
+    """
+    chosen = None
+    for tier in tiers:
+        if tier.reached(cost, TIER_HYSTERESIS if tier.name == current else 1.0):
+            chosen = tier.name
+    return chosen
+
+
+def tiered(
+    jobs: typing.List[dict], membership: typing.Mapping[str, str], tiers: typing.Sequence[Tier]
+) -> typing.List[dict]:
+    """Move targets into a `<job>_<tier>` job per tier, with the tier's interval and timeout.
+
+    Args:
+        jobs: rendered scrape jobs.
+        membership: tier name by target key (see target_key); targets without one stay put.
+        tiers: the configured tiers.
+    """
+    if not membership:
+        return jobs
+    names = {tier.name for tier in tiers}
+    result = []
+    for job in jobs:
+        by_tier: typing.Dict[typing.Optional[str], typing.List[dict]] = {}
+        for static_config in job["static_configs"]:
+            split: typing.Dict[typing.Optional[str], typing.List[str]] = {}
+            for target in static_config["targets"]:
+                name = membership.get(target_key(job["job_name"], target))
+                split.setdefault(name if name in names else None, []).append(target)
+            for name, targets in split.items():
+                by_tier.setdefault(name, []).append(dict(static_config, targets=targets))
+        if set(by_tier) <= {None}:
+            result.append(job)
+            continue
+        if None in by_tier:
+            result.append(dict(job, static_configs=by_tier[None]))
+        for tier in tiers:
+            if tier.name in by_tier:
+                result.append(
+                    dict(
+                        job,
+                        job_name="{}_{}".format(job["job_name"], tier.name),
+                        scrape_interval=tier.interval,
+                        scrape_timeout=tier.timeout,
+                        static_configs=by_tier[tier.name],
+                    )
+                )
+    return result
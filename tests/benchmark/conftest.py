@@ -0,0 +1,119 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Baseline tracking for the hook benchmarks.
+
+Measurements are compared against `baselines.json`; a benchmark fails when it regresses by
+more than the tolerance for that metric. Run with BENCHMARK_UPDATE_BASELINES=1 to record new
+baselines instead, e.g. after an intended change.
+
+Wall time depends on the machine, so it is only checked with BENCHMARK_CHECK_TIME=1, against
+baselines recorded on the same host; the other metrics are checked everywhere.
+"""
+
+import gc
+import json
+import logging
+import os
+import time
+import tracemalloc
+import typing
+from pathlib import Path
+
+import pytest
+
+logger = logging.getLogger(__name__)
+
+BASELINES = Path(__file__).parent / "baselines.json"
+
+# Allowed relative increase over the baseline, per metric. Allocations, payload size and
+# relation writes are deterministic for a given implementation, whatever the machine.
+TOLERANCES = {
+    "peak_alloc_bytes": float(os.environ.get("BENCHMARK_MEMORY_TOLERANCE", "0.25")),
+    "payload_bytes": 0.05,
+    "relation_writes": 0.0,
+}
+# Wall time varies most between runs, and does not transfer between machines
+TIME_TOLERANCE = float(os.environ.get("BENCHMARK_TIME_TOLERANCE", "1.0"))
+# Timer noise dominates for the fastest hooks; smaller wall time increases are ignored
+MIN_TIME_INCREASE_S = 0.005
+
+
+class Baseline:
+    """Measure a benchmark and check it against its recorded baseline."""
+
+    def __init__(self, baselines: dict, update: bool, check_time: bool = False):
+        self._baselines = baselines
+        self._update = update
+        self._tolerances = (
+            dict(TOLERANCES, wall_time_s=TIME_TOLERANCE) if check_time else TOLERANCES
+        )
+
+    def measure(
+        self,
+        name: str,
+        setup: typing.Callable[[], typing.Any],
+        run: typing.Callable[[typing.Any], typing.Optional[dict]],
+        repeat: int = 3,
+    ) -> dict:
+        """Measure `run`, each time on a fresh `setup()`, and compare with the baseline.
+
+        Wall time is the best of `repeat` runs without tracing; the peak allocation is
+        measured on a separate traced run. `run` may return extra metrics (e.g. payload size).
+        """
+        wall_times = []
+        extra = {}
+        for _ in range(repeat):
+            state = setup()
+            gc.collect()
+            start = time.perf_counter()
+            extra = run(state) or {}
+            wall_times.append(time.perf_counter() - start)
+
+        state = setup()
+        gc.collect()
+        tracemalloc.start()
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        metrics = {"wall_time_s": round(min(wall_times), 6), "peak_alloc_bytes": peak, **extra}
+        logger.info("benchmark %s: %s", name, metrics)
+        self._check(name, metrics)
+        return metrics
+
+    def _check(self, name: str, metrics: dict) -> None:
+        if self._update:
+            self._baselines[name] = metrics
+            return
+        if (baseline := self._baselines.get(name)) is None:
+            pytest.fail(
+                "no baseline for {}; record one with BENCHMARK_UPDATE_BASELINES=1".format(name)
+            )
+
+        regressions = [
+            "{} {} > baseline {} (+{:.0%} allowed)".format(
+                metric, metrics[metric], baseline[metric], tolerance
+            )
+            for metric, tolerance in self._tolerances.items()
+            if metric in metrics
+            and metric in baseline
+            and metrics[metric] > baseline[metric] * (1 + tolerance)
+            and not (
+                metric == "wall_time_s"
+                and metrics[metric] - baseline[metric] < MIN_TIME_INCREASE_S
+            )
+        ]
+        if regressions:
+            pytest.fail("{} regressed: {}".format(name, "; ".join(regressions)))
+
+
+@pytest.fixture(scope="session")
+def baseline():
+    """Session-wide access to the stored baselines."""
+    update = os.environ.get("BENCHMARK_UPDATE_BASELINES") == "1"
+    check_time = os.environ.get("BENCHMARK_CHECK_TIME") == "1"
+    baselines = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    yield Baseline(baselines, update, check_time)
+    if update:
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
@@ -0,0 +1,77 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import asyncio
+import logging
+import os
+import resource
+import threading
+import time
+
+from cardinality import ExpositionAnalyzer
+from probe import probe_jobs
+
+logger = logging.getLogger(__name__)
+
+BODY_MB = int(os.environ.get("BENCHMARK_EXPOSITION_MB", "256"))
+
+
+def _exposition_block(start: int) -> bytes:
+    """About 1 MiB of exposition, with a high-cardinality `id` label that keeps growing."""
+    lines = []
+    for i in range(start, start + 10000):
+        lines.append(
+            'http_request_duration_seconds_bucket{method="GET",code="200",id="%d",le="0.5"} %d\n'
+            % (i, i)
+        )
+    return "".join(lines).encode()
+
+
+async def _serve(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\n\r\n")
+    writer.write(b"# TYPE http_request_duration_seconds histogram\n")
+    written = block = 0
+    while written < BODY_MB * 2**20:
+        chunk = _exposition_block(block * 10000)
+        writer.write(chunk)
+        await writer.drain()
+        written += len(chunk)
+        block += 1
+    writer.close()
+
+
+def _start_server() -> int:
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(_serve, "127.0.0.1", 0))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1]
+
+
+def test_streaming_analysis_memory_stays_flat():
+    port = _start_server()
+    job = {"job_name": "bench", "static_configs": [{"targets": [f"127.0.0.1:{port}"]}]}
+    analyzer = ExpositionAnalyzer()
+
+    # tracemalloc would slow parsing down several fold; peak RSS growth is enough here
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    start = time.perf_counter()
+    (result,) = probe_jobs([job], timeout=3600, consumer=lambda *_: analyzer.feed)
+    analyzer.close()
+    elapsed = time.perf_counter() - start
+    growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - rss_before
+
+    logger.info(
+        "cardinality: %d MiB, %d series in %.1fs (%.1f MiB/s), peak RSS growth %.1f MiB",
+        result.body_size / 2**20,
+        analyzer.series,
+        elapsed,
+        result.body_size / 2**20 / elapsed,
+        growth / 2**20,
+    )
+    assert result.up
+    assert result.body_size >= BODY_MB * 2**20
+    assert analyzer.families["http_request_duration_seconds"] == analyzer.series
+    # The body is never buffered and the id label tracking is capped, so the peak does not
+    # grow with the body size.
+    assert growth < 64 * 2**20
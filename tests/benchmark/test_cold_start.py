@@ -0,0 +1,161 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Start-up cost of a hook.
+
+Module import times, and the latency of each event dispatched in a fresh interpreter, the way
+Juju runs every hook.
+"""
+
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).parents[2]
+RUNS = 5
+
+# Answers of the stubbed hook tools; the others print nothing
+HOOK_TOOL = """#!/bin/sh
+case "$(basename "$0")" in
+    is-leader) echo "$STUB_LEADER" ;;
+    config-get|relation-get|action-get) echo "{}" ;;
+    relation-ids|relation-list|opened-ports) echo "[]" ;;
+    resource-get) exit 1 ;;
+esac
+"""
+HOOK_TOOLS = (
+    "is-leader",
+    "config-get",
+    "relation-get",
+    "relation-ids",
+    "relation-list",
+    "relation-set",
+    "resource-get",
+    "status-get",
+    "status-set",
+    "juju-log",
+    "application-version-set",
+    "opened-ports",
+)
+
+# (hook, leader, relation): the first two are answered by the fast path
+EVENTS = (
+    ("install", False, None),
+    ("metrics-endpoint-relation-changed", False, "metrics-endpoint"),
+    ("update-status", False, None),
+    ("metrics-endpoint-relation-changed", True, "metrics-endpoint"),
+)
+
+
+def _environment() -> dict:
+    return dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT / "src"), str(ROOT / "lib")]))
+
+
+def test_import_time():
+    """Report the slowest imports of `import charm`, and of the fast path."""
+    for module in ("fastpath", "charm"):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+            env=_environment(),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # import time: self [us] | cumulative | imported package, children before their parent
+        imports = []
+        for line in result.stderr.splitlines()[1:]:
+            head, cumulative_us, name = line.split("|")
+            imports.append((int(cumulative_us), int(head.rpartition(":")[2]), name.rstrip()))
+        total = imports[-1][0]
+        logger.info("importtime: import %s in %.1fms", module, total / 1000)
+        # the modules it imports directly, listed since the previous top-level import
+        direct = []
+        for entry in reversed(imports[:-1]):
+            if not entry[2].startswith("  "):
+                break
+            if entry[2][3] != " ":
+                direct.append(entry)
+        for cumulative_us, self_us, name in sorted(direct, reverse=True)[:10]:
+            logger.info(
+                "importtime:   %-28s %7.1fms (self %.1fms)",
+                name.strip(),
+                cumulative_us / 1000,
+                self_us / 1000,
+            )
+        if module == "fastpath":
+            # the fast path must stay clear of the framework
+            assert "ops" not in {entry[2].strip() for entry in imports}
+
+
+@pytest.fixture()
+def charm_dir(tmp_path):
+    # a packed charm carries its metadata, config and actions as separate files
+    charm = tmp_path / "charm"
+    charm.mkdir()
+    metadata = yaml.safe_load((ROOT / "charmcraft.yaml").read_text())
+    (charm / "actions.yaml").write_text(yaml.safe_dump(metadata.pop("actions")))
+    (charm / "config.yaml").write_text(yaml.safe_dump(metadata.pop("config")))
+    (charm / "metadata.yaml").write_text(yaml.safe_dump(metadata))
+    tools = tmp_path / "bin"
+    tools.mkdir()
+    stub = tools / "hook-tool"
+    stub.write_text(HOOK_TOOL)
+    stub.chmod(0o755)
+    for tool in HOOK_TOOLS:
+        (tools / tool).symlink_to(stub)
+    return charm, tools
+
+
+def _dispatch(charm: Path, tools: Path, hook: str, leader: bool, relation) -> float:
+    env = dict(
+        _environment(),
+        PATH=os.pathsep.join([str(tools), os.environ["PATH"]]),
+        STUB_LEADER="true" if leader else "false",
+        JUJU_CHARM_DIR=str(charm),
+        JUJU_DISPATCH_PATH="hooks/" + hook,
+        JUJU_UNIT_NAME="prometheus-scrape-target-k8s/1",
+        JUJU_MODEL_NAME="bench",
+        JUJU_MODEL_UUID="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d",
+        JUJU_VERSION="3.6.0",
+    )
+    if relation:
+        env.update(
+            JUJU_RELATION=relation,
+            JUJU_RELATION_ID="{}:1".format(relation),
+            JUJU_REMOTE_APP="prometheus-k8s",
+            JUJU_REMOTE_UNIT="prometheus-k8s/0",
+        )
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, str(ROOT / "src" / "charm.py")],
+        cwd=charm,
+        env=env,
+        check=True,
+        capture_output=True,
+    )
+    return time.perf_counter() - start
+
+
+def test_dispatch_latency(charm_dir):
+    """Time each event end to end, from interpreter start to exit."""
+    charm, tools = charm_dir
+    latencies = {}
+    for hook, leader, relation in EVENTS:
+        runs = [_dispatch(charm, tools, hook, leader, relation) for _ in range(RUNS)]
+        key = "{} ({})".format(hook, "leader" if leader else "follower")
+        latencies[key] = statistics.median(runs)
+        logger.info("dispatch: %-50s %.1fms", key, latencies[key] * 1000)
+
+    framework = latencies["update-status (follower)"]
+    # hooks with nothing to do skip importing the framework altogether
+    assert latencies["install (follower)"] < framework / 2
+    assert latencies["metrics-endpoint-relation-changed (follower)"] < framework / 2
@@ -0,0 +1,42 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import logging
+import time
+
+from charm import DEFAULT_MAX_EXPANDED_TARGETS
+from targets import validate_targets
+
+logger = logging.getLogger(__name__)
+
+
+def _timed_validation(entries):
+    start = time.perf_counter()
+    report = validate_targets(entries, DEFAULT_MAX_EXPANDED_TARGETS)
+    return report.targets, report.error or report.invalid, time.perf_counter() - start
+
+
+def test_expansion_scales_linearly():
+    """Expanding a /16 costs about 16 times a /20: no quadratic dedup or validation."""
+    small, errors, small_elapsed = _timed_validation(["10.20.0.0/20:9100"])
+    assert not errors
+    large, errors, large_elapsed = _timed_validation(["10.20.0.0/16:9100", "10.20.0.1:9100{x=y}"])
+    assert not errors
+
+    logger.info(
+        "expansion: /20 -> %d targets in %.3fs; /16 -> %d targets in %.3fs",
+        len(small),
+        small_elapsed,
+        len(large),
+        large_elapsed,
+    )
+    assert len(large) == 65534
+    assert large["10.20.0.1:9100"] == {"x": "y"}
+    assert large_elapsed < small_elapsed * 16 * 2
+
+
+def test_range_expansion():
+    targets, errors, elapsed = _timed_validation(["rack[001-256]-node[001-250].dc1:9100"])
+    logger.info("expansion: ranges -> %d targets in %.3fs", len(targets), elapsed)
+    assert not errors
+    assert len(targets) == 64000
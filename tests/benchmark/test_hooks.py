@@ -0,0 +1,106 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+"""Cost of the charm's hooks, driven through ops.testing, against stored baselines."""
+
+import itertools
+
+import pytest
+from ops.testing import Harness
+
+from charm import PrometheusScrapeTargetCharm
+
+TARGET_COUNTS = (10, 1000, 100_000)
+
+
+def _targets(count: int, labels: int = 0) -> str:
+    """`count` distinct targets, each with `labels` labels spread over a few label sets."""
+    entries = []
+    for i in range(count):
+        target = "10.{}.{}.{}:9100".format(i >> 16, (i >> 8) & 255, i & 255)
+        if labels:
+            target += "{{{}}}".format(
+                ",".join("label{}=value{}".format(n, (i + n) % 8) for n in range(labels))
+            )
+        entries.append(target)
+    return ",".join(entries)
+
+
+def _harness(targets: str, relations: int = 1, **config) -> Harness:
+    harness = Harness(PrometheusScrapeTargetCharm)
+    harness.set_model_info(name="bench", uuid="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d")
+    harness.set_leader(True)
+    harness.begin()
+    harness.update_config(
+        {"targets": targets, "labels": "env:prod,region:eu", "params": "{module: [x]}", **config}
+    )
+    for n in range(relations):
+        harness.add_relation("metrics-endpoint", "prometheus-{}".format(n))
+    return harness
+
+
+def _payload_size(harness: Harness) -> int:
+    relation = harness.model.relations["metrics-endpoint"][0]
+    return len(relation.data[harness.charm.app].get("scrape_jobs", ""))
+
+
+def _published(harness: Harness, writes: int) -> dict:
+    """Payload size, and relation writes since the count was `writes`."""
+    return {
+        "payload_bytes": _payload_size(harness),
+        "relation_writes": harness.charm._stored.relation_writes - writes,
+    }
+
+
+@pytest.mark.parametrize("count", TARGET_COUNTS)
+def test_config_changed(baseline, count):
+    targets = _targets(count)
+
+    def run(harness):
+        writes = harness.charm._stored.relation_writes
+        # a changed value, so that the payload is republished
+        harness.update_config({"job_name": "changed"})
+        return _published(harness, writes)
+
+    baseline.measure("config-changed[{}]".format(count), lambda: _harness(targets), run)
+
+
+@pytest.mark.parametrize("count", TARGET_COUNTS)
+def test_start(baseline, count):
+    targets = _targets(count)
+
+    def run(harness):
+        writes = harness.charm._stored.relation_writes
+        harness.charm.on.start.emit()
+        return _published(harness, writes)
+
+    baseline.measure("start[{}]".format(count), lambda: _harness(targets), run)
+
+
+@pytest.mark.parametrize("count,relations", itertools.product((10, 1000), (1, 50)))
+def test_relation_changed(baseline, count, relations):
+    targets = _targets(count)
+
+    def run(harness):
+        writes = harness.charm._stored.relation_writes
+        relation = harness.model.relations["metrics-endpoint"][-1]
+        harness.update_relation_data(relation.id, relation.app.name, {"updated": "true"})
+        return _published(harness, writes)
+
+    baseline.measure(
+        "relation-changed[{}x{}]".format(count, relations),
+        lambda: _harness(targets, relations),
+        run,
+    )
+
+
+@pytest.mark.parametrize("count", (1000, 10_000))
+def test_config_changed_large_label_sets(baseline, count):
+    targets = _targets(count, labels=10)
+
+    def run(harness):
+        writes = harness.charm._stored.relation_writes
+        harness.update_config({"job_name": "changed"})
+        return _published(harness, writes)
+
+    baseline.measure("config-changed-labels[{}]".format(count), lambda: _harness(targets), run)
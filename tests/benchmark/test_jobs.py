@@ -0,0 +1,94 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import json
+import logging
+import time
+from unittest.mock import patch
+
+import yaml
+from ops.testing import Harness
+
+import charm
+from charm import PrometheusScrapeTargetCharm
+
+logger = logging.getLogger(__name__)
+
+JOBS = 500
+TARGETS_PER_JOB = 20
+
+
+def _specs() -> list:
+    return [
+        {
+            "job_name": f"job{j}",
+            "targets": [f"10.{j // 250}.{j % 250}.{t}:9100" for t in range(TARGETS_PER_JOB)],
+            "labels": {"team": f"team{j % 7}"},
+            "metrics_path": f"/metrics/{j}",
+            "scrape_interval": "1m",
+        }
+        for j in range(JOBS)
+    ]
+
+
+def test_config_changed_with_500_jobs():
+    specs = _specs()
+    harness = Harness(PrometheusScrapeTargetCharm)
+    harness.set_model_info(name="bench", uuid="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d")
+    harness.set_leader(True)
+    harness.begin()
+    rel_id = harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+    start = time.perf_counter()
+    harness.update_config({"jobs": yaml.safe_dump(specs)})
+    elapsed = time.perf_counter() - start
+
+    payload = harness.get_relation_data(rel_id, harness.charm.app.name)["scrape_jobs"]
+    logger.info(
+        "jobs: %d jobs x %d targets rendered in %.3fs; payload %d bytes",
+        JOBS,
+        TARGETS_PER_JOB,
+        elapsed,
+        len(payload),
+    )
+    assert len(json.loads(payload)) == JOBS
+    harness.cleanup()
+
+
+def test_config_changed_with_500_unchanged_jobs():
+    """Re-render after a change that leaves every `jobs` entry's options as they were."""
+    specs = _specs()
+    for spec in specs:
+        spec["relabel_configs"] = [
+            {"source_labels": ["__address__"], "regex": "(.*):9100", "target_label": "host"}
+        ]
+    harness = Harness(PrometheusScrapeTargetCharm)
+    harness.set_model_info(name="bench", uuid="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d")
+    harness.set_leader(True)
+    harness.begin()
+    harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+    start = time.perf_counter()
+    harness.update_config({"jobs": yaml.safe_dump(specs)})
+    first = time.perf_counter() - start
+
+    for spec in specs:
+        spec["targets"].append("10.255.0.1:9100")
+    with patch("charm._parse_job_spec", wraps=charm._parse_job_spec) as parse, patch(
+        "charm.validate_relabel_configs", wraps=charm.validate_relabel_configs
+    ) as check:
+        start = time.perf_counter()
+        harness.update_config({"jobs": yaml.safe_dump(specs)})
+        second = time.perf_counter() - start
+
+    logger.info(
+        "jobs: %d jobs rendered in %.3fs, and in %.3fs with their options unchanged",
+        JOBS,
+        first,
+        second,
+    )
+    assert len(harness.charm._stored.job_models) == JOBS
+    # only the targets changed: no job options were parsed or validated again
+    assert parse.call_count == 0
+    assert check.call_count == 0
+    harness.cleanup()
@@ -0,0 +1,76 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import asyncio
+import logging
+import threading
+import time
+
+from distribution import distribute
+from probe import probe_jobs
+
+logger = logging.getLogger(__name__)
+
+TARGETS = 5000
+RESPONSE_DELAY = 0.05
+BODY = b"# TYPE up gauge\nup 1\n" * 100
+
+
+async def _serve(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    await asyncio.sleep(RESPONSE_DELAY)
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(BODY), BODY))
+    await writer.drain()
+    writer.close()
+
+
+def _start_server(host="127.0.0.1"):
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(_serve, host, 0, backlog=4096))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return server.sockets[0].getsockname()[1]
+
+
+def test_probe_thousands_of_targets():
+    port = _start_server()
+    job = {"static_configs": [{"targets": [f"127.0.0.1:{port}"] * TARGETS}]}
+
+    start = time.perf_counter()
+    results = probe_jobs([job], concurrency=500, timeout=10)
+    elapsed = time.perf_counter() - start
+
+    up = sum(result.up for result in results)
+    logger.info(
+        "probe: %d targets (%.0fms server delay) in %.2fs, %d up",
+        TARGETS,
+        RESPONSE_DELAY * 1000,
+        elapsed,
+        up,
+    )
+    assert up == TARGETS
+    # Serially this would take TARGETS * RESPONSE_DELAY = 250s
+    assert elapsed < 10
+
+
+def test_probe_wall_time_shrinks_with_units():
+    # on every address, so that targets can differ in more than the port
+    port = _start_server("0.0.0.0")
+    # distinct addresses, as the targets are split between units by address
+    targets = [f"127.0.{i // 250}.{i % 250 + 1}:{port}" for i in range(500)]
+    jobs = [{"job_name": "bench", "static_configs": [{"targets": targets}]}]
+
+    wall_times = {}
+    for units in (1, 2, 4):
+        members = [f"app/{u}" for u in range(units)]
+        # units probe in parallel, so the slowest share sets the wall time
+        elapsed = []
+        for member_jobs in distribute(jobs, members).values():
+            start = time.perf_counter()
+            results = probe_jobs(member_jobs, concurrency=100, timeout=10)
+            elapsed.append(time.perf_counter() - start)
+            assert all(result.up for result in results)
+        wall_times[units] = max(elapsed)
+        logger.info(
+            "probe: %d targets over %d unit(s) in %.2fs", len(targets), units, wall_times[units]
+        )
+    assert wall_times[4] < wall_times[1] / 2
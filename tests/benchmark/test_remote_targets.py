@@ -0,0 +1,59 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Benchmarks are not part of the unit test run; use `tox -e benchmark`.
+
+import json
+import logging
+import time
+from unittest.mock import patch
+
+from ops.testing import Harness
+
+from charm import PrometheusScrapeTargetCharm
+from targets import validate_targets
+
+logger = logging.getLogger(__name__)
+
+TARGETS_PER_APP = 50
+
+
+def _relation_changed(apps: int):
+    """Time one remote application's change, with `apps` applications related."""
+    harness = Harness(PrometheusScrapeTargetCharm)
+    harness.set_model_info(name="bench", uuid="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d")
+    harness.set_leader(True)
+    harness.begin()
+    harness.add_relation("metrics-endpoint", "prometheus-k8s")
+    rel_ids = [
+        harness.add_relation(
+            "scrape-targets",
+            f"app{a}",
+            app_data={"targets": json.dumps([f"app{a}-{t}:9100" for t in range(TARGETS_PER_APP)])},
+        )
+        for a in range(apps)
+    ]
+
+    targets = json.dumps([f"app0-{t}:9100" for t in range(TARGETS_PER_APP + 1)])
+    with patch("charm.validate_targets", wraps=validate_targets) as validate:
+        start = time.perf_counter()
+        harness.update_relation_data(rel_ids[0], "app0", {"targets": targets})
+        elapsed = time.perf_counter() - start
+    validated = sum(len(call.args[0]) for call in validate.mock_calls)
+    harness.cleanup()
+    return elapsed, validated
+
+
+def test_relation_changed_with_many_remote_apps():
+    results = {apps: _relation_changed(apps) for apps in (10, 100, 400)}
+    for apps, (elapsed, validated) in results.items():
+        logger.info(
+            "scrape-targets: relation-changed with %d apps x %d targets in %.4fs; "
+            "%d target entries validated",
+            apps,
+            TARGETS_PER_APP,
+            elapsed,
+            validated,
+        )
+    # only the changed application's targets are validated, however many are related
+    assert {validated for _, validated in results.values()} == {TARGETS_PER_APP + 1}
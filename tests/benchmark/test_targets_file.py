@@ -0,0 +1,62 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Benchmarks are not part of the unit test run; use `tox -e benchmark`.
+
+import logging
+import time
+import tracemalloc
+
+from targets import iter_targets_file, validate_targets
+
+logger = logging.getLogger(__name__)
+
+LINES = 100_000
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def _read_all(path):
+    """Baseline: load the whole file, then split and validate it in memory."""
+    lines = [line.strip() for line in path.read_text().splitlines()]
+    entries = [line for line in lines if line and not line.startswith("#")]
+    return len(validate_targets(entries, max_expanded=0).targets)
+
+
+def test_streaming_100k_line_targets_file(tmp_path):
+    path = tmp_path / "targets.txt"
+    with open(path, "w") as targets_file:
+        for i in range(LINES):
+            targets_file.write(f"host-{i:06d}.example.com:9100\n")
+            if i % 10 == 0:
+                # sprinkle in duplicates and comments
+                targets_file.write(f"# rack {i}\nhost-{i:06d}.example.com:9100\n")
+    file_size = path.stat().st_size
+
+    count, elapsed, peak = _measure(
+        lambda: len(validate_targets(iter_targets_file(path), max_expanded=0).targets)
+    )
+    baseline_count, baseline_elapsed, baseline_peak = _measure(lambda: _read_all(path))
+
+    logger.info(
+        "targets-file: %d lines (%d bytes) -> %d targets in %.3fs, peak memory %d bytes "
+        "(read-all baseline: %.3fs, %d bytes)",
+        LINES,
+        file_size,
+        count,
+        elapsed,
+        peak,
+        baseline_elapsed,
+        baseline_peak,
+    )
+    assert count == baseline_count == LINES
+    # Only the validated targets are retained; the file itself is never held in memory.
+    assert peak < baseline_peak
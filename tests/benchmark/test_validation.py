@@ -0,0 +1,85 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+#
+# Benchmarks are not part of the unit test run; use `tox -e benchmark`.
+
+import logging
+import time
+from urllib.parse import urlparse
+
+from targets import address_error, validate_targets
+
+logger = logging.getLogger(__name__)
+
+TARGETS = 100_000
+
+
+def _urlparse_validated_address(address: str) -> str:
+    """Baseline: the urlparse based check the charm used before address_error."""
+    if not address.startswith("//"):
+        address = "//" + address
+
+    parsed = urlparse(address)
+    if not parsed.netloc or any([parsed.scheme, parsed.path, parsed.params, parsed.query]):
+        return ""
+    try:
+        _ = parsed.port
+    except ValueError:
+        return ""
+    return parsed.netloc
+
+
+def _addresses():
+    """A mix of IPv4 addresses, hostnames and bracketed IPv6 addresses."""
+    for i in range(TARGETS):
+        if i % 3 == 0:
+            yield "10.{}.{}.{}:9100".format(i >> 16, (i >> 8) & 255, i & 255)
+        elif i % 3 == 1:
+            yield "node-{:06d}.rack{}.dc1.example.com:9100".format(i, i % 40)
+        else:
+            yield "[2001:db8::{:x}:{:x}]:9100".format(i >> 16, i & 0xFFFF)
+
+
+def _throughput(func, addresses):
+    start = time.perf_counter()
+    for address in addresses:
+        func(address)
+    return len(addresses) / (time.perf_counter() - start)
+
+
+def test_address_validation_throughput():
+    addresses = list(_addresses())
+    assert not any(address_error(address) for address in addresses)
+    assert all(_urlparse_validated_address(address) for address in addresses)
+
+    throughput = max(_throughput(address_error, addresses) for _ in range(3))
+    baseline = max(_throughput(_urlparse_validated_address, addresses) for _ in range(3))
+    logger.info(
+        "validation: %d addresses; address_error %.0f/s, urlparse baseline %.0f/s",
+        TARGETS,
+        throughput,
+        baseline,
+    )
+    assert throughput > baseline
+
+
+def test_trusted_target_list_skips_address_checks():
+    """Revalidating a target list already found valid only parses and dedupes it."""
+    addresses = list(_addresses())
+
+    start = time.perf_counter()
+    checked = validate_targets(addresses, 0)
+    checked_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    trusted = validate_targets(addresses, 0, check_addresses=False)
+    trusted_elapsed = time.perf_counter() - start
+
+    logger.info(
+        "validation: %d targets checked in %.3fs, trusted in %.3fs",
+        TARGETS,
+        checked_elapsed,
+        trusted_elapsed,
+    )
+    assert checked.targets == trusted.targets
+    assert len(trusted.targets) == TARGETS
+    assert trusted_elapsed < checked_elapsed
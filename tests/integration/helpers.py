@@ -1,6 +1,7 @@
 # Copyright 2021 Canonical Ltd.
 # See LICENSE file for licensing details.
 
+import json
 import logging
 
 log = logging.getLogger(__name__)
@@ -15,3 +16,14 @@ async def get_config_values(ops_test, app_name) -> dict:
     """Return the app's config, but filter out keys that do not have a value."""
     config = await ops_test.model.applications[app_name].get_config()
     return {key: config[key]["value"] for key in config if "value" in config[key]}
+
+
+async def get_published_jobs(ops_test, app_name: str, consumer_unit: str) -> list:
+    """Return the scrape jobs the app published, as seen by a unit of the consumer."""
+    _, stdout, _ = await ops_test.juju("show-unit", consumer_unit, "--format=json")
+    for relation in json.loads(stdout)[consumer_unit]["relation-info"]:
+        if relation["endpoint"] == "metrics-endpoint" and "scrape_jobs" in relation.get(
+            "application-data", {}
+        ):
+            return json.loads(relation["application-data"]["scrape_jobs"])
+    return []
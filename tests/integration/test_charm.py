@@ -10,7 +10,9 @@ from pathlib import Path
 
 import pytest
 import yaml
-from helpers import get_unit_address
+from helpers import get_published_jobs, get_unit_address
+
+from options import dropped_keys
 
 log = logging.getLogger(__name__)
 
@@ -121,3 +123,40 @@ async def test_scrape_config_is_ingested_by_prometheus(ops_test):
     )
     assert len(ours) == 1
     assert ours[0]["metrics_path"] == "/foometrics"
+
+
+@pytest.mark.abort_on_fail
+async def test_prometheus_drops_fields_outside_the_consumer_allowlist(ops_test):
+    """Check CONSUMER_KEYS against the fields Prometheus actually keeps."""
+    address = await get_unit_address(ops_test, "prom", 0)
+    url = f"http://{address}:9090"
+    # a federation job, published with honor_labels set and match[] in its params
+    options = {"federation_selectors": "up", "federation_jobs": 1}
+    await ops_test.model.applications["st"].set_config(
+        {"targets": "1.2.3.5:5678", **{key: str(value) for key, value in options.items()}}
+    )
+    await ops_test.model.wait_for_idle(apps=["prom"], status="active")
+
+    response = urllib.request.urlopen(f"{url}/api/v1/status/config", data=None, timeout=10.0)
+    config = yaml.safe_load(json.loads(response.read())["data"]["yaml"])
+    (ours,) = [
+        scrape_config
+        for scrape_config in config["scrape_configs"]
+        if scrape_config["static_configs"][0]["targets"] == ["1.2.3.5:5678"]
+    ]
+    assert ours["params"]["match[]"] == ["up"]
+    (published,) = [
+        job
+        for job in await get_published_jobs(ops_test, "st", "prom/0")
+        if job["static_configs"][0]["targets"] == ["1.2.3.5:5678"]
+    ]
+    # the federation job sets honor_labels away from its default, so Prometheus would show it
+    assert (dropped := dropped_keys([published]))
+    for key in dropped:
+        assert key not in ours, f"{key} is kept by Prometheus, so belongs in CONSUMER_KEYS"
+    # still published, so only noted in the active status
+    unit = ops_test.model.applications["st"].units[0]
+    assert unit.workload_status == "active"
+    assert "ignored by Prometheus" in unit.workload_status_message
+
+    await ops_test.model.applications["st"].reset_config(list(options))
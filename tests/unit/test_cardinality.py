@@ -0,0 +1,84 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import re
+import unittest
+
+from cardinality import ExpositionAnalyzer, drop_rules, recommend_limits
+
+EXPOSITION = b"""# HELP http_requests_total Requests.
+# TYPE http_requests_total counter
+http_requests_total{code="200",path="/"} 10
+http_requests_total{code="500",path="/"} 1
+http_requests_total{code="200",path="/a,b}"} 3
+# TYPE latency_seconds histogram
+latency_seconds_bucket{le="0.1"} 1 # {trace_id="abc"} 0.05
+latency_seconds_bucket{le="+Inf"} 2
+latency_seconds_sum 0.3
+latency_seconds_count 2
+up 1
+"""
+
+
+class TestExpositionAnalyzer(unittest.TestCase):
+    def _analyze(self, body: bytes, chunk_size: int) -> ExpositionAnalyzer:
+        analyzer = ExpositionAnalyzer()
+        for i in range(0, len(body), chunk_size):
+            analyzer.feed(body[i : i + chunk_size])
+        analyzer.close()
+        return analyzer
+
+    def test_series_are_counted_per_family(self):
+        analyzer = self._analyze(EXPOSITION, 4096)
+        self.assertEqual(8, analyzer.series)
+        self.assertEqual(
+            {"http_requests_total": 3, "latency_seconds": 4, "up": 1}, dict(analyzer.families)
+        )
+
+    def test_result_does_not_depend_on_chunking(self):
+        whole = self._analyze(EXPOSITION, 4096)
+        for chunk_size in (1, 7, 64):
+            with self.subTest(chunk_size=chunk_size):
+                chunked = self._analyze(EXPOSITION, chunk_size)
+                self.assertEqual(whole.families, chunked.families)
+                self.assertEqual(whole.label_values, chunked.label_values)
+
+    def test_label_cardinality(self):
+        analyzer = self._analyze(EXPOSITION, 4096)
+        self.assertEqual({"/", "/a,b}"}, analyzer.label_values["path"])
+        # exemplar labels are not series labels
+        self.assertNotIn("trace_id", analyzer.label_values)
+        self.assertEqual(("code", 2), analyzer.top_labels(1)[0])
+        self.assertEqual(2, analyzer.max_labels)
+
+    def test_tracked_values_are_capped(self):
+        analyzer = ExpositionAnalyzer(max_tracked_values=10)
+        analyzer.feed(b"".join(b'm{id="%d"} 1\n' % i for i in range(100)))
+        self.assertEqual(10, len(analyzer.label_values["id"]))
+        self.assertEqual(100, analyzer.series)
+        self.assertEqual(">=10", analyzer.report()["top_labels"]["id"])
+
+    def test_report_suggests_dominant_families(self):
+        report = self._analyze(EXPOSITION, 4096).report(drop_share=0.3)
+        self.assertEqual(["latency_seconds", "http_requests_total"], report["drop_candidates"])
+
+
+class TestRecommendations(unittest.TestCase):
+    def test_limits_fit_the_largest_target(self):
+        small, large = ExpositionAnalyzer(), ExpositionAnalyzer()
+        small.feed(b'a{x="1"} 1\n')
+        large.feed(b"".join(b'b{x="%d",y="1"} 1\n' % i for i in range(1000)))
+        limits = recommend_limits([small, large])
+        self.assertEqual(1500, limits["sample_limit"])
+        self.assertGreaterEqual(limits["label_limit"], 4)
+
+    def test_drop_rules_match_family_samples_only(self):
+        (rule,) = drop_rules(["latency_seconds", "go_gc"])
+        self.assertEqual("drop", rule["action"])
+        regex = re.compile(rule["regex"])
+        for name in ("latency_seconds_bucket", "latency_seconds", "go_gc_count"):
+            self.assertTrue(regex.fullmatch(name), name)
+        self.assertFalse(regex.fullmatch("go_gc_duration_seconds"))
+
+    def test_no_drop_rules_without_candidates(self):
+        self.assertEqual([], drop_rules([]))
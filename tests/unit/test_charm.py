@@ -4,12 +4,61 @@
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
 import json
+import socket
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest.mock import patch
 
 from ops.model import ActiveStatus, BlockedStatus, WaitingStatus
-from ops.testing import Harness
+from ops.testing import ActionFailed, Harness
 
-from charm import PrometheusScrapeTargetCharm
+from charm import UPDATE_STATUS_PROBE_TIME, PrometheusScrapeTargetCharm
+from distribution import owner
+from health import job_targets, target_key
+from probe import NOT_PROBED, ProbeResult
+from targets import validate_targets
+
+
+def _leader_harness(test: unittest.TestCase) -> Harness:
+    """Begin a charm harness for the leader unit, cleaned up with the test."""
+    harness = Harness(PrometheusScrapeTargetCharm)
+    harness.set_model_info(name="lma", uuid="e40bf1a0-91f4-45a5-9f35-eb30fd010e4d")
+    test.addCleanup(harness.cleanup)
+    harness.set_leader(True)
+    harness.begin()
+    return harness
+
+
+def _log_output(logs) -> str:
+    """The records captured by assertLogs, one per line."""
+    return "\n".join(logs.output if logs else [])
+
+
+class LeaderCharmTestCase(unittest.TestCase):
+    """Tests of the leader unit, related to a Prometheus application."""
+
+    def setUp(self):
+        self.harness = _leader_harness(self)
+        self.rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+    def _jobs(self) -> list:
+        relation_data = self.harness.get_relation_data(self.rel_id, self.harness.charm.app.name)
+        return json.loads(relation_data["scrape_jobs"])
+
+    def _jobs_by_suffix(self) -> dict:
+        """The published jobs, by what their name adds to the config job's; "main" for it."""
+        return {
+            job["job_name"].rpartition("external_jobs")[2] or "main": job for job in self._jobs()
+        }
+
+    def _patch_probes(self, fake):
+        """Answer the charm's probes with `fake` rather than the network, until the test ends."""
+        probe = patch("charm.probe_jobs", side_effect=fake)
+        self.addCleanup(probe.stop)
+        return probe.start()
 
 
 class TestCharm(unittest.TestCase):
@@ -73,7 +122,7 @@ class TestCharm(unittest.TestCase):
             json.loads(relation_data["scrape_jobs"]),
         )
 
-        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
 
     def test_scrape_job_has_specified_labels(self):
         """Test relation data for single targets with additional labels."""
@@ -110,7 +159,7 @@ class TestCharm(unittest.TestCase):
             json.loads(relation_data["scrape_jobs"]),
         )
 
-        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
 
     def test_scrape_job_has_no_port_if_not_specified(self):
         """Test relation data for single targets without additional labels."""
@@ -139,7 +188,7 @@ class TestCharm(unittest.TestCase):
             json.loads(relation_data["scrape_jobs"]),
         )
 
-        self.assertEqual(self.harness.model.unit.status, ActiveStatus())
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
 
     def test_charm_blocks_if_target_includes_scheme(self):
         """Test the charm goes into blocked state if provided target address includes a scheme."""
@@ -183,6 +232,182 @@ class TestCharm(unittest.TestCase):
         self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
         self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
 
+    def test_invalid_targets_are_reported_together(self):
+        """Test every invalid target is logged in a single error, with the reason."""
+        self.harness.set_leader(True)
+
+        with self.assertLogs("charm", "ERROR") as logs:
+            self.harness.update_config({"targets": "foo:0,bar:1234,[::1]:x,-baz:1"})
+
+        self.assertEqual(
+            "ERROR:charm:Invalid config: targets: 3 invalid target(s): "
+            "foo:0 (port 0 out of range), [::1]:x (invalid port 'x'), "
+            "-baz:1 (invalid hostname '-baz'); use host:port format",
+            _log_output(logs),
+        )
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid targets; see debug-logs")
+        )
+
+    def test_targets_separated_by_comma_and_space(self):
+        """Test spaces after the commas of the targets option are accepted, as they used to be."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        self.harness.update_config({"targets": "a:1, b:2"})
+
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            [{"targets": ["a:1", "b:2"]}],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"],
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_ipv6_targets(self):
+        """Test bracketed IPv6 targets are accepted."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "[2001:db8::1]:9100,[::1]"})
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            [{"targets": ["[2001:db8::1]:9100", "[::1]"]}],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"],
+        )
+
+    def test_underscored_hostnames_are_deprecated(self):
+        """Test hostnames with underscores are still published, with a warning."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        with self.assertLogs("charm", "WARNING") as logs:
+            self.harness.update_config({"targets": "host_1:9100,host2:9100"})
+
+        self.assertIn(
+            "deprecated, and may be rejected in a later version: host_1:9100",
+            _log_output(logs),
+        )
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            [{"targets": ["host_1:9100", "host2:9100"]}],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"],
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_valid_targets_are_not_checked_again(self):
+        """Test a target list found valid in an earlier hook skips the address checks."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234,bar:5678"})
+        self.assertEqual(1, len(self.harness.charm._stored.valid_targets))
+
+        with patch("targets.address_error") as address_error:
+            self.harness.update_config({"job_name": "renamed"})
+            address_error.assert_not_called()
+
+            self.harness.update_config({"targets": "foo:1234"})
+            address_error.assert_called_once_with("foo:1234")
+
+    def test_upgrade_revalidates_targets(self):
+        """Test the known valid target lists are forgotten on upgrade."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234"})
+
+        with patch("targets.address_error", return_value="") as address_error:
+            self.harness.charm.on.upgrade_charm.emit()
+            address_error.assert_called_once_with("foo:1234")
+
+    def test_unchanged_job_options_are_not_parsed_again(self):
+        """Test only the job specs whose options changed are parsed in later hooks."""
+        self.harness.set_leader(True)
+        rules = "[{source_labels: [a], action: drop}]"
+        jobs = [
+            {"job_name": "a", "targets": "foo:1", "relabel_configs": rules},
+            {"job_name": "b", "targets": "foo:2", "relabel_configs": rules, "scheme": "https"},
+        ]
+        self.harness.update_config(
+            {"targets": "foo:1234", "relabel_configs": rules, "jobs": json.dumps(jobs)}
+        )
+        self.assertEqual(3, len(self.harness.charm._stored.job_models))
+
+        with patch("charm.validate_relabel_configs", return_value=[]) as validate:
+            self.harness.update_config({"targets": "foo:1234,bar:5678"})
+            validate.assert_not_called()
+
+            jobs[1]["relabel_configs"] = "[{source_labels: [b], action: drop}]"
+            self.harness.update_config({"jobs": json.dumps(jobs)})
+            validate.assert_called_once_with([{"source_labels": ["b"], "action": "drop"}])
+        self.assertEqual(3, len(self.harness.charm._stored.job_models))
+
+    def test_errors_of_memoized_job_options_are_reported(self):
+        """Test a job spec that is not parsed again still blocks, along with new errors."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234", "labels": "invalid"})
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+        self.harness.update_config({"targets": "foo:1234,bar:5678", "distribution": "random"})
+        self.assertEqual(
+            BlockedStatus("Invalid distribution, labels; see debug-logs"),
+            self.harness.model.unit.status,
+        )
+
+    def test_upgrade_parses_job_options_again(self):
+        """Test the parsed job options are forgotten on upgrade."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234", "relabel_configs": "[]"})
+
+        with patch("charm.validate_relabel_configs", return_value=[]) as validate:
+            self.harness.charm.on.upgrade_charm.emit()
+            validate.assert_called_once_with([])
+
+    def test_active_status_summarizes_published_jobs(self):
+        """Test the active status counts the published targets and the payload size."""
+        self.harness.set_leader(True)
+        rel_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+
+        self.harness.update_config({"targets": "foo:1234,bar:5678"})
+
+        payload = self.harness.get_relation_data(rel_id, self.harness.model.app.name)
+        self.assertEqual(
+            ActiveStatus("2 targets in 1 job; {}B payload".format(len(payload["scrape_jobs"]))),
+            self.harness.model.unit.status,
+        )
+
+    def test_stats_action_reports_hook_history(self):
+        """Test the stats action reports the cost of the last hooks."""
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("stats")
+
+        self.harness.set_leader(True)
+        self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.update_config({"targets": "foo:1234,bar:5678"})
+        self.harness.update_config({"targets": "foo:1234,bar:5678,https://baz:1"})
+
+        output = self.harness.run_action("stats")
+
+        history = json.loads(output.results["history"])
+        self.assertEqual(
+            [("config_changed", 2, 0, 1), ("config_changed", 0, 1, 1)],
+            [
+                (
+                    entry["event"],
+                    entry["valid_targets"],
+                    entry["invalid_targets"],
+                    entry["relation_writes"],
+                )
+                for entry in history[-2:]
+            ],
+        )
+        self.assertEqual(history[-1], json.loads(output.results["last"]))
+        (summary,) = json.loads(output.results["summary"]).values()
+        self.assertEqual(len(history), summary["hooks"])
+
     def test_non_leader_unit_sets_waiting_status(self):
         """Test units that are not leader are marked inactive."""
         self.harness.set_leader(False)
@@ -216,6 +441,1519 @@ class TestCharm(unittest.TestCase):
         self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
         self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
 
+    def test_targets_are_split_across_shards(self):
+        """Test each target lands in exactly one shard job."""
+        self.harness.set_leader(True)
+        targets = [f"host{i}:9100" for i in range(50)]
+
+        self.harness.update_config({"targets": ",".join(targets), "shards": 4})
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        jobs = json.loads(relation_data["scrape_jobs"])
+
+        self.assertEqual(4, len(jobs))
+        for job in jobs:
+            self.assertRegex(
+                job["job_name"],
+                r"^juju_lma_e40bf1a_prometheus-scrape-target-k8s_external_jobs_shard[0-3]$",
+            )
+        sharded = [t for job in jobs for sc in job["static_configs"] for t in sc["targets"]]
+        self.assertCountEqual(targets, sharded)
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_shard_assignment_is_stable_when_targets_change(self):
+        """Test adding and removing targets does not move the remaining ones."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        def assignment():
+            relation_data = self.harness.get_relation_data(
+                downstream_rel_id, self.harness.charm.app.name
+            )
+            return {
+                target: job["job_name"]
+                for job in json.loads(relation_data["scrape_jobs"])
+                for target in job["static_configs"][0]["targets"]
+            }
+
+        targets = [f"10.0.0.{i}:9100" for i in range(100)]
+        self.harness.update_config({"targets": ",".join(targets), "shards": 8})
+        before = assignment()
+
+        changed = targets[10:] + [f"10.0.1.{i}:9100" for i in range(20)]
+        self.harness.update_config({"targets": ",".join(changed)})
+        after = assignment()
+
+        for target in targets[10:]:
+            self.assertEqual(before[target], after[target])
+
+    def test_charm_blocks_if_shards_invalid(self):
+        """Test the charm goes into blocked state if the shard count is not positive."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "foo:1234", "shards": 0})
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_unchanged_payload_is_not_rewritten(self):
+        """Test relation data is only written when the rendered jobs change."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234"})
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        stored = self.harness.charm._stored
+        self.assertEqual(1, stored.relation_writes)
+        self.assertEqual(0, stored.skipped_writes)
+
+        # Neither an unrelated config change nor a remote relation change alters the payload
+        self.harness.update_config({"job_name": "external_jobs"})
+        self.harness.update_relation_data(downstream_rel_id, "prometheus-k8s", {"foo": "bar"})
+        self.harness.charm.on.start.emit()
+        self.assertEqual(1, stored.relation_writes)
+        self.assertEqual(3, stored.skipped_writes)
+
+        self.harness.update_config({"targets": "foo:1234,bar:5678"})
+        self.assertEqual(2, stored.relation_writes)
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            ["foo:1234", "bar:5678"],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"][0]["targets"],
+        )
+
+    def test_payload_is_rewritten_after_another_leader(self):
+        """Test a unit leading again writes its payload over the one another leader wrote."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234"})
+        rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        published = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)[
+            "scrape_jobs"
+        ]
+
+        self.harness.set_leader(False)
+        self.harness.update_config({"targets": "bar:5678"})
+        # the other leader's payload
+        self.harness.update_relation_data(
+            rel_id, self.harness.charm.app.name, {"scrape_jobs": "[]"}
+        )
+
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234"})
+        relation_data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        self.assertEqual(published, relation_data["scrape_jobs"])
+
+    def test_new_leader_publishes(self):
+        """Test a unit elected leader publishes its payload without waiting for another event."""
+        self.harness.update_config({"targets": "foo:1234"})
+        rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        # the previous leader's payload
+        self.harness.update_relation_data(
+            rel_id, self.harness.charm.app.name, {"scrape_jobs": "[]"}
+        )
+
+        self.harness.set_leader(True)
+        relation_data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        (job,) = json.loads(relation_data["scrape_jobs"])
+        self.assertEqual([{"targets": ["foo:1234"]}], job["static_configs"])
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_new_relation_is_written_once(self):
+        """Test each relation gets the payload even when it is unchanged for the others."""
+        self.harness.set_leader(True)
+        self.harness.update_config({"targets": "foo:1234"})
+        first_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        second_rel_id = self.harness.add_relation("metrics-endpoint", "scrape-config")
+
+        self.assertEqual(2, self.harness.charm._stored.relation_writes)
+        self.assertEqual(
+            self.harness.get_relation_data(first_rel_id, self.harness.charm.app.name),
+            self.harness.get_relation_data(second_rel_id, self.harness.charm.app.name),
+        )
+
+    def test_targets_file_is_merged_with_config_targets(self):
+        """Test targets from the resource file are appended to config targets, deduplicated."""
+        self.harness.set_leader(True)
+        self.harness.add_resource(
+            "targets-file", "# inventory\nbar:5678\n\nfoo:1234\nbaz:9100\nbar:5678\n"
+        )
+
+        self.harness.update_config({"targets": "foo:1234"})
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            ["foo:1234", "bar:5678", "baz:9100"],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"][0]["targets"],
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_targets_file_alone_is_enough(self):
+        """Test the charm does not need the targets config option when a file is attached."""
+        self.harness.set_leader(True)
+        self.harness.add_resource("targets-file", "foo:1234\n")
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            ["foo:1234"],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"][0]["targets"],
+        )
+
+    def test_charm_blocks_if_targets_file_has_invalid_target(self):
+        """Test the charm goes into blocked state if the resource file has an invalid target."""
+        self.harness.set_leader(True)
+        self.harness.add_resource("targets-file", "foo:1234\nhttps://bar:5678\n")
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_charm_blocks_if_targets_file_is_not_utf8(self):
+        """Test a resource file that is not UTF-8 blocks the charm rather than failing the hook."""
+        self.harness.set_leader(True)
+        self.harness.add_resource("targets-file", b"a:1\n\xff\xfe:2\n")
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        self.assertEqual(
+            BlockedStatus("Invalid targets-file; see debug-logs"), self.harness.model.unit.status
+        )
+
+    def test_charm_blocks_if_targets_file_is_missing(self):
+        """Test a fetched resource file that cannot be read blocks the charm."""
+        self.harness.set_leader(True)
+        self.harness.add_resource("targets-file", "foo:1234\n")
+        missing = Path(self.harness.charm.charm_dir, "missing", "targets-file")
+
+        with patch.object(self.harness.model.resources, "fetch", return_value=missing):
+            self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        self.assertEqual(
+            BlockedStatus("Invalid targets-file; see debug-logs"), self.harness.model.unit.status
+        )
+
+    def test_targets_with_same_labels_share_a_static_config(self):
+        """Test per-target labels are merged with common labels and grouped by label set."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {
+                "targets": "foo:1234{rack=r1,role=db},bar:5678,baz:9100{role=db,rack=r1},"
+                "qux:9100{dc=lon}",
+                "labels": "dc:fra",
+            }
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            [
+                {
+                    "targets": ["foo:1234", "baz:9100"],
+                    "labels": {"dc": "fra", "rack": "r1", "role": "db"},
+                },
+                {"targets": ["bar:5678"], "labels": {"dc": "fra"}},
+                {"targets": ["qux:9100"], "labels": {"dc": "lon"}},
+            ],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"],
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_charm_blocks_if_target_labels_invalid(self):
+        """Test the charm goes into blocked state if a per-target label set is malformed."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "foo:1234{rack}"})
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_probe_targets_action_reports_every_target(self):
+        """Test the probe action returns one result per configured target."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            closed_port = sock.getsockname()[1]
+        self.harness.update_config({"targets": f"127.0.0.1:{closed_port}"})
+
+        output = self.harness.run_action("probe-targets", {"timeout": 1})
+
+        self.assertEqual(0, output.results["up"])
+        self.assertEqual(1, output.results["down"])
+        (result,) = json.loads(output.results["results"])
+        self.assertEqual(f"127.0.0.1:{closed_port}", result["target"])
+        self.assertFalse(result["up"])
+
+    def test_probe_targets_action_fails_without_targets(self):
+        """Test the probe action fails when there is nothing to probe."""
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("probe-targets")
+
+    def test_analyze_cardinality_action(self):
+        """Test the cardinality action reports series counts and recommendations."""
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                body = b"".join(b'big{id="%d"} 1\n' % i for i in range(100)) + b"small 1\n"
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.harness.update_config({"targets": f"127.0.0.1:{server.server_address[1]}"})
+
+        output = self.harness.run_action("analyze-cardinality")
+
+        (report,) = json.loads(output.results["targets"])
+        self.assertEqual(101, report["series"])
+        self.assertEqual({"big": 100, "small": 1}, report["top_families"])
+        self.assertEqual(["big"], report["drop_candidates"])
+        self.assertEqual(160, json.loads(output.results["recommended"])["sample_limit"])
+        (rule,) = json.loads(output.results["drop-rules"])
+        self.assertEqual(["__name__"], rule["source_labels"])
+
+    def test_compare_protocols_action(self):
+        """Test the protocol comparison measures each protocol and encoding per target."""
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                body = b"".join(b'big{id="%d"} 1\n' % i for i in range(100))
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.harness.update_config({"targets": f"127.0.0.1:{server.server_address[1]}"})
+
+        output = self.harness.run_action(
+            "compare-protocols", {"protocols": "PrometheusText0.0.4,PrometheusProto"}
+        )
+
+        measurements = json.loads(output.results["targets"])
+        self.assertEqual(4, len(measurements))
+        # the target ignores Accept-Encoding and protobuf requests
+        self.assertEqual([True, False, False, False], [m["served"] for m in measurements])
+        self.assertNotIn("recommended", output.results)
+        (cheapest,) = json.loads(output.results["cheapest"]).values()
+        self.assertEqual(["PrometheusText0.0.4"], cheapest["scrape_protocols"])
+        self.assertFalse(cheapest["enable_compression"])
+
+    def test_compare_protocols_action_rejects_unknown_protocol(self):
+        """Test the protocol comparison fails on protocols Prometheus does not know."""
+        self.harness.update_config({"targets": "foo:1234"})
+        with self.assertRaises(ActionFailed):
+            self.harness.run_action("compare-protocols", {"protocols": "Text"})
+
+    def test_scrape_job_has_interval_and_limits(self):
+        """Test scrape interval, timeout and ingestion limits are added to the job."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {
+                "targets": "foo:1234",
+                "scrape_interval": "2m",
+                "scrape_timeout": "1m",
+                "sample_limit": 5000,
+                "label_limit": 30,
+            }
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        (job,) = json.loads(relation_data["scrape_jobs"])
+        self.assertEqual("2m", job["scrape_interval"])
+        self.assertEqual("1m", job["scrape_timeout"])
+        self.assertEqual(5000, job["sample_limit"])
+        self.assertEqual(30, job["label_limit"])
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_charm_blocks_if_scrape_timeout_exceeds_interval(self):
+        """Test the charm goes into blocked state if scrape options are inconsistent."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {"targets": "foo:1234", "scrape_interval": "30s", "scrape_timeout": "1m"}
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_scrape_job_has_relabel_configs(self):
+        """Test relabel configs and drop_metrics are validated and added to the job."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {
+                "targets": "foo:1234",
+                "relabel_configs": "- {target_label: env, replacement: prod}",
+                "metric_relabel_configs": "- {regex: tmp_.*, action: labeldrop}",
+                "drop_metrics": "go_.*,process_.*",
+            }
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        (job,) = json.loads(relation_data["scrape_jobs"])
+        self.assertEqual([{"target_label": "env", "replacement": "prod"}], job["relabel_configs"])
+        self.assertEqual(
+            [
+                {
+                    "source_labels": ["__name__"],
+                    "regex": "(?:go_.*)|(?:process_.*)",
+                    "action": "drop",
+                },
+                {"regex": "tmp_.*", "action": "labeldrop"},
+            ],
+            job["metric_relabel_configs"],
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_charm_blocks_if_relabel_configs_invalid(self):
+        """Test the charm goes into blocked state if a relabel rule is invalid."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        for config in (
+            {"metric_relabel_configs": "- {action: drop, regex: 'a(?=b)'}"},
+            {"relabel_configs": "[unclosed"},
+            {"drop_metrics": "go_(.*"},
+        ):
+            with self.subTest(config=config):
+                self.harness.update_config({"targets": "foo:1234", **config})
+                relation_data = self.harness.get_relation_data(
+                    downstream_rel_id, self.harness.charm.app.name
+                )
+                self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+                self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+                self.harness.update_config(unset=list(config))
+
+    def test_jobs_option_renders_independent_jobs(self):
+        """Test every `jobs` entry becomes its own job, next to the flat config one."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {
+                "targets": "foo:1234",
+                "jobs": """
+- job_name: node
+  targets: [10.0.0.1:9100, 10.0.0.2:9100]
+  labels: {env: prod}
+- job_name: app
+  targets: 10.0.1.1:8443{role=api}
+  scheme: https
+  metrics_path: /internal/metrics
+  params: {module: [http_2xx]}
+  basic_auth: user:password
+  tls_config_insecure_skip_verify: true
+  scrape_interval: 5m
+""",
+            }
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        prefix = "juju_lma_e40bf1a_prometheus-scrape-target-k8s_"
+        self.assertEqual(
+            [
+                {
+                    "job_name": prefix + "external_jobs",
+                    "static_configs": [{"targets": ["foo:1234"]}],
+                },
+                {
+                    "job_name": prefix + "node",
+                    "static_configs": [
+                        {"targets": ["10.0.0.1:9100", "10.0.0.2:9100"], "labels": {"env": "prod"}}
+                    ],
+                },
+                {
+                    "job_name": prefix + "app",
+                    "scheme": "https",
+                    "metrics_path": "/internal/metrics",
+                    "params": {"module": ["http_2xx"]},
+                    "basic_auth": {"username": "user", "password": "password"},
+                    "tls_config": {"insecure_skip_verify": True},
+                    "scrape_interval": "5m",
+                    "static_configs": [{"targets": ["10.0.1.1:8443"], "labels": {"role": "api"}}],
+                },
+            ],
+            json.loads(relation_data["scrape_jobs"]),
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_jobs_option_errors_are_reported_together(self):
+        """Test errors from several jobs all show up, and none of those jobs is published."""
+        self.harness.set_leader(True)
+
+        with self.assertLogs("charm", "ERROR") as logs:
+            self.harness.update_config(
+                {
+                    "jobs": """
+- job_name: a
+  targets: [foo:1234]
+  basic_auth: nopassword
+- job_name: b
+  targets: [https://bar:5678]
+- job_name: c
+- targets: [baz:1]
+  scrape_timeout: soon
+""",
+                }
+            )
+            downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        output = _log_output(logs)
+        for error in (
+            "jobs[a].basic_auth",
+            "jobs[b].targets",
+            "jobs[c].targets",
+            "jobs[3].job_name",
+        ):
+            self.assertIn(error, output)
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+        self.assertIn("jobs[a].basic_auth", self.harness.model.unit.status.message)
+
+    def test_jobs_option_rejects_mistyped_fields(self):
+        """Test `jobs` fields of the wrong YAML type are reported, rather than published."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        with self.assertLogs("charm", "ERROR") as logs:
+            self.harness.update_config(
+                {
+                    "jobs": """
+- {job_name: a, targets: [foo:1], scrape_interval: 30, scrape_timeout: 10}
+- {job_name: b, targets: [foo:1], basic_auth: {u: p}}
+- {job_name: c, targets: [foo:1], tls_config_insecure_skip_verify: 'yes'}
+- {job_name: d, targets: [foo:1], metrics_path: 5, scheme: [https]}
+- {job_name: e, targets: [foo:1], params: {module: x}}
+- {job_name: f, targets: [foo:1], tls_config_server_name: 1}
+""",
+                }
+            )
+
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual({"scrape_jobs": "[]"}, dict(relation_data))
+        output = _log_output(logs)
+        for error in (
+            "jobs[a].scrape_interval",
+            "jobs[a].scrape_timeout",
+            "jobs[b].basic_auth",
+            "jobs[c].tls_config_insecure_skip_verify",
+            "jobs[d].metrics_path",
+            "jobs[d].scheme",
+            "jobs[e].params: module must be a list of strings",
+            "jobs[f].tls_config_server_name",
+        ):
+            self.assertIn(error, output)
+        self.assertIsInstance(self.harness.model.unit.status, BlockedStatus)
+
+    def test_jobs_with_errors_do_not_hold_back_the_others(self):
+        """Test only the jobs with errors are left out, and the charm still blocks on them."""
+        self.harness.set_leader(True)
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+
+        self.harness.update_config(
+            {
+                "targets": "foo:1234",
+                "jobs": "[{job_name: x, targets: [bar:1], scrape_timeout: bogus},"
+                " {job_name: y, targets: [baz:1]}]",
+                "distribution": "bogus",
+            }
+        )
+
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        prefix = "juju_lma_e40bf1a_prometheus-scrape-target-k8s_"
+        self.assertEqual(
+            [prefix + "external_jobs", prefix + "y"],
+            [job["job_name"] for job in json.loads(relation_data["scrape_jobs"])],
+        )
+        status = self.harness.model.unit.status
+        self.assertIsInstance(status, BlockedStatus)
+        self.assertIn("jobs[x].scrape_timeout", status.message)
+        self.assertIn("distribution", status.message)
+
+    def test_charm_blocks_on_duplicate_job_names(self):
+        """Test job names must be unique across the flat config and the `jobs` option."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {"targets": "foo:1234", "jobs": "[{job_name: external_jobs, targets: [bar:1]}]"}
+        )
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid jobs; see debug-logs")
+        )
+
+    def test_invalid_basic_auth_is_not_hidden_by_active_status(self):
+        """Test a config error keeps the charm blocked even though targets are valid."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "foo:1234", "basic_auth": "nopassword"})
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid basic_auth; see debug-logs")
+        )
+
+    def test_target_patterns_are_expanded(self):
+        """Test CIDR blocks and ranges expand, with explicit entries taking precedence."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config(
+            {
+                "targets": "10.0.0.0/30:9100{rack=r1},node[1-2]:9100,10.0.0.1:9100{rack=r9}",
+            }
+        )
+
+        downstream_rel_id = self.harness.add_relation("metrics-endpoint", "prometheus-k8s")
+        relation_data = self.harness.get_relation_data(
+            downstream_rel_id, self.harness.charm.app.name
+        )
+        self.assertEqual(
+            [
+                {"targets": ["10.0.0.1:9100"], "labels": {"rack": "r9"}},
+                {"targets": ["10.0.0.2:9100"], "labels": {"rack": "r1"}},
+                {"targets": ["node1:9100", "node2:9100"]},
+            ],
+            json.loads(relation_data["scrape_jobs"])[0]["static_configs"],
+        )
+
+    def test_charm_blocks_if_expansion_exceeds_cap(self):
+        """Test a pattern expanding beyond max_expanded_targets blocks the charm."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "10.0.0.0/16:9100", "max_expanded_targets": 1000})
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid targets; see debug-logs")
+        )
+
+    def test_charm_blocks_if_expanded_address_invalid(self):
+        """Test every expanded address is validated."""
+        self.harness.set_leader(True)
+
+        self.harness.update_config({"targets": "node[1-2]:99999"})
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid targets; see debug-logs")
+        )
+
+
+class TestFederation(LeaderCharmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.selectors = ['{{job="job{}"}}'.format(i) for i in range(20)]
+
+    def test_selectors_are_split_between_federation_jobs(self):
+        """Test each selector is pulled by exactly one federation job."""
+        self.harness.update_config(
+            {"targets": "prom:9090", "federation_selectors": "\n".join(self.selectors)}
+        )
+
+        jobs = self._jobs()
+        self.assertEqual(4, len(jobs))
+        self.assertEqual(
+            sorted(self.selectors), sorted(sum((job["params"]["match[]"] for job in jobs), []))
+        )
+        for job in jobs:
+            self.assertRegex(job["job_name"], r"_external_jobs_federate[0-3]$")
+            self.assertEqual("/federate", job["metrics_path"])
+            self.assertTrue(job["honor_labels"])
+            self.assertEqual("1m", job["scrape_interval"])
+            self.assertEqual("45s", job["scrape_timeout"])
+            self.assertEqual([{"targets": ["prom:9090"]}], job["static_configs"])
+
+    def test_selectors_are_balanced(self):
+        """Test the jobs get as many selectors as one another, whatever the selectors."""
+        for count in (4, 5, 7):
+            with self.subTest(count=count):
+                self.harness.update_config(
+                    {
+                        "targets": "prom:9090",
+                        "federation_selectors": "\n".join(self.selectors[:count]),
+                    }
+                )
+                sizes = [len(job["params"]["match[]"]) for job in self._jobs()]
+                self.assertEqual(min(count, 4), len(sizes))
+                self.assertEqual(count, sum(sizes))
+                self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_added_selector_leaves_other_jobs_alone(self):
+        """Test adding a selector changes the params of at most two federation jobs."""
+        self.harness.update_config(
+            {"targets": "prom:9090", "federation_selectors": "\n".join(self.selectors)}
+        )
+        before = {job["job_name"]: job["params"] for job in self._jobs()}
+        self.harness.update_config(
+            {"federation_selectors": "\n".join(self.selectors + ['{job="extra"}'])}
+        )
+        after = {job["job_name"]: job["params"] for job in self._jobs()}
+
+        self.assertEqual(before.keys(), after.keys())
+        self.assertLessEqual(sum(before[name] != after[name] for name in before), 2)
+
+    def test_dropped_honor_labels_is_reported(self):
+        """Test the unit stays active, noting that Prometheus charms drop honor_labels."""
+        self.harness.update_config({"targets": "prom:9090", "federation_selectors": "up"})
+        status = self.harness.model.unit.status
+        self.assertIsInstance(status, ActiveStatus)
+        self.assertTrue(status.message.endswith(", ignored by Prometheus: honor_labels"))
+
+    def test_configured_options_take_precedence(self):
+        """Test a single federation job keeps the configured path, params and interval."""
+        self.harness.update_config(
+            {
+                "targets": "prom:9090",
+                "federation_selectors": "up",
+                "federation_jobs": 1,
+                "metrics_path": "/prometheus/federate",
+                "params": "{format: [text]}",
+                "scrape_interval": "30s",
+            }
+        )
+
+        (job,) = self._jobs()
+        self.assertTrue(job["job_name"].endswith("_external_jobs"))
+        self.assertEqual("/prometheus/federate", job["metrics_path"])
+        self.assertEqual({"format": ["text"], "match[]": ["up"]}, job["params"])
+        self.assertEqual("30s", job["scrape_interval"])
+        self.assertNotIn("scrape_timeout", job)
+
+    def test_charm_blocks_if_selectors_invalid(self):
+        """Test invalid selectors, and a conflicting match[] param, block the charm."""
+        self.harness.update_config(
+            {
+                "targets": "prom:9090",
+                "federation_selectors": 'up\n{job=~".*"}',
+                "params": "{match[]: [up]}",
+            }
+        )
+
+        self.assertEqual([], self._jobs())
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid federation_selectors, params; see debug-logs"),
+        )
+
+
+class TestMultiTargetExporter(LeaderCharmTestCase):
+    def test_one_job_per_module(self):
+        """Test every module scrapes all the devices through the exporter."""
+        self.harness.update_config(
+            {
+                "targets": "10.1.0.0/30,ups.example.com{site=a}",
+                "exporter_address": "snmp-exporter:9116",
+                "exporter_modules": "if_mib,ups_mib",
+                "metrics_path": "/snmp",
+                "relabel_configs": "[{source_labels: [instance], target_label: device}]",
+            }
+        )
+
+        jobs = self._jobs()
+        self.assertEqual([["if_mib"], ["ups_mib"]], [job["params"]["module"] for job in jobs])
+        for job in jobs:
+            self.assertTrue(
+                job["job_name"].endswith("_external_jobs_" + job["params"]["module"][0])
+            )
+            self.assertEqual("/snmp", job["metrics_path"])
+            self.assertEqual(
+                [
+                    {"source_labels": ["__address__"], "target_label": "__param_target"},
+                    {"source_labels": ["__param_target"], "target_label": "instance"},
+                    {"target_label": "__address__", "replacement": "snmp-exporter:9116"},
+                    {"source_labels": ["instance"], "target_label": "device"},
+                ],
+                job["relabel_configs"],
+            )
+            self.assertEqual(
+                [
+                    {"targets": ["10.1.0.1", "10.1.0.2"]},
+                    {"targets": ["ups.example.com"], "labels": {"site": "a"}},
+                ],
+                job["static_configs"],
+            )
+
+    def test_remote_devices_are_checked_as_devices(self):
+        """Test targets from the scrape-targets relation pass the same checks as `targets`."""
+        data = {"targets": json.dumps(["https://example.com/health"])}
+        self.harness.add_relation("scrape-targets", "inventory", app_data=data)
+        self.assertEqual([], self._jobs())
+
+        self.harness.update_config(
+            {"exporter_address": "blackbox-exporter:9115", "metrics_path": "/probe"}
+        )
+
+        (job,) = self._jobs()
+        self.assertEqual([{"targets": ["https://example.com/health"]}], job["static_configs"])
+
+    def test_urls_are_valid_devices(self):
+        """Test blackbox_exporter devices may be URLs, and a single module keeps the job name."""
+        self.harness.update_config(
+            {
+                "targets": "https://example.com/health,http://10.0.0.1:8080",
+                "exporter_address": "blackbox:9115",
+                "exporter_modules": "http_2xx",
+                "metrics_path": "/probe",
+            }
+        )
+
+        (job,) = self._jobs()
+        self.assertTrue(job["job_name"].endswith("_external_jobs"))
+        self.assertEqual(
+            [{"targets": ["https://example.com/health", "http://10.0.0.1:8080"]}],
+            job["static_configs"],
+        )
+        # without an exporter, the same targets are invalid
+        self.harness.update_config(unset=["exporter_address", "exporter_modules"])
+        self.assertIsInstance(self.harness.charm.unit.status, BlockedStatus)
+
+    def test_charm_blocks_if_exporter_options_invalid(self):
+        """Test an invalid exporter, modules without an exporter, and module params block."""
+        self.harness.update_config({"targets": "10.0.0.1", "exporter_address": "http://snmp:9116"})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid exporter_address; see debug-logs"),
+        )
+
+        self.harness.update_config(
+            {
+                "exporter_address": "snmp:9116",
+                "exporter_modules": "if_mib,if_mib",
+                "params": "{module: [if_mib]}",
+            }
+        )
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid exporter_modules, params; see debug-logs"),
+        )
+
+        self.harness.update_config(unset=["exporter_address", "params"])
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid exporter_modules; see debug-logs"),
+        )
+
+
+class TestPayloadBudget(LeaderCharmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.targets = ",".join("10.0.0.{}:9100".format(i) for i in range(1, 101))
+
+    def test_payload_within_budget(self):
+        """Test a payload fitting the budget is published without a warning."""
+        self.harness.update_config({"targets": self.targets, "payload_budget": "10KB"})
+        (job,) = self._jobs()
+        self.assertEqual(100, len(job["static_configs"][0]["targets"]))
+        self.assertNotIn("payload_budget", self.harness.model.unit.status.message)
+
+    def test_payload_over_budget_warns(self):
+        """Test a payload over the budget is still published, with a warning."""
+        with self.assertLogs("charm", "WARNING") as logs:
+            self.harness.update_config({"targets": self.targets, "payload_budget": "1KB"})
+        self.assertIn("exceeds payload_budget", _log_output(logs))
+        (job,) = self._jobs()
+        self.assertEqual(100, len(job["static_configs"][0]["targets"]))
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+        self.assertTrue(self.harness.model.unit.status.message.endswith(", over payload_budget"))
+
+    def test_invalid_budget_blocks(self):
+        """Test an invalid payload budget is reported."""
+        self.harness.update_config({"targets": self.targets, "payload_budget": "1 MB"})
+        self.assertEqual(
+            BlockedStatus("Invalid payload_budget; see debug-logs"),
+            self.harness.model.unit.status,
+        )
+
+
+class TestRemoteTargets(LeaderCharmTestCase):
+    def _add_remote(self, app: str, targets: list, labels=None) -> int:
+        data = {"targets": json.dumps(targets)}
+        if labels:
+            data["labels"] = json.dumps(labels)
+        return self.harness.add_relation("scrape-targets", app, app_data=data)
+
+    def _static_configs(self):
+        return [static_config for job in self._jobs() for static_config in job["static_configs"]]
+
+    def test_remote_targets_are_merged(self):
+        """Test targets from several applications are deduplicated into the config job."""
+        self.harness.update_config({"targets": "foo:1{role=db}", "labels": "env:prod"})
+        self._add_remote("inventory-b", ["bar:1", "baz:1{rack=r2}"], {"rack": "r1"})
+        self._add_remote("inventory-a", ["foo:1", "bar:1"])
+
+        self.assertEqual(
+            [
+                {"targets": ["bar:1"], "labels": {"env": "prod"}},
+                {"targets": ["baz:1"], "labels": {"env": "prod", "rack": "r2"}},
+                {"targets": ["foo:1"], "labels": {"env": "prod", "role": "db"}},
+            ],
+            sorted(self._static_configs(), key=lambda static_config: static_config["targets"]),
+        )
+
+    def test_remote_targets_without_config_targets(self):
+        """Test remote targets alone are enough to render the job."""
+        self._add_remote("inventory", ["foo:1"])
+        self.assertEqual([{"targets": ["foo:1"]}], self._static_configs())
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_invalid_remote_targets_are_ignored(self):
+        """Test an application publishing invalid data does not affect the others."""
+        self._add_remote("good", ["foo:1"])
+        with self.assertLogs("charm", "ERROR") as logs:
+            self._add_remote("bad", ["https://bar:1"])
+        self.assertIn("Ignoring the targets published by bad", _log_output(logs))
+        self.assertEqual([{"targets": ["foo:1"]}], self._static_configs())
+
+    def test_removed_relation_drops_its_targets(self):
+        """Test the targets of a removed application are no longer scraped."""
+        self._add_remote("a", ["foo:1"])
+        rel_id = self._add_remote("b", ["bar:1"])
+        self.harness.remove_relation(rel_id)
+        self.assertEqual([{"targets": ["foo:1"]}], self._static_configs())
+        self.assertEqual(["a"], list(self.harness.charm._stored.remote_targets))
+
+    def test_change_only_revalidates_its_application(self):
+        """Test a change from one application neither reads nor revalidates the others."""
+        rel_ids = [self._add_remote("app{}".format(i), ["app{}:1".format(i)]) for i in range(20)]
+
+        with patch("charm.validate_targets", wraps=validate_targets) as validate:
+            self.harness.update_relation_data(
+                rel_ids[3], "app3", {"targets": json.dumps(["app3:1", "app3:2"])}
+            )
+        # the changed application's targets, then the (empty) config targets
+        validated = [call.args[0] for call in validate.mock_calls]
+        self.assertEqual([["app3:1", "app3:2"], []], validated)
+        self.assertEqual(21, len(self._static_configs()[0]["targets"]))
+
+    def test_new_leader_reads_every_application(self):
+        """Test a unit that was not leader reads all the remote targets once it leads."""
+        self._add_remote("a", ["foo:1"])
+        self.harness.set_leader(False)
+        self.harness.update_config({"labels": "env:prod"})
+        self.assertEqual({}, dict(self.harness.charm._stored.remote_targets))
+
+        rel_id = self._add_remote("b", ["bar:1"])
+        self.harness.set_leader(True)
+        self.harness.update_relation_data(rel_id, "b", {"targets": json.dumps(["baz:1"])})
+        self.assertEqual(["baz:1", "foo:1"], sorted(self._static_configs()[0]["targets"]))
+
+    def test_regained_leadership_rereads_every_application(self):
+        """Test entries stored while last leading are read again on becoming leader."""
+        rel_id = self._add_remote("a", ["foo:1"])
+        # followers skip relation-changed hooks, so nothing drops the entries in between
+        self.harness.set_leader(False)
+        self.harness.update_relation_data(rel_id, "a", {"targets": json.dumps(["bar:1"])})
+        self.harness.charm._stored.remote_targets = {
+            "a": {"targets": {"foo:1": {}}, "error": "", "max_expanded": 65536},
+        }
+        self.harness.charm._stored.remote_targets_synced = True
+
+        self.harness.set_leader(True)
+        self.harness.update_config({"labels": "env:prod"})
+        self.assertEqual(["bar:1"], self._static_configs()[0]["targets"])
+
+
+class TestDistribution(unittest.TestCase):
+    def setUp(self):
+        self.harness = _leader_harness(self)
+        self.targets = ["10.0.0.{}:9100".format(i) for i in range(1, 101)]
+        self.harness.update_config({"targets": ",".join(self.targets), "labels": "env:prod"})
+
+    def _targets(self, rel_id):
+        relation_data = self.harness.get_relation_data(rel_id, self.harness.charm.app.name)
+        return [
+            target
+            for job in json.loads(relation_data["scrape_jobs"])
+            for static_config in job["static_configs"]
+            for target in static_config["targets"]
+        ]
+
+    def test_jobs_are_replicated_by_default(self):
+        """Test every related Prometheus gets every target by default."""
+        rel_ids = [self.harness.add_relation("metrics-endpoint", name) for name in "ab"]
+
+        for rel_id in rel_ids:
+            self.assertEqual(self.targets, self._targets(rel_id))
+
+    def test_targets_are_split_between_prometheus_apps(self):
+        """Test each target goes to exactly one Prometheus in hash mode."""
+        self.harness.update_config({"distribution": "hash"})
+        rel_ids = [self.harness.add_relation("metrics-endpoint", name) for name in "abc"]
+
+        slices = [self._targets(rel_id) for rel_id in rel_ids]
+        self.assertEqual(sorted(self.targets), sorted(sum(slices, [])))
+        self.assertTrue(all(slices))
+
+    def test_adding_a_prometheus_only_moves_its_own_slice(self):
+        """Test relating another Prometheus only takes targets away from the others."""
+        self.harness.update_config({"distribution": "hash"})
+        rel_ids = [self.harness.add_relation("metrics-endpoint", name) for name in "ab"]
+        before = [set(self._targets(rel_id)) for rel_id in rel_ids]
+
+        new_id = self.harness.add_relation("metrics-endpoint", "c")
+
+        after = [set(self._targets(rel_id)) for rel_id in rel_ids]
+        for old, new in zip(before, after):
+            self.assertLessEqual(new, old)
+        self.assertEqual(set().union(*before) - set().union(*after), set(self._targets(new_id)))
+
+    def test_charm_blocks_if_distribution_invalid(self):
+        """Test the charm goes into blocked state for an unknown distribution mode."""
+        self.harness.update_config({"distribution": "random"})
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid distribution; see debug-logs")
+        )
+
+
+class TestHostnameResolution(LeaderCharmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.table = {"foo": ["10.0.0.1"], "bar": ["2001:db8::1"], "dup": ["10.0.0.2"]}
+        self.lookups = []
+        self.harness.charm.resolver = self._resolve
+
+    def _resolve(self, host):
+        self.lookups.append(host)
+        if host not in self.table:
+            raise OSError("unknown host")
+        return self.table[host]
+
+    def _static_configs(self):
+        return self._jobs()[0]["static_configs"]
+
+    def test_hostnames_are_replaced_by_their_addresses(self):
+        """Test resolved targets keep their original address as the instance label."""
+        self.harness.update_config(
+            {
+                "targets": "foo:9100{rack=r1},bar:9100,10.0.0.2:9100,dup:9100,nope:9100",
+                "resolve_hostnames": True,
+            }
+        )
+
+        # dup resolves to the address of another target, so it is left to Prometheus
+        self.assertEqual(
+            [
+                {"targets": ["10.0.0.2:9100", "nope:9100", "dup:9100"]},
+                {"targets": ["10.0.0.1:9100"], "labels": {"instance": "foo:9100", "rack": "r1"}},
+                {"targets": ["[2001:db8::1]:9100"], "labels": {"instance": "bar:9100"}},
+            ],
+            self._static_configs(),
+        )
+        self.assertIsInstance(self.harness.model.unit.status, ActiveStatus)
+
+    def test_hostnames_are_kept_by_default(self):
+        """Test nothing is resolved unless resolve_hostnames is set."""
+        self.harness.update_config({"targets": "foo:9100"})
+
+        self.assertEqual([{"targets": ["foo:9100"]}], self._static_configs())
+        self.assertEqual([], self.lookups)
+
+    def test_resolutions_are_cached_until_they_expire(self):
+        """Test lookups are cached across hooks and refreshed on update-status once expired."""
+        self.harness.update_config({"targets": "foo:9100", "resolve_hostnames": True})
+        self.harness.update_config({"job_name": "renamed"})
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(["foo"], self.lookups)
+
+        self.table["foo"] = ["10.0.0.9"]
+        self.harness.charm._stored.dns_cache["foo"] = ["10.0.0.1", 0]
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(["foo", "foo"], self.lookups)
+        self.assertEqual(
+            [{"targets": ["10.0.0.9:9100"], "labels": {"instance": "foo:9100"}}],
+            self._static_configs(),
+        )
+
+    def test_unconfigured_hostnames_are_forgotten(self):
+        """Test the cache only holds the hostnames still configured."""
+        self.harness.update_config({"targets": "foo:9100,bar:9100", "resolve_hostnames": True})
+        self.harness.update_config({"targets": "foo:9100"})
+
+        self.assertEqual(["foo"], list(self.harness.charm._stored.dns_cache))
+
+    def test_resolution_in_jobs(self):
+        """Test resolve_hostnames can be set per entry of the `jobs` option."""
+        self.harness.update_config(
+            {"jobs": "[{job_name: a, targets: [foo:1], resolve_hostnames: true}]"}
+        )
+
+        self.assertEqual(
+            [{"targets": ["10.0.0.1:1"], "labels": {"instance": "foo:1"}}],
+            self._static_configs(),
+        )
+
+    def test_https_targets_are_kept_without_server_name(self):
+        """Test https targets are only resolved when the certificates name the server."""
+        self.harness.update_config(
+            {"targets": "foo:9100", "resolve_hostnames": True, "scheme": "https"}
+        )
+        self.assertEqual([{"targets": ["foo:9100"]}], self._static_configs())
+        self.assertEqual([], self.lookups)
+
+        self.harness.update_config({"tls_config_server_name": "foo"})
+        self.assertEqual(
+            [{"targets": ["10.0.0.1:9100"], "labels": {"instance": "foo:9100"}}],
+            self._static_configs(),
+        )
+
+    def test_charm_blocks_if_resolve_ttl_invalid(self):
+        """Test the charm goes into blocked state if the TTL is not a duration."""
+        self.harness.update_config(
+            {"targets": "foo:9100", "resolve_hostnames": True, "resolve_ttl": "soon"}
+        )
+
+        self.assertEqual(
+            self.harness.model.unit.status, BlockedStatus("Invalid resolve_ttl; see debug-logs")
+        )
+
+
+class TestHealthCheck(LeaderCharmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.down = set()
+        # devices an exporter answers `probe_success 0` for
+        self.failed_probes = set()
+        # targets left when the probe time ran out
+        self.unprobed = set()
+        self.probe = self._patch_probes(self._probe)
+        self.harness.update_config(
+            {"targets": "foo:1,bar:1", "health_check": True, "health_check_failures": 2}
+        )
+
+    def _probe(
+        self, jobs, concurrency, timeout, consumer=None, read_body=True, total_timeout=None
+    ):
+        results = []
+        for job in jobs:
+            for static_config in job["static_configs"]:
+                for target in static_config["targets"]:
+                    if consumer:
+                        success = b"0" if target in self.failed_probes else b"1"
+                        consumer(job, target)(b"probe_success " + success + b"\n")
+                    if target in self.unprobed:
+                        results.append(ProbeResult(target, error=NOT_PROBED))
+                        continue
+                    results.append(
+                        ProbeResult(target, status=None if target in self.down else 200)
+                    )
+        return results
+
+    def test_target_is_quarantined_after_consecutive_failures(self):
+        """Test a target moves to the quarantine job after K failed checks, and back."""
+        self.down.add("bar:1")
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(["main"], list(self._jobs_by_suffix()))
+        # a liveness check needs no body
+        self.assertFalse(self.probe.call_args.kwargs["read_body"])
+
+        self.harness.charm.on.update_status.emit()
+        jobs = self._jobs_by_suffix()
+        self.assertEqual([{"targets": ["foo:1"]}], jobs["main"]["static_configs"])
+        self.assertEqual([{"targets": ["bar:1"]}], jobs["_quarantine"]["static_configs"])
+        self.assertEqual("5m", jobs["_quarantine"]["scrape_interval"])
+
+        self.down.clear()
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            [{"targets": ["foo:1", "bar:1"]}], self._jobs_by_suffix()["main"]["static_configs"]
+        )
+
+    def test_exporter_probe_failures_are_down(self):
+        """Test a device is down if its exporter reports it could not probe it."""
+        self.harness.update_config(
+            {"exporter_address": "blackbox:9115", "metrics_path": "/probe", "targets": "foo,bar"}
+        )
+        self.failed_probes.add("bar")
+        for _ in range(2):
+            self.harness.charm.on.update_status.emit()
+        # the exporter's whole response is read
+        self.assertTrue(self.probe.call_args.kwargs.get("read_body", True))
+        jobs = self._jobs_by_suffix()
+        self.assertEqual([{"targets": ["foo"]}], jobs["main"]["static_configs"])
+        self.assertEqual([{"targets": ["bar"]}], jobs["_quarantine"]["static_configs"])
+
+    def test_unprobed_targets_keep_their_failure_counts(self):
+        """Test a target left unprobed when time ran out is neither down nor reset."""
+        self.down.add("bar:1")
+        self.harness.charm.on.update_status.emit()
+        self.assertLessEqual(
+            self.probe.call_args.kwargs["total_timeout"], UPDATE_STATUS_PROBE_TIME
+        )
+
+        self.unprobed.add("bar:1")
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual([1], list(self.harness.charm._stored.health_failures.values()))
+
+        self.unprobed.clear()
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(
+            [{"targets": ["bar:1"]}], self._jobs_by_suffix()["_quarantine"]["static_configs"]
+        )
+
+    def test_quarantine_label(self):
+        """Test quarantined targets can be labelled rather than moved."""
+        self.harness.update_config({"quarantine": "label"})
+        self.down.add("bar:1")
+        for _ in range(2):
+            self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(
+            [{"targets": ["foo:1"]}, {"targets": ["bar:1"], "labels": {"quarantined": "true"}}],
+            self._jobs_by_suffix()["main"]["static_configs"],
+        )
+
+    def test_jobs_are_only_republished_when_membership_changes(self):
+        """Test checks that do not change the quarantine do not rewrite relation data."""
+        writes = self.harness.charm._stored.relation_writes
+        self.down.add("bar:1")
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(writes + 1, self.harness.charm._stored.relation_writes)
+        self.assertEqual(3, self.probe.call_count)
+
+    def test_no_checks_unless_enabled(self):
+        """Test health checks are opt-in, and disabling them restores every target."""
+        self.down.add("bar:1")
+        for _ in range(2):
+            self.harness.charm.on.update_status.emit()
+        self.harness.update_config({"health_check": False})
+        self.harness.charm.on.update_status.emit()
+
+        self.assertEqual(2, self.probe.call_count)
+        self.assertEqual(["main"], list(self._jobs_by_suffix()))
+        self.assertEqual({}, dict(self.harness.charm._stored.health_failures))
+
+    def test_quarantine_interval_under_default_scrape_timeout(self):
+        """Test jobs without a scrape_timeout are checked against Prometheus' default one."""
+        self.harness.update_config({"quarantine_interval": "5s"})
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid quarantine_interval; see debug-logs"),
+        )
+
+    def test_charm_blocks_if_quarantine_options_invalid(self):
+        """Test invalid quarantine options are reported."""
+        self.harness.update_config(
+            {"quarantine": "hide", "quarantine_interval": "10s", "scrape_timeout": "30s"}
+        )
+
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid quarantine, quarantine_interval; see debug-logs"),
+        )
+
+
+class TestLatencyTiers(LeaderCharmTestCase):
+    def setUp(self):
+        super().setUp()
+        self.latency = {}
+        self.probe = self._patch_probes(self._probe)
+        self.harness.update_config(
+            {"targets": "foo:1,bar:1", "latency_tiers": "medium:1s:1m,slow:10s:5m:2m"}
+        )
+
+    def _probe(self, jobs, concurrency, timeout, read_body=True, total_timeout=None):
+        return [
+            ProbeResult(target, status=200, latency=self.latency.get(target, 0.1), body_size=100)
+            for _, target in job_targets(jobs)
+        ]
+
+    def test_slow_targets_move_to_their_tier(self):
+        """Test measured targets are published in the job of their tier."""
+        self.latency["bar:1"] = 20.0
+        self.harness.charm.on.update_status.emit()
+
+        jobs = self._jobs_by_suffix()
+        self.assertEqual([{"targets": ["foo:1"]}], jobs["main"]["static_configs"])
+        self.assertEqual([{"targets": ["bar:1"]}], jobs["_slow"]["static_configs"])
+        self.assertEqual("5m", jobs["_slow"]["scrape_interval"])
+        self.assertEqual("2m", jobs["_slow"]["scrape_timeout"])
+        # the probe waits long enough to measure the slowest tier
+        self.assertEqual(30.0, self.probe.call_args.kwargs["timeout"])
+
+    def test_tiers_do_not_flap(self):
+        """Test a target measured around a threshold stays in its tier."""
+        self.latency["bar:1"] = 1.5
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(["main", "_medium"], list(self._jobs_by_suffix()))
+        writes = self.harness.charm._stored.relation_writes
+
+        for latency in (0.9, 1.1, 0.9, 0.95):
+            self.latency["bar:1"] = latency
+            self.harness.charm.on.update_status.emit()
+        self.assertEqual(["main", "_medium"], list(self._jobs_by_suffix()))
+        self.assertEqual(writes, self.harness.charm._stored.relation_writes)
+
+        for _ in range(3):
+            self.latency["bar:1"] = 0.1
+            self.harness.charm.on.update_status.emit()
+        self.assertEqual(["main"], list(self._jobs_by_suffix()))
+
+    def test_timed_out_targets_count_as_slow(self):
+        """Test a target that does not answer within the probe timeout lands in the slowest tier."""
+        self.probe.side_effect = lambda jobs, concurrency, timeout, total_timeout: [
+            ProbeResult("foo:1", status=200, latency=0.1),
+            ProbeResult("bar:1", error="timeout after {}s".format(timeout)),
+        ]
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual(["main", "_slow"], list(self._jobs_by_suffix()))
+
+    def test_measurements_are_split_between_units(self):
+        """Test each unit measures its share, and the leader tiers from all the reports."""
+        targets = ["host{}:9100".format(i) for i in range(10)]
+        peer_id = self.harness.add_relation("workers", self.harness.charm.app.name)
+        self.harness.add_relation_unit(peer_id, "prometheus-scrape-target-k8s/1")
+        self.harness.update_config({"targets": ",".join(targets)})
+        self.latency.update(dict.fromkeys(targets, 20.0))
+        self.harness.charm.on.update_status.emit()
+
+        app_data = self.harness.get_relation_data(peer_id, self.harness.charm.app.name)
+        members = json.loads(app_data["members"])
+        share = [target for target in targets if owner(target, members) == members[0]]
+        probed = [target for _, target in job_targets(self.probe.call_args.args[0])]
+        self.assertEqual(share, probed)
+        self.assertLess(len(probed), len(targets))
+        slow = self._jobs_by_suffix()["_slow"]["static_configs"]
+        self.assertEqual(share, [target for c in slow for target in c["targets"]])
+
+        (job,) = self.harness.charm._scrape_jobs()
+        report = {
+            "digest": app_data["digest"],
+            "time": time.time(),
+            "samples": {
+                target_key(job["job_name"], target): [20.0, 100]
+                for target in targets
+                if target not in share
+            },
+        }
+        self.harness.update_relation_data(
+            peer_id, "prometheus-scrape-target-k8s/1", {"tiers": json.dumps(report)}
+        )
+        self.assertEqual(["_slow"], list(self._jobs_by_suffix()))
+
+    def test_disabling_tiers_restores_jobs(self):
+        """Test turning tiers off moves every target back and forgets the measurements."""
+        self.latency["bar:1"] = 20.0
+        self.harness.charm.on.update_status.emit()
+        self.harness.update_config(unset=["latency_tiers"])
+
+        self.assertEqual(["main"], list(self._jobs_by_suffix()))
+        self.assertEqual({}, dict(self.harness.charm._stored.tier_costs))
+
+    def test_charm_blocks_if_tiers_invalid(self):
+        """Test invalid tiers are reported."""
+        self.harness.update_config({"latency_tiers": "slow:10s"})
+        self.assertEqual(
+            self.harness.model.unit.status,
+            BlockedStatus("Invalid latency_tiers; see debug-logs"),
+        )
+
+
+class TestHealthWorkers(LeaderCharmTestCase):
+    TARGETS = ["host{}:9100".format(i) for i in range(30)]
+
+    def setUp(self):
+        super().setUp()
+        self.peer_id = self.harness.add_relation("workers", self.harness.charm.app.name)
+        self.harness.add_relation_unit(self.peer_id, "prometheus-scrape-target-k8s/1")
+        self.harness.add_relation_unit(self.peer_id, "prometheus-scrape-target-k8s/2")
+        self.probed = []
+        self._patch_probes(self._probe)
+        self.harness.update_config(
+            {
+                "targets": ",".join(self.TARGETS),
+                "health_check": True,
+                "health_check_failures": 1,
+            }
+        )
+
+    def _probe(self, jobs, concurrency, timeout, read_body=True, total_timeout=None):
+        targets = [target for _, target in job_targets(jobs)]
+        self.probed.append(targets)
+        return [ProbeResult(target, status=None) for target in targets]
+
+    def _quarantined(self):
+        return {
+            target
+            for job in self._jobs()
+            if job["job_name"].endswith("_quarantine")
+            for static_config in job["static_configs"]
+            for target in static_config["targets"]
+        }
+
+    def _report(self, unit_name, down):
+        """Publish the report a follower would after probing its share."""
+        app_data = self.harness.get_relation_data(self.peer_id, self.harness.charm.app.name)
+        (job,) = self.harness.charm._scrape_jobs()
+        self.harness.update_relation_data(
+            self.peer_id,
+            unit_name,
+            {
+                "health": json.dumps(
+                    {
+                        "digest": app_data["digest"],
+                        "time": time.time(),
+                        "down": [target_key(job["job_name"], target) for target in down],
+                    }
+                )
+            },
+        )
+
+    def _members(self):
+        app_data = self.harness.get_relation_data(self.peer_id, self.harness.charm.app.name)
+        return json.loads(app_data["members"])
+
+    def _share(self, unit_name):
+        return [target for target in self.TARGETS if owner(target, self._members()) == unit_name]
+
+    def test_leader_only_probes_its_share(self):
+        """Test the targets are split between the units, and the leader publishes the split."""
+        self.harness.charm.on.update_status.emit()
+
+        (probed,) = self.probed
+        self.assertEqual(self._share("prometheus-scrape-target-k8s/0"), probed)
+        self.assertLess(len(probed), len(self.TARGETS))
+        self.assertEqual(set(probed), self._quarantined())
+
+    def test_follower_reports_are_counted_once(self):
+        """Test the leader quarantines the targets its followers report down."""
+        self.harness.charm.on.update_status.emit()
+        share = self._share("prometheus-scrape-target-k8s/1")
+        self._report("prometheus-scrape-target-k8s/1", share[:1])
+
+        self.assertIn(share[0], self._quarantined())
+        self.assertNotIn(share[1], self._quarantined())
+        failures = dict(self.harness.charm._stored.health_failures)
+        # rereading the same report on another peer event does not count it again
+        self.harness.update_relation_data(
+            self.peer_id, "prometheus-scrape-target-k8s/2", {"unrelated": "1"}
+        )
+        self.assertEqual(failures, dict(self.harness.charm._stored.health_failures))
+
+    def test_stale_reports_are_ignored(self):
+        """Test a report made for another split of the targets is not counted."""
+        self.harness.charm.on.update_status.emit()
+        self.harness.remove_relation_unit(self.peer_id, "prometheus-scrape-target-k8s/2")
+        self.assertNotIn("prometheus-scrape-target-k8s/2", self._members())
+        quarantined = self._quarantined()
+        self.harness.update_relation_data(
+            self.peer_id,
+            "prometheus-scrape-target-k8s/1",
+            {"health": json.dumps({"digest": "stale", "time": time.time(), "down": self.TARGETS})},
+        )
+        self.assertEqual(quarantined, self._quarantined())
+
+    def test_follower_probes_its_share(self):
+        """Test a follower probes the share the leader assigned it, and reports failures."""
+        self.harness.charm.on.update_status.emit()
+        self.harness.set_leader(False)
+        self.probed.clear()
+        self.harness.charm.on.update_status.emit()
+
+        unit_name = self.harness.charm.unit.name
+        (probed,) = self.probed
+        self.assertEqual(self._share(unit_name), probed)
+        report = json.loads(self.harness.get_relation_data(self.peer_id, unit_name)["health"])
+        self.assertEqual(len(probed), len(report["down"]))
+        self.assertEqual(
+            ActiveStatus("probing targets for the leader"), self.harness.charm.unit.status
+        )
+
+    def test_follower_resolving_hostnames_differently_still_probes(self):
+        """Test the split does not depend on the addresses each unit resolves hostnames to."""
+        self.harness.charm.resolver = lambda host: [
+            "10.0.0.{}".format(self.TARGETS.index(host + ":9100"))
+        ]
+        self.harness.update_config({"resolve_hostnames": True})
+        self.harness.charm.on.update_status.emit()
+        self.harness.set_leader(False)
+        # round-robin DNS, or a cache of another age, gives the follower other addresses
+        self.harness.charm._stored.dns_cache = {}
+        self.harness.charm.resolver = lambda host: [
+            "10.1.0.{}".format(self.TARGETS.index(host + ":9100"))
+        ]
+        self.probed.clear()
+        self.harness.charm.on.update_status.emit()
+
+        unit_name = self.harness.charm.unit.name
+        (probed,) = self.probed
+        self.assertTrue(probed)
+        self.assertTrue(all(target.startswith("10.1.0.") for target in probed))
+        app_data = self.harness.get_relation_data(self.peer_id, self.harness.charm.app.name)
+        report = json.loads(self.harness.get_relation_data(self.peer_id, unit_name)["health"])
+        self.assertEqual(app_data["digest"], report["digest"])
+
+    def test_follower_waits_for_the_leaders_split(self):
+        """Test a follower does not probe before the leader assigned it a share."""
+        self.harness.set_leader(False)
+        self.harness.charm.on.update_status.emit()
+        self.assertEqual([], self.probed)
+
 
 class TestCharmWithInitialHooks(unittest.TestCase):
     def setUp(self):
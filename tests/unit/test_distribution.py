@@ -0,0 +1,70 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from distribution import distribute, owner, split_evenly
+
+TARGETS = ["10.0.{}.{}:9100".format(i // 250, i % 250) for i in range(3000)]
+
+
+class TestDistribution(unittest.TestCase):
+    def test_targets_are_spread_evenly(self):
+        members = ["prom-a", "prom-b", "prom-c"]
+        counts = dict.fromkeys(members, 0)
+        for target in TARGETS:
+            counts[owner(target, members)] += 1
+        for count in counts.values():
+            self.assertAlmostEqual(1000, count, delta=150)
+
+    def test_adding_a_member_moves_about_one_nth(self):
+        members = ["prom-a", "prom-b", "prom-c"]
+        before = {target: owner(target, members) for target in TARGETS}
+        after = {target: owner(target, members + ["prom-d"]) for target in TARGETS}
+
+        moved = [target for target in TARGETS if before[target] != after[target]]
+        self.assertTrue(all(after[target] == "prom-d" for target in moved))
+        self.assertAlmostEqual(len(TARGETS) / 4, len(moved), delta=150)
+
+    def test_distribute_keeps_job_options_and_labels(self):
+        job = {
+            "job_name": "a",
+            "metrics_path": "/m",
+            "static_configs": [{"targets": TARGETS[:100], "labels": {"rack": "r1"}}],
+        }
+        slices = distribute([job], ["prom-a", "prom-b"])
+
+        self.assertEqual(
+            sorted(TARGETS[:100]),
+            sorted(
+                target
+                for jobs in slices.values()
+                for target in jobs[0]["static_configs"][0]["targets"]
+            ),
+        )
+        for (sliced,) in slices.values():
+            self.assertEqual("/m", sliced["metrics_path"])
+            self.assertEqual({"rack": "r1"}, sliced["static_configs"][0]["labels"])
+
+    def test_members_without_targets_get_no_job(self):
+        self.assertEqual(
+            {"prom-a": [], "prom-b": []},
+            distribute([{"job_name": "a", "static_configs": []}], ["prom-a", "prom-b"]),
+        )
+
+    def test_split_evenly_is_balanced(self):
+        for count in (1, 7, 100, 101):
+            groups = split_evenly(TARGETS[:count], ["0", "1", "2", "3"])
+            sizes = [len(group) for group in groups.values()]
+            self.assertEqual(sorted(TARGETS[:count]), sorted(sum(groups.values(), [])))
+            self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_split_evenly_adding_an_item_moves_few_others(self):
+        members = ["0", "1", "2", "3"]
+        before = split_evenly(TARGETS[:100], members)
+        after = split_evenly(TARGETS[:101], members)
+
+        moved = [
+            item for member in members for item in before[member] if item not in after[member]
+        ]
+        self.assertLessEqual(len(moved), 3)
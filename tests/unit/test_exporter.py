@@ -0,0 +1,71 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from exporter import (
+    ProbeSuccess,
+    device_error,
+    exporter_of,
+    module_jobs,
+    parse_modules,
+    relabel_chain,
+)
+
+
+class TestDevices(unittest.TestCase):
+    def test_valid_devices(self):
+        for device in ("10.0.0.1", "switch1.example.com:161", "https://example.com/health?x=1"):
+            with self.subTest(device=device):
+                self.assertEqual("", device_error(device))
+
+    def test_invalid_devices(self):
+        for device in ("", "ftp://example.com", "http://", "http://a b", "http://x:99999"):
+            with self.subTest(device=device):
+                self.assertTrue(device_error(device))
+
+
+class TestModules(unittest.TestCase):
+    def test_parse_modules(self):
+        self.assertEqual((["if_mib", "ups_mib"], []), parse_modules("if_mib, ups_mib"))
+        self.assertEqual((["http_2xx"], []), parse_modules(["http_2xx"]))
+        self.assertTrue(parse_modules("if_mib,if_mib")[1])
+        self.assertTrue(parse_modules("if_mib,")[1])
+
+    def test_module_jobs(self):
+        job = {"job_name": "snmp", "params": {"auth": ["public_v2"]}, "static_configs": []}
+        self.assertEqual([job], module_jobs([job], []))
+        self.assertEqual(
+            [
+                dict(job, job_name="snmp_a", params={"auth": ["public_v2"], "module": ["a"]}),
+                dict(job, job_name="snmp_b", params={"auth": ["public_v2"], "module": ["b"]}),
+            ],
+            module_jobs([job], ["a", "b"]),
+        )
+
+    def test_exporter_of(self):
+        self.assertEqual("snmp:9116", exporter_of({"relabel_configs": relabel_chain("snmp:9116")}))
+        self.assertIsNone(exporter_of({}))
+        self.assertIsNone(exporter_of({"relabel_configs": relabel_chain("snmp:9116")[:2]}))
+
+
+class TestProbeSuccess(unittest.TestCase):
+    def _failed(self, *chunks: bytes) -> bool:
+        watcher = ProbeSuccess()
+        for chunk in chunks:
+            watcher.feed(chunk)
+        watcher.close()
+        return watcher.failed
+
+    def test_probe_success(self):
+        self.assertFalse(self._failed(b"# TYPE probe_success gauge\nprobe_success 1\n"))
+        self.assertTrue(self._failed(b"probe_duration_seconds 0.1\nprobe_success 0\n"))
+        self.assertTrue(self._failed(b'probe_success{module="http_2xx"} 0 1700000000000'))
+
+    def test_split_across_chunks(self):
+        self.assertTrue(self._failed(b"up 1\nprobe_succ", b"ess ", b"0\n"))
+        self.assertTrue(self._failed(b"probe_success 0"))
+
+    def test_other_metrics_are_ignored(self):
+        self.assertFalse(self._failed(b"probe_success_total 0\n", b"ifInOctets 0\n"))
+        self.assertFalse(self._failed(b""))
@@ -0,0 +1,47 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import subprocess
+import unittest
+from unittest.mock import patch
+
+from fastpath import handled
+
+
+class TestFastPath(unittest.TestCase):
+    def setUp(self):
+        hook_tool = patch("fastpath._hook_tool", side_effect=self._hook_tool)
+        self.hook_tool = hook_tool.start()
+        self.addCleanup(hook_tool.stop)
+        self.leader = "false"
+
+    def _hook_tool(self, *args):
+        return self.leader if args[0] == "is-leader" else ""
+
+    def _handled(self, hook):
+        return handled({"JUJU_DISPATCH_PATH": "hooks/" + hook})
+
+    def test_install_sets_the_workload_version(self):
+        self.assertTrue(self._handled("install"))
+        self.hook_tool.assert_called_once_with("application-version-set", "n/a")
+
+    def test_follower_skips_relation_changes(self):
+        for relation in ("metrics-endpoint", "scrape-targets", "workers"):
+            with self.subTest(relation=relation):
+                self.assertTrue(self._handled(relation + "-relation-changed"))
+
+    def test_leader_relation_changes_are_dispatched(self):
+        self.leader = "true"
+        self.assertFalse(self._handled("scrape-targets-relation-changed"))
+
+    def test_other_hooks_are_dispatched(self):
+        for hook in ("config-changed", "update-status", "scrape-targets-relation-broken"):
+            with self.subTest(hook=hook):
+                self.assertFalse(self._handled(hook))
+        self.assertFalse(handled({"JUJU_DISPATCH_PATH": "actions/probe-targets"}))
+        self.assertFalse(handled({}))
+        self.hook_tool.assert_not_called()
+
+    def test_hook_tool_errors_are_left_to_the_framework(self):
+        self.hook_tool.side_effect = subprocess.CalledProcessError(1, "is-leader")
+        self.assertFalse(self._handled("workers-relation-changed"))
@@ -0,0 +1,48 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from federation import parse_selectors, selector_error
+
+
+class TestSelectors(unittest.TestCase):
+    def test_valid_selectors(self):
+        for selector in (
+            "up",
+            "up{}",
+            '{job="prometheus"}',
+            '{__name__=~"job:.*"}',
+            'node_cpu_seconds_total{mode!="idle", cpu=~"[0-3]",}',
+            "{job='node'}",
+            "node_cpu{mode=`idle`}",
+            '{job!=""}',
+            '{job="a\\"b"}',
+        ):
+            with self.subTest(selector=selector):
+                self.assertEqual("", selector_error(selector))
+
+    def test_invalid_selectors(self):
+        for selector in (
+            "",
+            "{}",
+            '{job=~".*"}',
+            '{job=""}',
+            'up{job="a"',
+            "{job=prometheus}",
+            '{a="x" b="y"}',
+            '{job=~"("}',
+            '{job=~"(?=x)"}',
+            "1up",
+        ):
+            with self.subTest(selector=selector):
+                self.assertTrue(selector_error(selector))
+
+    def test_parse_selectors(self):
+        self.assertEqual((['{job="a"}', "up"], []), parse_selectors('{job="a"}\n\n  up  \n'))
+        self.assertEqual((["up"], []), parse_selectors(["up"]))
+        _, errors = parse_selectors(["up", "{}"])
+        self.assertEqual(
+            ["{}: must contain at least one matcher that does not match the empty string"], errors
+        )
+        self.assertTrue(parse_selectors({"up": 1})[1])
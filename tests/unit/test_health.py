@@ -0,0 +1,81 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from health import count_failures, job_targets, quarantine, target_key
+
+JOBS = [
+    {
+        "job_name": "a",
+        "scrape_interval": "30s",
+        "static_configs": [
+            {"targets": ["x:1", "y:1"], "labels": {"rack": "r1"}},
+            {"targets": ["z:1"]},
+        ],
+    },
+    {"job_name": "b", "static_configs": [{"targets": ["x:1"]}]},
+]
+
+
+class TestCountFailures(unittest.TestCase):
+    def test_consecutive_failures_are_counted(self):
+        failures = count_failures({"a x:1": 2, "a y:1": 1}, [("a x:1", False), ("a y:1", True)])
+        self.assertEqual({"a x:1": 3}, failures)
+
+    def test_unchecked_targets_are_forgotten(self):
+        self.assertEqual({}, count_failures({"a gone:1": 5}, [("a x:1", True)]))
+
+    def test_targets_checked_elsewhere_keep_their_count(self):
+        failures = count_failures(
+            {"a x:1": 2, "a y:1": 1, "a gone:1": 5}, [("a x:1", True)], unchecked={"a y:1"}
+        )
+        self.assertEqual({"a y:1": 1}, failures)
+
+    def test_job_targets_follow_probe_order(self):
+        self.assertEqual(
+            [("a", "x:1"), ("a", "y:1"), ("a", "z:1"), ("b", "x:1")], list(job_targets(JOBS))
+        )
+
+
+class TestQuarantine(unittest.TestCase):
+    def test_nothing_quarantined(self):
+        self.assertIs(JOBS, quarantine(JOBS, set(), "job"))
+
+    def test_quarantine_job(self):
+        quarantined = {target_key("a", "y:1"), target_key("a", "z:1")}
+        jobs = quarantine(JOBS, quarantined, "job", {"scrape_interval": "5m"})
+        self.assertEqual(
+            [
+                {
+                    "job_name": "a",
+                    "scrape_interval": "30s",
+                    "static_configs": [{"targets": ["x:1"], "labels": {"rack": "r1"}}],
+                },
+                {
+                    "job_name": "a_quarantine",
+                    "scrape_interval": "5m",
+                    "static_configs": [
+                        {"targets": ["y:1"], "labels": {"rack": "r1"}},
+                        {"targets": ["z:1"]},
+                    ],
+                },
+                JOBS[1],
+            ],
+            jobs,
+        )
+
+    def test_fully_quarantined_job_is_replaced(self):
+        jobs = quarantine(JOBS, {target_key("b", "x:1")}, "job")
+        self.assertEqual(["a", "b_quarantine"], [job["job_name"] for job in jobs])
+
+    def test_quarantine_label(self):
+        jobs = quarantine(JOBS, {target_key("a", "z:1")}, "label")
+        self.assertEqual(
+            [
+                {"targets": ["x:1", "y:1"], "labels": {"rack": "r1"}},
+                {"targets": ["z:1"], "labels": {"quarantined": "true"}},
+            ],
+            jobs[0]["static_configs"],
+        )
+        self.assertEqual(2, len(jobs))
@@ -0,0 +1,99 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from options import (
+    dropped_keys,
+    parse_duration,
+    parse_protocols,
+    parse_size,
+    scrape_options,
+)
+
+
+class TestParsers(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(0, parse_duration("0"))
+        self.assertEqual(90_000, parse_duration("1m30s"))
+        self.assertEqual(500, parse_duration("500ms"))
+        self.assertEqual(86_400_000 + 3_600_000, parse_duration("1d1h"))
+
+    def test_parse_invalid_duration(self):
+        for value in ("", "1", "1.5s", "30s1m", "1 m", "1M", 30, None):
+            with self.subTest(value=value):
+                self.assertRaises(ValueError, parse_duration, value)
+
+    def test_parse_size(self):
+        self.assertEqual(512, parse_size("512B"))
+        self.assertEqual(10 * 2**20, parse_size("10MB"))
+
+    def test_parse_invalid_size(self):
+        for value in ("", "10", "10mb", "1.5MB", "10 MB", "10MiB", 10):
+            with self.subTest(value=value):
+                self.assertRaises(ValueError, parse_size, value)
+
+    def test_parse_protocols(self):
+        self.assertEqual(
+            ["PrometheusProto", "PrometheusText0.0.4"],
+            parse_protocols(" PrometheusProto, PrometheusText0.0.4 "),
+        )
+        self.assertEqual(["OpenMetricsText1.0.0"], parse_protocols(["OpenMetricsText1.0.0"]))
+
+    def test_parse_invalid_protocols(self):
+        for value in ("", ",", [], "PrometheusText", "PrometheusProto,PrometheusProto", 1):
+            with self.subTest(value=value):
+                self.assertRaises(ValueError, parse_protocols, value)
+
+
+class TestScrapeOptions(unittest.TestCase):
+    def test_unset_options_are_omitted(self):
+        self.assertEqual(({}, []), scrape_options({"scrape_interval": "", "sample_limit": None}))
+
+    def test_valid_options(self):
+        config = {
+            "scrape_interval": "1m",
+            "scrape_timeout": "30s",
+            "sample_limit": 1000,
+            "label_limit": 0,
+        }
+        self.assertEqual(
+            (
+                {
+                    "scrape_interval": "1m",
+                    "scrape_timeout": "30s",
+                    "sample_limit": 1000,
+                },
+                [],
+            ),
+            scrape_options(config),
+        )
+
+    def test_timeout_must_not_exceed_interval(self):
+        _, errors = scrape_options({"scrape_interval": "30s", "scrape_timeout": "1m"})
+        self.assertEqual(
+            ["scrape_timeout: must not be greater than scrape_interval, 1m by default"], errors
+        )
+
+    def test_timeout_alone_must_not_exceed_default_interval(self):
+        self.assertEqual([], scrape_options({"scrape_timeout": "1m"})[1])
+        _, errors = scrape_options({"scrape_timeout": "90s"})
+        self.assertEqual(
+            ["scrape_timeout: must not be greater than scrape_interval, 1m by default"], errors
+        )
+
+    def test_all_errors_are_reported(self):
+        _, errors = scrape_options(
+            {"scrape_interval": "0", "sample_limit": -1, "label_limit": "lots"}
+        )
+        self.assertEqual(3, len(errors))
+
+
+class TestDroppedKeys(unittest.TestCase):
+    def test_keys_outside_the_consumer_allowlist(self):
+        jobs = [
+            {"job_name": "a", "static_configs": [], "sample_limit": 1, "honor_labels": True},
+            {"job_name": "b", "static_configs": [], "honor_timestamps": False},
+        ]
+        self.assertEqual(["honor_labels", "honor_timestamps"], dropped_keys(jobs))
+        self.assertEqual([], dropped_keys([{"job_name": "a", "static_configs": []}]))
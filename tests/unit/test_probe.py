@@ -0,0 +1,180 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import base64
+import socket
+import threading
+import time
+import typing
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from exporter import relabel_chain
+from probe import NOT_PROBED, ScrapeRequest, probe_jobs, split_host_port
+
+METRICS = b"# TYPE up gauge\nup 1\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802
+        if self.path.startswith("/slow"):
+            time.sleep(1)
+        if self.path.startswith("/auth"):
+            expected = "Basic " + base64.b64encode(b"user:pass").decode()
+            if self.headers.get("Authorization") != expected:
+                self.send_response(401)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+        if self.path.startswith("/trickle"):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(METRICS)))
+            self.end_headers()
+            self.wfile.flush()
+            time.sleep(1)
+            self.wfile.write(METRICS)
+            return
+        if self.path.startswith("/chunked"):
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in (METRICS[:5], METRICS[5:]):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        body = self.path.encode() if self.path.startswith("/echo") else METRICS
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up, as in the timeout test
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestProbe(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.target = "127.0.0.1:{}".format(self.server.server_address[1])
+
+    def _job(self, **options):
+        return dict(options, job_name="test", static_configs=[{"targets": [self.target]}])
+
+    def test_reachable_target(self):
+        (result,) = probe_jobs([self._job()])
+        self.assertTrue(result.up)
+        self.assertEqual(200, result.status)
+        self.assertEqual(len(METRICS), result.body_size)
+        self.assertIsNotNone(result.ttfb)
+        self.assertIsNotNone(result.latency)
+        self.assertLessEqual(typing.cast(float, result.ttfb), typing.cast(float, result.latency))
+        self.assertEqual("", result.error)
+
+    def test_chunked_body_size_excludes_framing(self):
+        (result,) = probe_jobs([self._job(metrics_path="/chunked")])
+        self.assertTrue(result.up)
+        self.assertEqual(len(METRICS), result.body_size)
+
+    def test_metrics_path_and_params_are_sent(self):
+        (result,) = probe_jobs(
+            [self._job(metrics_path="/echo", params={"match[]": ["up", "foo"]})]
+        )
+        self.assertEqual(len("/echo?match%5B%5D=up&match%5B%5D=foo"), result.body_size)
+
+    def test_devices_are_probed_through_the_exporter(self):
+        job = {
+            "job_name": "snmp",
+            "metrics_path": "/echo",
+            "params": {"module": ["if_mib"]},
+            "relabel_configs": relabel_chain(self.target),
+            "static_configs": [{"targets": ["10.0.0.1"]}],
+        }
+        (result,) = probe_jobs([job])
+        self.assertEqual("10.0.0.1", result.target)
+        self.assertEqual(len("/echo?module=if_mib&target=10.0.0.1"), result.body_size)
+
+    def test_basic_auth_is_sent(self):
+        (result,) = probe_jobs(
+            [self._job(metrics_path="/auth", basic_auth={"username": "user", "password": "pass"})]
+        )
+        self.assertEqual(200, result.status)
+        (result,) = probe_jobs([self._job(metrics_path="/auth")])
+        self.assertEqual(401, result.status)
+        self.assertFalse(result.up)
+
+    def test_timeout(self):
+        (result,) = probe_jobs([self._job(metrics_path="/slow")], timeout=0.2)
+        self.assertFalse(result.up)
+        self.assertIn("timeout", result.error)
+
+    def test_total_timeout(self):
+        """Test targets left when the time for all of them runs out are not reported down."""
+        job = {"static_configs": [{"targets": [self.target] * 3}], "metrics_path": "/slow"}
+        start = time.perf_counter()
+        results = probe_jobs([job], concurrency=1, timeout=5, total_timeout=1.5)
+        self.assertLess(time.perf_counter() - start, 2.5)
+        self.assertTrue(results[0].up)
+        self.assertEqual([NOT_PROBED] * 2, [result.error for result in results[1:]])
+        self.assertFalse(any(result.probed for result in results[1:]))
+
+    def test_headers_only(self):
+        """Test the body is not waited for when only the status and headers are wanted."""
+        (result,) = probe_jobs([self._job(metrics_path="/trickle")], timeout=0.5, read_body=False)
+        self.assertTrue(result.up)
+        self.assertEqual(0, result.body_size)
+        (result,) = probe_jobs([self._job(metrics_path="/trickle")], timeout=0.5)
+        self.assertIn("timeout", result.error)
+
+    def test_unreachable_target(self):
+        job = {"static_configs": [{"targets": ["127.0.0.1:{}".format(_closed_port())]}]}
+        (result,) = probe_jobs([job])
+        self.assertFalse(result.up)
+        self.assertIsNone(result.status)
+        self.assertTrue(result.error)
+
+    def test_many_targets_are_probed_concurrently(self):
+        job = {"static_configs": [{"targets": [self.target] * 20}], "metrics_path": "/slow"}
+        start = time.perf_counter()
+        results = probe_jobs([job], concurrency=20, timeout=5)
+        self.assertTrue(all(result.up for result in results))
+        self.assertLess(time.perf_counter() - start, 5)
+
+
+class TestScrapeRequest(unittest.TestCase):
+    def test_defaults(self):
+        request = ScrapeRequest({})
+        self.assertEqual("/metrics", request.path)
+        self.assertIsNone(request.ssl)
+
+    def test_https_uses_tls(self):
+        request = ScrapeRequest(
+            {"scheme": "https", "tls_config": {"insecure_skip_verify": True, "server_name": "x"}}
+        )
+        self.assertIsNotNone(request.ssl)
+        self.assertEqual("x", request.server_name)
+
+    def test_split_host_port(self):
+        self.assertEqual(("foo", 1234), split_host_port("foo:1234", 80))
+        self.assertEqual(("foo", 80), split_host_port("foo", 80))
+        self.assertEqual(("::1", 9100), split_host_port("[::1]:9100", 80))
+        self.assertEqual(("::1", 443), split_host_port("[::1]", 443))
@@ -0,0 +1,127 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import gzip
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from protocols import Decoder, DelimitedProtobuf, cheapest, compare_protocols
+
+TEXT = b"".join(b'requests_total{path="/%d"} 1\n' % i for i in range(200))
+
+
+def _varint(value: int) -> bytes:
+    encoded = b""
+    while value > 0x7F:
+        encoded += bytes([value & 0x7F | 0x80])
+        value >>= 7
+    return encoded + bytes([value])
+
+
+def _family(name: bytes, metrics: int) -> bytes:
+    """A MetricFamily with a name, a type and empty metrics, length-delimited."""
+    message = b"\x0a" + _varint(len(name)) + name + b"\x18\x00" + b"\x22\x00" * metrics
+    return _varint(len(message)) + message
+
+
+PROTOBUF = _family(b"requests_total", 200) + _family(b"up", 1)
+
+
+class ExpositionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # noqa: N802
+        if "protobuf" in self.headers.get("Accept", "") and self.path != "/text-only":
+            content_type = "application/vnd.google.protobuf; encoding=delimited"
+            body = PROTOBUF
+        else:
+            content_type = "text/plain; version=0.0.4"
+            body = TEXT
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDecoder(unittest.TestCase):
+    def test_protobuf_split_across_chunks(self):
+        parser = DelimitedProtobuf()
+        for i in range(0, len(PROTOBUF), 7):
+            parser.feed(PROTOBUF[i : i + 7])
+        parser.close()
+        self.assertEqual(2, parser.families)
+        self.assertEqual(201, parser.metrics)
+
+    def test_truncated_protobuf(self):
+        parser = DelimitedProtobuf()
+        parser.feed(PROTOBUF[:-1])
+        self.assertRaises(ValueError, parser.close)
+
+    def test_gzip_text(self):
+        decoder = Decoder()
+        decoder.start({"content-type": "text/plain", "content-encoding": "gzip"})
+        body = gzip.compress(TEXT)
+        decoder.feed(body[:10])
+        decoder.feed(body[10:])
+        decoder.close()
+        self.assertEqual(200, decoder.samples)
+        self.assertGreater(decoder.elapsed, 0)
+
+    def test_invalid_gzip(self):
+        decoder = Decoder()
+        decoder.start({"content-encoding": "gzip"})
+        self.assertRaises(ValueError, decoder.feed, b"not gzip")
+
+
+class TestCompareProtocols(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ExpositionHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.target = "127.0.0.1:{}".format(self.server.server_address[1])
+
+    def _job(self, **options):
+        return dict(options, job_name="test", static_configs=[{"targets": [self.target]}])
+
+    def test_every_protocol_and_encoding_is_measured(self):
+        measurements = compare_protocols([self._job()], ["PrometheusProto", "PrometheusText0.0.4"])
+        self.assertEqual(
+            [
+                ("PrometheusProto", "identity", len(PROTOBUF), 201),
+                ("PrometheusProto", "gzip", len(gzip.compress(PROTOBUF)), 201),
+                ("PrometheusText0.0.4", "identity", len(TEXT), 200),
+                ("PrometheusText0.0.4", "gzip", len(gzip.compress(TEXT)), 200),
+            ],
+            [(m["protocol"], m["encoding"], m["bytes"], m["samples"]) for m in measurements],
+        )
+        self.assertTrue(all(m["served"] for m in measurements))
+
+        (recommended,) = cheapest(measurements).values()
+        self.assertEqual(["PrometheusProto"], recommended["scrape_protocols"])
+        self.assertTrue(recommended["enable_compression"])
+
+    def test_protocol_the_target_does_not_serve_is_not_recommended(self):
+        measurements = compare_protocols(
+            [self._job(metrics_path="/text-only")], ["PrometheusProto", "PrometheusText0.0.4"]
+        )
+        self.assertFalse(measurements[0]["served"])
+        self.assertEqual(
+            ["PrometheusText0.0.4"], cheapest(measurements)["test"]["scrape_protocols"]
+        )
+
+    def test_failed_target_has_no_recommendation(self):
+        self.server.server_close()
+        self.server.shutdown()
+        measurements = compare_protocols([self._job()], ["PrometheusText0.0.4"], timeout=1)
+        self.assertTrue(all("error" in m for m in measurements))
+        self.assertEqual({}, cheapest(measurements))
@@ -0,0 +1,122 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import typing
+import unittest
+
+from relabel import compile_regex, drop_metrics_rule, split_patterns, validate_relabel_configs
+
+
+class TestCompileRegex(unittest.TestCase):
+    def test_regex_is_anchored(self):
+        regex = compile_regex("go_.*")
+        self.assertTrue(regex.match("go_goroutines"))
+        self.assertFalse(regex.match("x_go_goroutines"))
+        self.assertFalse(compile_regex("foo").match("foobar"))
+
+    def test_compiled_regexes_are_cached(self):
+        self.assertIs(compile_regex("cached_.*"), compile_regex("cached_.*"))
+
+    def test_non_re2_syntax_is_rejected(self):
+        for pattern in (r"(a)\1", "foo(?=bar)", "(?<!x)y", "(?>a)", "a++", r"a\Z", "(?P=n)"):
+            with self.subTest(pattern=pattern):
+                self.assertRaises(ValueError, compile_regex, pattern)
+
+    def test_invalid_regex_is_rejected(self):
+        self.assertRaises(ValueError, compile_regex, "foo(")
+
+    def test_re2_syntax_is_accepted(self):
+        for pattern in (
+            r"\d+\.\d+",
+            "(?i)foo",
+            "(?P<name>a)b",
+            "a{1,3}?",
+            r"\++",
+            "[*+]+",
+            "[]?+]",
+        ):
+            with self.subTest(pattern=pattern):
+                compile_regex(pattern)
+
+    def test_inline_flags_apply_to_the_rest_of_their_group(self):
+        regex = compile_regex("foo|(?i)bar")
+        self.assertTrue(regex.match("BaR"))
+        self.assertFalse(regex.match("FOO"))
+
+        regex = compile_regex("(x(?i)y|z)w")
+        self.assertTrue(regex.match("xYw"))
+        self.assertTrue(regex.match("Zw"))
+        self.assertFalse(regex.match("XYw"))
+        self.assertFalse(regex.match("zW"))
+
+
+class TestValidateRelabelConfigs(unittest.TestCase):
+    def test_valid_configs(self):
+        configs = [
+            {"source_labels": ["__name__"], "regex": "go_.*", "action": "drop"},
+            {"source_labels": ["a", "b"], "target_label": "c", "replacement": "$1"},
+            {"source_labels": ["__address__"], "target_label": "shard", "modulus": 4,
+             "action": "hashmod"},
+            {"regex": "tmp_.*", "action": "labeldrop"},
+            {"source_labels": ["a"], "target_label": "b", "action": "keepequal"},
+        ]  # fmt: skip
+        self.assertEqual([], validate_relabel_configs(configs))
+
+    def test_not_a_list(self):
+        self.assertEqual(
+            ["must be a list of relabel configs"], validate_relabel_configs({"action": "drop"})
+        )
+
+    def test_errors_are_reported_per_rule(self):
+        configs = [
+            {"action": "explode"},
+            {"action": "hashmod", "target_label": "x"},
+            {"action": "replace"},
+            {"source_labels": ["1bad"], "regex": "(a)\\1", "action": "drop"},
+            {"action": "labeldrop", "regex": "x", "target_label": "y"},
+            {"action": "drop", "extra": 1},
+            "drop",
+        ]
+        errors = validate_relabel_configs(configs)
+        for index in range(len(configs)):
+            self.assertTrue(any(e.startswith(f"rule {index}:") for e in errors), index)
+        self.assertEqual(8, len(errors))
+
+
+class TestSplitPatterns(unittest.TestCase):
+    def test_commas_inside_a_regex_are_kept(self):
+        self.assertEqual(
+            ["go_.{1,3}", "a(b,c)", "x[,]y", r"p\,q", "process_.*"],
+            split_patterns(r"go_.{1,3},a(b,c),x[,]y,p\,q,process_.*"),
+        )
+
+    def test_repetition_survives_into_the_drop_rule(self):
+        rule = drop_metrics_rule(split_patterns("go_.{1,3},up"))
+        self.assertIsNotNone(rule)
+        regex = compile_regex(typing.cast(dict, rule)["regex"])
+        self.assertTrue(regex.match("go_gc"))
+        self.assertFalse(regex.match("go_goroutines"))
+
+
+class TestDropMetricsRule(unittest.TestCase):
+    def test_patterns_are_combined_into_one_rule(self):
+        rule = drop_metrics_rule(["go_.*", " process_.*", ""])
+        self.assertEqual(
+            {"source_labels": ["__name__"], "regex": "(?:go_.*)|(?:process_.*)", "action": "drop"},
+            rule,
+        )
+        self.assertIsNotNone(rule)
+        regex = compile_regex(typing.cast(dict, rule)["regex"])
+        self.assertTrue(regex.match("process_cpu_seconds_total"))
+        self.assertFalse(regex.match("up"))
+
+    def test_single_pattern(self):
+        rule = drop_metrics_rule(["go_.*"])
+        self.assertIsNotNone(rule)
+        self.assertEqual("go_.*", typing.cast(dict, rule)["regex"])
+
+    def test_no_patterns(self):
+        self.assertIsNone(drop_metrics_rule(["", " "]))
+
+    def test_invalid_pattern(self):
+        self.assertRaises(ValueError, drop_metrics_rule, ["go_(.*"])
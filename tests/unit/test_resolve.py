@@ -0,0 +1,96 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+import resolve
+from probe import split_host_port
+from resolve import join_address, resolve_all, resolve_cached
+
+
+class StubResolver:
+    """Resolves hosts from a table, recording the lookups made."""
+
+    def __init__(self, table, delay=0.0):
+        self.table = table
+        self.delay = delay
+        self.lookups = []
+        self._lock = threading.Lock()
+
+    def __call__(self, host):
+        with self._lock:
+            self.lookups.append(host)
+        time.sleep(self.delay)
+        if host not in self.table:
+            raise OSError("unknown host {}".format(host))
+        return self.table[host]
+
+
+class TestAddresses(unittest.TestCase):
+    def test_split_and_join(self):
+        for address, parts in (
+            ("foo:9100", ("foo", 9100)),
+            ("foo", ("foo", 0)),
+            ("[::1]:9100", ("::1", 9100)),
+            ("[::1]", ("::1", 0)),
+        ):
+            with self.subTest(address=address):
+                self.assertEqual(parts, split_host_port(address, 0))
+                self.assertEqual(address, join_address(*parts))
+
+
+class TestResolveAll(unittest.TestCase):
+    def test_lookups_run_in_parallel(self):
+        table = {"host{}".format(i): ["10.0.0.{}".format(i)] for i in range(20)}
+        resolver = StubResolver(table, delay=0.2)
+        start = time.perf_counter()
+        resolved = resolve_all(list(resolver.table), resolver, concurrency=20)
+        self.assertLess(time.perf_counter() - start, 2)
+        self.assertEqual("10.0.0.7", resolved["host7"])
+
+    def test_ipv4_is_preferred_and_choice_is_stable(self):
+        resolver = StubResolver({"foo": ["2001:db8::1", "10.0.0.2", "10.0.0.1", "10.0.0.2"]})
+        self.assertEqual({"foo": "10.0.0.1"}, resolve_all(["foo"], resolver))
+
+    def test_failed_and_slow_lookups_resolve_to_nothing(self):
+        resolver = StubResolver({"slow": ["10.0.0.1"]}, delay=0.5)
+        self.assertEqual(
+            {"slow": "", "missing": ""}, resolve_all(["slow", "missing"], resolver, timeout=0.1)
+        )
+
+    def test_hanging_lookup_does_not_hold_up_exit(self):
+        """Test a lookup that never returns neither blocks the caller nor interpreter exit."""
+        script = (
+            "import threading; from resolve import resolve_all; "
+            "print(resolve_all(['hang'], lambda host: threading.Event().wait(), timeout=0.1))"
+        )
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(resolve.__file__))
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", script], env=env, capture_output=True, text=True, timeout=30
+        )
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertEqual("{'hang': ''}", result.stdout.strip())
+
+
+class TestResolveCached(unittest.TestCase):
+    def test_only_expired_entries_are_resolved(self):
+        resolver = StubResolver({"foo": ["10.0.0.1"], "bar": ["10.0.0.2"]})
+        cache = {"foo": ["10.0.0.9", 200.0], "bar": ["10.0.0.8", 50.0], "gone": ["10.0.0.7", 200]}
+
+        entries = resolve_cached(["foo", "bar"], cache, resolver, ttl=60, now=100)
+
+        self.assertEqual(["bar"], resolver.lookups)
+        self.assertEqual({"foo": ["10.0.0.9", 200.0], "bar": ["10.0.0.2", 160]}, entries)
+
+    def test_failures_are_cached(self):
+        resolver = StubResolver({})
+        entries = resolve_cached(["foo"], {}, resolver, ttl=60, now=100)
+        self.assertEqual({"foo": ["", 160]}, entries)
+        resolve_cached(["foo"], entries, resolver, ttl=60, now=150)
+        self.assertEqual(["foo"], resolver.lookups)
@@ -0,0 +1,200 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from targets import (
+    address_error,
+    expand,
+    group_by_labels,
+    is_pattern,
+    iter_targets_file,
+    parse_target,
+    split_targets,
+    validate_targets,
+)
+
+
+class TestTargetsFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = Path(self.tmpdir.name) / "targets.txt"
+
+    def test_comments_and_blank_lines_are_skipped(self):
+        self.path.write_text("# header\nfoo:1234\n\n   \n  bar:5678  \n#baz:1\n")
+        self.assertEqual(["foo:1234", "bar:5678"], list(iter_targets_file(self.path)))
+
+    def test_file_is_read_lazily(self):
+        self.path.write_text("foo:1234\nbar:5678\n")
+        targets = iter_targets_file(self.path)
+        self.assertEqual("foo:1234", next(targets))
+        self.assertEqual("bar:5678", next(targets))
+        self.assertRaises(StopIteration, next, targets)
+
+
+class TestTargetLabels(unittest.TestCase):
+    def test_commas_inside_label_sets_are_not_separators(self):
+        self.assertEqual(
+            ["foo:1{a=b,c=d}", "bar:2", "baz:3{e=f}"],
+            list(split_targets("foo:1{a=b,c=d},bar:2,baz:3{e=f}")),
+        )
+
+    def test_whitespace_around_entries_is_dropped(self):
+        self.assertEqual(["a:1", "b:2{c=d}"], list(split_targets("a:1, b:2{c=d} ")))
+
+    def test_parse_target_without_labels(self):
+        self.assertEqual(("foo:1234", {}), parse_target("foo:1234"))
+
+    def test_parse_target_with_labels(self):
+        self.assertEqual(
+            ("foo:1234", {"rack": "r1", "role": "db"}),
+            parse_target("foo:1234{rack=r1, role=db}"),
+        )
+
+    def test_parse_target_rejects_malformed_labels(self):
+        for entry in ("foo:1{rack}", "foo:1{rack=}", "foo:1{1rack=r1}", "foo:1{__address__=x}"):
+            with self.subTest(entry=entry):
+                self.assertRaises(ValueError, parse_target, entry)
+
+    def test_group_by_labels(self):
+        static_configs = group_by_labels(
+            {"a:1": {"x": "1"}, "b:1": {}, "c:1": {"x": "1"}, "d:1": {"y": "2"}}, {"y": "1"}
+        )
+        self.assertEqual(
+            [
+                {"targets": ["a:1", "c:1"], "labels": {"x": "1", "y": "1"}},
+                {"targets": ["b:1"], "labels": {"y": "1"}},
+                {"targets": ["d:1"], "labels": {"y": "2"}},
+            ],
+            static_configs,
+        )
+
+    def test_group_without_labels_has_no_labels_key(self):
+        self.assertEqual([{"targets": ["a:1", "b:1"]}], group_by_labels({"a:1": {}, "b:1": {}}))
+
+
+class TestExpand(unittest.TestCase):
+    def test_cidr(self):
+        self.assertEqual(["10.0.0.1:9100", "10.0.0.2:9100"], list(expand("10.0.0.0/30:9100")))
+        self.assertEqual(["10.0.0.1"], list(expand("10.0.0.1/32")))
+
+    def test_ipv6_cidr(self):
+        self.assertEqual(
+            ["[2001:db8::1]:9100", "[2001:db8::2]:9100", "[2001:db8::3]:9100"],
+            list(expand("[2001:db8::/126]:9100")),
+        )
+
+    def test_range_keeps_zero_padding(self):
+        self.assertEqual(
+            ["node08.dc1:9100", "node09.dc1:9100", "node10.dc1:9100"],
+            list(expand("node[08-10].dc1:9100")),
+        )
+        self.assertEqual(["n9", "n10"], list(expand("n[9-10]")))
+
+    def test_alternation_and_range_combine(self):
+        self.assertEqual(["r1-a:1", "r1-b:1", "r2-a:1", "r2-b:1"], list(expand("r[1-2]-{a,b}:1")))
+
+    def test_expansion_is_lazy(self):
+        addresses = expand("10.0.0.0/8:9100")
+        self.assertEqual("10.0.0.1:9100", next(addresses))
+
+    def test_invalid_patterns(self):
+        for address in ("10.0.0.0/33:9100", "foo/24:9100", "foo:1234/path"):
+            with self.subTest(address=address):
+                self.assertRaises(ValueError, lambda: list(expand(address)))
+        self.assertRaises(ValueError, lambda: list(expand("node[10-1]")))
+
+    def test_is_pattern(self):
+        self.assertTrue(is_pattern("10.0.0.0/24:1"))
+        self.assertTrue(is_pattern("node[1-2]:1"))
+        self.assertTrue(is_pattern("web{a,b}:1"))
+        self.assertFalse(is_pattern("[::1]:9100"))
+        self.assertFalse(is_pattern("foo:1"))
+        self.assertFalse(is_pattern("host:9100/metrics"))
+        self.assertFalse(is_pattern("[::1]:9100/metrics"))
+
+    def test_trailing_alternation_is_not_a_label_set(self):
+        self.assertEqual(("web{a,b}", {}), parse_target("web{a,b}"))
+        self.assertEqual(("web{a,b}:1", {"x": "y"}), parse_target("web{a,b}:1{x=y}"))
+
+
+class TestAddressError(unittest.TestCase):
+    def test_valid_addresses(self):
+        for address in (
+            "foo",
+            "foo:1234",
+            "node-1.example.com.:65535",
+            "host_1:9100",
+            "10.0.0.1:9100",
+            "[::1]:9100",
+            "[2001:db8::1]",
+            "[fe80::1%eth0]:9100",
+        ):
+            with self.subTest(address=address):
+                self.assertEqual("", address_error(address))
+
+    def test_invalid_addresses(self):
+        for address, reason in (
+            ("", "empty address"),
+            ("https://foo:1234", "must not include a scheme"),
+            ("foo:1234/metrics", "must not include a path or query"),
+            ("user@foo:1234", "must not include credentials; use basic_auth"),
+            ("foo:0", "port 0 out of range"),
+            ("foo:65536", "port 65536 out of range"),
+            ("foo:123456789", "port 123456789 out of range"),
+            ("foo:", "invalid port ''"),
+            ("foo:http", "invalid port 'http'"),
+            ("-foo:1234", "invalid hostname '-foo'"),
+            ("{}:1".format("a" * 64), "invalid hostname '{}'".format("a" * 64)),
+            (".".join(["a" * 63] * 4), "hostname longer than 253 characters"),
+            ("10.0.0.256:9100", "invalid IPv4 address"),
+            ("10.0.1:9100", "invalid IPv4 address"),
+            ("::1:9100", "IPv6 addresses must be enclosed in brackets"),
+            ("[::g]:9100", "invalid IPv6 address"),
+            ("[1::2::3]:9100", "invalid IPv6 address"),
+            ("[::1]9100", "invalid IPv6 address"),
+        ):
+            with self.subTest(address=address):
+                self.assertEqual(reason, address_error(address))
+
+
+class TestValidateTargets(unittest.TestCase):
+    def test_every_invalid_entry_is_reported(self):
+        report = validate_targets(
+            ["foo:1", "foo:0", "bar:1{rack}", "node[1-2]:99999", "10.0.0.0/33:1"], 100
+        )
+        self.assertEqual({}, report.targets)
+        self.assertEqual(
+            ["foo:0", "bar:1{rack}", "node1:99999", "node2:99999", "10.0.0.0/33:1"],
+            list(report.invalid),
+        )
+        self.assertEqual("port 0 out of range", report.invalid["foo:0"])
+
+    def test_path_is_not_taken_for_a_network(self):
+        report = validate_targets(["host:9100/metrics"], 100)
+        self.assertEqual({"host:9100/metrics": "must not include a path or query"}, report.invalid)
+
+    def test_duplicates_are_reported(self):
+        report = validate_targets(
+            ["foo:1", "foo:1{rack=r1}", "foo:1", "n{a,b}:1", "n{b,c}:1"], 100
+        )
+        self.assertEqual({"foo:1": {}, "na:1": {}, "nb:1": {}, "nc:1": {}}, report.targets)
+        self.assertEqual(["foo:1{rack=r1}", "foo:1", "nb:1"], report.duplicates)
+        self.assertEqual({}, report.invalid)
+
+    def test_explicit_entry_overrides_expanded_one(self):
+        report = validate_targets(["10.0.0.0/30:1", "10.0.0.1:1{x=y}"], 100)
+        self.assertEqual({"10.0.0.1:1": {"x": "y"}, "10.0.0.2:1": {}}, report.targets)
+        self.assertEqual([], report.duplicates)
+
+    def test_expansion_cap(self):
+        report = validate_targets(["10.0.0.0/24:1"], 10)
+        self.assertEqual({}, report.targets)
+        self.assertIn("exceeds max_expanded_targets (10)", report.error)
+
+    def test_address_checks_can_be_skipped(self):
+        report = validate_targets(["foo:0"], 10, check_addresses=False)
+        self.assertEqual({"foo:0": {}}, report.targets)
@@ -0,0 +1,71 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from telemetry import HookStats, recorded, status_message, summarize
+
+
+def _stats(version="1", duration_ms=10.0, payload_bytes=100, **fields):
+    values = {
+        "event": "config_changed",
+        "version": version,
+        "timestamp": 0.0,
+        "duration_ms": duration_ms,
+        "render_ms": 1.0,
+        "jobs": 1,
+        "valid_targets": 2,
+        "invalid_targets": 0,
+        "payload_bytes": payload_bytes,
+        "relation_writes": 1,
+        **fields,
+    }
+    return HookStats(**values)
+
+
+class TestHistory(unittest.TestCase):
+    def test_history_is_capped(self):
+        history = []
+        for duration in range(5):
+            history = recorded(history, _stats(duration_ms=duration), size=3)
+        self.assertEqual([2, 3, 4], [entry["duration_ms"] for entry in history])
+
+    def test_summary_per_version(self):
+        history = [
+            _stats("1", 10.0, 100).as_dict(),
+            _stats("1", 30.0, 300).as_dict(),
+            _stats("1", 20.0, 200).as_dict(),
+            _stats("2", 50.0, 100, relation_writes=0).as_dict(),
+        ]
+        self.assertEqual(
+            {
+                "1": {
+                    "hooks": 3,
+                    "median_duration_ms": 20.0,
+                    "max_duration_ms": 30.0,
+                    "max_payload_bytes": 300,
+                    "relation_writes": 3,
+                },
+                "2": {
+                    "hooks": 1,
+                    "median_duration_ms": 50.0,
+                    "max_duration_ms": 50.0,
+                    "max_payload_bytes": 100,
+                    "relation_writes": 0,
+                },
+            },
+            summarize(history),
+        )
+
+
+class TestStatusMessage(unittest.TestCase):
+    def test_status_message(self):
+        self.assertEqual("2 targets in 1 job; 100B payload", status_message(_stats()))
+        self.assertEqual(
+            "1 target in 3 jobs; 12.3kB payload",
+            status_message(_stats(valid_targets=1, jobs=3, payload_bytes=12345)),
+        )
+        self.assertEqual(
+            "0 targets in 0 jobs; 2.5MB payload",
+            status_message(_stats(valid_targets=0, jobs=0, payload_bytes=2_500_000)),
+        )
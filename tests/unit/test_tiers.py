@@ -0,0 +1,108 @@
+# Copyright 2021 Canonical Ltd.
+# See LICENSE file for licensing details.
+
+import unittest
+
+from health import target_key
+from tiers import Tier, parse_tiers, smoothed, tier_of, tiered
+
+TIERS = [
+    Tier("medium", "1m", "1m", latency=1.0),
+    Tier("heavy", "2m", "1m", size=10 * 1024**2),
+    Tier("slow", "5m", "2m", latency=10.0),
+]
+
+
+class TestParseTiers(unittest.TestCase):
+    def test_tiers_are_sorted_by_interval(self):
+        self.assertEqual(TIERS, parse_tiers("slow:10s:5m:2m, medium:1s:1m,heavy:10MB:2m:1m"))
+
+    def test_invalid_tiers(self):
+        for value in (
+            "slow",
+            "slow:10s",
+            "1slow:10s:5m",
+            "slow:often:5m",
+            "slow:10s:0",
+            "slow:10s:5m:10m",
+            "slow:10s:5m,slow:20s:10m",
+            "slow:10s:5m,heavy:10MB:5m",
+        ):
+            with self.subTest(value=value):
+                self.assertRaises(ValueError, parse_tiers, value)
+
+
+class TestTierOf(unittest.TestCase):
+    def test_slowest_tier_reached(self):
+        self.assertIsNone(tier_of([0.5, 1000], TIERS, None))
+        self.assertEqual("medium", tier_of([2.0, 1000], TIERS, None))
+        self.assertEqual("heavy", tier_of([2.0, 20_000_000], TIERS, None))
+        self.assertEqual("slow", tier_of([12.0, 20_000_000], TIERS, None))
+
+    def test_hysteresis(self):
+        """Test a target only leaves its tier once well under the tier's threshold."""
+        self.assertEqual("slow", tier_of([9.0, 0], TIERS, "slow"))
+        self.assertEqual("medium", tier_of([7.0, 0], TIERS, "slow"))
+        self.assertEqual("medium", tier_of([0.9, 0], TIERS, "medium"))
+        self.assertIsNone(tier_of([0.7, 0], TIERS, "medium"))
+        # moving to a slower tier takes reaching its full threshold
+        self.assertEqual("medium", tier_of([9.0, 0], TIERS, "medium"))
+
+    def test_smoothing(self):
+        self.assertEqual([2.0, 100], smoothed(None, 2.0, 100))
+        self.assertEqual([3.0, 150], smoothed([2.0, 100], 4.0, 200))
+
+
+class TestTiered(unittest.TestCase):
+    JOBS = [
+        {
+            "job_name": "a",
+            "scrape_interval": "15s",
+            "static_configs": [{"targets": ["x:1", "y:1", "z:1"], "labels": {"rack": "r1"}}],
+        },
+        {"job_name": "b", "static_configs": [{"targets": ["y:1"]}]},
+    ]
+
+    def test_no_tiers(self):
+        self.assertIs(self.JOBS, tiered(self.JOBS, {}, TIERS))
+
+    def test_targets_move_to_their_tier_job(self):
+        membership = {target_key("a", "y:1"): "slow", target_key("a", "z:1"): "medium"}
+        self.assertEqual(
+            [
+                {
+                    "job_name": "a",
+                    "scrape_interval": "15s",
+                    "static_configs": [{"targets": ["x:1"], "labels": {"rack": "r1"}}],
+                },
+                {
+                    "job_name": "a_medium",
+                    "scrape_interval": "1m",
+                    "scrape_timeout": "1m",
+                    "static_configs": [{"targets": ["z:1"], "labels": {"rack": "r1"}}],
+                },
+                {
+                    "job_name": "a_slow",
+                    "scrape_interval": "5m",
+                    "scrape_timeout": "2m",
+                    "static_configs": [{"targets": ["y:1"], "labels": {"rack": "r1"}}],
+                },
+                self.JOBS[1],
+            ],
+            tiered(self.JOBS, membership, TIERS),
+        )
+
+    def test_whole_job_in_one_tier(self):
+        membership = {target_key("b", "y:1"): "heavy"}
+        self.assertEqual(
+            [
+                self.JOBS[0],
+                {
+                    "job_name": "b_heavy",
+                    "scrape_interval": "2m",
+                    "scrape_timeout": "1m",
+                    "static_configs": [{"targets": ["y:1"]}],
+                },
+            ],
+            tiered(self.JOBS, membership, TIERS),
+        )